@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# Measures GUI frame-time jitter of Ultraviz while the SDK log is written at a
+# high rate, with log parsing on a reader thread (default) and in a worker process (-p).
+#
+# Usage (from this directory):
+#   $ python3 gui_jitter.py --rate=40000 --seconds=10
+# Each mode runs in its own interpreter, and a table of frame interval statistics is printed.
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import multiprocessing
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+def writeLog(pipe_name, rate, noise_ratio):
+    """Write synthetic control point lines (and noise lines) to the pipe at 'rate' lines/s"""
+    import math
+    fifo = os.open(pipe_name, os.O_WRONLY)
+    period = 0.001
+    start = time.monotonic()
+    sent = 0
+    while True:
+        due = int((time.monotonic() - start) * rate)
+        lines = []
+        for n in range(sent, due):
+            if noise_ratio and n % int(1 / noise_ratio) == 0:
+                lines.append("[INFO] Emitter update %d\n" % n)
+            t = n / rate
+            lines.append("[%.5f,%.5f,%.5f] intensity %.3f\n" % (0.02 * math.cos(400 * math.pi * t), 0.02 * math.sin(400 * math.pi * t), 0.2, 1.0))
+        sent = due
+        if lines:
+            os.write(fifo, "".join(lines).encode())
+        time.sleep(period)
+
+def runMode(parse_in_process, rate, seconds, noise_ratio):
+    import numpy as np
+    from PyQt5.QtWidgets import QApplication
+    from PyQt5.QtCore import QTimer
+    import Ultraviz
+
+    app = QApplication(sys.argv)
+    Ultraviz.app = app
+    window = Ultraviz.MainWindow(parse_in_process=parse_in_process)
+    window.show()
+
+    writer = multiprocessing.Process(target=writeLog, args=(window.logHandler.pipe_name, rate, noise_ratio))
+    writer.daemon = True
+    writer.start()
+
+    frames = []
+    window.viewer.painterThreadTimer.timeout.connect(lambda: frames.append(time.perf_counter()))
+
+    def finish():
+        writer.terminate()
+        if window.parseWorker:
+            window.stopPollingLogReaderThread()
+            window.parseWorker.stop()
+        intervals = np.diff(np.array(frames)) * 1000.0
+        # Skip the first second, while the window and pipe are starting up
+        intervals = intervals[np.array(frames[1:]) - frames[0] > 1.0]
+        print(json.dumps({'mode': 'process' if parse_in_process else 'thread',
+                          'rate': rate,
+                          'frames': int(len(intervals)),
+                          'mean_ms': float(intervals.mean()),
+                          'std_ms': float(intervals.std()),
+                          'p50_ms': float(np.percentile(intervals, 50)),
+                          'p99_ms': float(np.percentile(intervals, 99)),
+                          'max_ms': float(intervals.max())}))
+        sys.stdout.flush()
+        os._exit(0)
+
+    QTimer.singleShot(int(seconds * 1000), finish)
+    app.exec_()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-r', '--rate', type=int, default=40000, help='Control point lines written per second.')
+    parser.add_argument('-s', '--seconds', type=float, default=10.0, help='Duration of each run.')
+    parser.add_argument('-n', '--noise', type=float, default=0.1, help='Fraction of extra non control point lines.')
+    parser.add_argument('-p', '--parseProcess', action='store_true', help='Run a single mode, with the parse worker process.')
+    parser.add_argument('--single', action='store_true', help='Run a single mode in this interpreter, rather than comparing both.')
+    args = parser.parse_args()
+
+    if args.single:
+        runMode(args.parseProcess, args.rate, args.seconds, args.noise)
+        sys.exit(0)
+
+    results = []
+    for flags in ([], ['-p']):
+        out = subprocess.run([sys.executable, os.path.abspath(__file__), '--single', '-r', str(args.rate),
+                              '-s', str(args.seconds), '-n', str(args.noise)] + flags,
+                             stdout=subprocess.PIPE, universal_newlines=True)
+        lines = [line for line in out.stdout.splitlines() if line.startswith('{')]
+        if lines:
+            results.append(json.loads(lines[-1]))
+
+    print("%-8s %8s %8s %8s %8s %8s %8s" % ('mode', 'frames', 'mean', 'std', 'p50', 'p99', 'max'))
+    for r in results:
+        print("%-8s %8d %8.2f %8.2f %8.2f %8.2f %8.2f" % (r['mode'], r['frames'], r['mean_ms'], r['std_ms'],
+                                                         r['p50_ms'], r['p99_ms'], r['max_ms']))
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# Load test for the WebSocket server: serves synthetic control points on port 9000,
+# through the same server and broadcast code as Ultraviz, to hundreds of local clients.
+#
+# Usage (from this directory):
+#   $ python3 websocket_load.py --clients=200 --rate=2000 --seconds=10
+# The server runs in its own process, and the clients are shared between several
+# processes, each running them on an asyncio event loop. A summary of delivered
+# rates, latencies, drops (messages not received by the end of --drain) and
+# server CPU is printed.
+import os
+import sys
+import json
+import math
+import time
+import base64
+import struct
+import asyncio
+import argparse
+import threading
+import multiprocessing
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src')
+sys.path.insert(0, SRC_DIR)
+
+PORT = 9000
+# The server listens with a backlog of 5, so only connect a few clients at a time
+CONNECT_AT_ONCE = 4
+
+def runServer(conn, rate, seconds, batch):
+    """Serve 'rate' control points/s to every client, in batches of 'batch' points, once told to start"""
+    from websocket import createWebSocketServer, get_clients, encodePoints, broadcast
+    server = createWebSocketServer()
+    thread = threading.Thread(target=server.serveforever, name='websocket')
+    thread.daemon = True
+    thread.start()
+    conn.send('ready')
+
+    expected = conn.recv()
+    deadline = time.monotonic() + 30
+    while len(get_clients()) < expected and time.monotonic() < deadline:
+        time.sleep(0.01)
+    connected = len(get_clients())
+
+    cpuStart = time.process_time()
+    threadCpuStart = time.thread_time()
+    start = time.monotonic()
+    sent = 0
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= seconds:
+            break
+        due = int(elapsed * rate)
+        if due - sent < batch:
+            time.sleep(batch / float(rate) / 4)
+            continue
+        n = due - sent
+        phase = 2 * math.pi * (sent + 0.5 * n) / rate
+        points = [(0.2 * math.cos(phase), 0.2 * math.sin(phase), 2.0)] * n
+        # Each message carries the time it was sent, for latency
+        broadcast(encodePoints(points, [time.time()] * n))
+        sent += n
+    wall = time.monotonic() - start
+    backlog = [len(client.sendq) for client in list(get_clients())]
+    conn.send({'connected': connected,
+               'sent': sent,
+               'wall': wall,
+               'cpu': time.process_time() - cpuStart,
+               'generatorCpu': time.thread_time() - threadCpuStart,
+               'maxBacklog': max(backlog) if backlog else 0})
+    # Keep serving until the clients have drained what is queued for them
+    conn.recv()
+    server.close()
+
+async def openWebSocket(host, port):
+    reader, writer = await asyncio.open_connection(host, port)
+    key = base64.b64encode(os.urandom(16)).decode()
+    writer.write(("GET / HTTP/1.1\r\nHost: %s:%d\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                  "Sec-WebSocket-Key: %s\r\nSec-WebSocket-Version: 13\r\n\r\n" % (host, port, key)).encode())
+    await writer.drain()
+    response = await reader.readuntil(b"\r\n\r\n")
+    if b" 101 " not in response.split(b"\r\n", 1)[0]:
+        raise IOError("WebSocket handshake refused: " + response.split(b"\r\n", 1)[0].decode())
+    return reader, writer
+
+def parseFrames(buf):
+    """Split complete frames off the front of 'buf'. Returns ([(opcode, payload)], bytes used)"""
+    frames = []
+    pos = 0
+    size = len(buf)
+    while size - pos >= 2:
+        opcode = buf[pos] & 0x0F
+        length = buf[pos + 1] & 0x7F
+        masked = buf[pos + 1] & 0x80
+        head = 2
+        if length == 126:
+            if size - pos < 4:
+                break
+            length = struct.unpack_from('!H', buf, pos + 2)[0]
+            head = 4
+        elif length == 127:
+            if size - pos < 10:
+                break
+            length = struct.unpack_from('!Q', buf, pos + 2)[0]
+            head = 10
+        if masked:
+            head += 4
+        if size - pos < head + length:
+            break
+        frames.append((opcode, bytes(buf[pos + head:pos + head + length])))
+        pos += head + length
+    return frames, pos
+
+async def receive(reader, stats, sample_every):
+    """Count the text messages received, and the latency of every 'sample_every'th"""
+    buf = bytearray()
+    try:
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            now = time.time()
+            buf += data
+            frames, used = parseFrames(buf)
+            del buf[:used]
+            for opcode, payload in frames:
+                if opcode == 0x8:
+                    stats['closed'] = True
+                    return
+                if opcode != 0x1:
+                    continue
+                if stats['received'] % sample_every == 0:
+                    stats['latencies'].append(now - json.loads(payload)['t'])
+                stats['received'] += 1
+    except (ConnectionError, asyncio.IncompleteReadError):
+        pass
+    stats['closed'] = True
+
+async def clientGroup(first, count, host, port, sample_every, stop, results):
+    connections, stats = [], []
+    for i in range(0, count, CONNECT_AT_ONCE):
+        group = range(first + i, first + min(i + CONNECT_AT_ONCE, count))
+        connections += await asyncio.gather(*[openWebSocket(host, port) for _ in group])
+        stats += [{'client': c, 'received': 0, 'latencies': [], 'closed': False} for c in group]
+    tasks = [asyncio.ensure_future(receive(reader, s, sample_every)) for (reader, _), s in zip(connections, stats)]
+    results.put(('connected', count))
+    while not stop.is_set():
+        await asyncio.sleep(0.05)
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    for _, writer in connections:
+        writer.close()
+    results.put(('done', stats, time.process_time()))
+
+def runClients(first, count, host, port, sample_every, stop, results):
+    try:
+        asyncio.run(clientGroup(first, count, host, port, sample_every, stop, results))
+    except Exception as e:
+        results.put(('error', str(e)))
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return float('nan')
+    return values[min(int(p / 100.0 * len(values)), len(values) - 1)]
+
+def runLoadTest(clients, rate, seconds, batch, processes, drain, sample_every):
+    serverConn, conn = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=runServer, args=(conn, rate, seconds, batch))
+    server.start()
+    serverConn.recv()
+
+    # Share the clients between processes, so the clients aren't the bottleneck
+    processes = max(1, min(processes, clients))
+    stop = multiprocessing.Event()
+    results = multiprocessing.Queue()
+    workers = []
+    for p in range(processes):
+        first = clients * p // processes
+        count = clients * (p + 1) // processes - first
+        worker = multiprocessing.Process(target=runClients,
+                                         args=(first, count, 'localhost', PORT, sample_every, stop, results))
+        worker.start()
+        workers.append(worker)
+    for _ in workers:
+        message = results.get()
+        if message[0] == 'error':
+            raise IOError("Client failed to connect: " + message[1])
+
+    serverConn.send(clients)
+    report = serverConn.recv()
+    time.sleep(drain)
+    stop.set()
+    stats, clientCpu = [], 0.0
+    for _ in workers:
+        message = results.get()
+        if message[0] == 'error':
+            raise IOError("Client failed: " + message[1])
+        stats += message[1]
+        clientCpu += message[2]
+    serverConn.send('stop')
+    for worker in workers:
+        worker.join()
+    server.join()
+
+    latencies = [latency for s in stats for latency in s['latencies']]
+    perClient = []
+    for s in sorted(stats, key=lambda s: s['client']):
+        perClient.append({'client': s['client'],
+                          'rate': s['received'] / report['wall'],
+                          'dropped': report['sent'] - s['received'],
+                          'p50_ms': percentile(s['latencies'], 50) * 1000,
+                          'p99_ms': percentile(s['latencies'], 99) * 1000,
+                          'closed': s['closed']})
+    rates = sorted(c['rate'] for c in perClient)
+    return {'clients': clients,
+            'connected': report['connected'],
+            'rate': rate,
+            'seconds': report['wall'],
+            'sent_per_client': report['sent'],
+            'delivered_min': rates[0],
+            'delivered_median': rates[len(rates) // 2],
+            'delivered_max': rates[-1],
+            'dropped': sum(c['dropped'] for c in perClient),
+            'disconnected': sum(1 for c in perClient if c['closed']),
+            'max_backlog': report['maxBacklog'],
+            'latency_p50_ms': percentile(latencies, 50) * 1000,
+            'latency_p90_ms': percentile(latencies, 90) * 1000,
+            'latency_p99_ms': percentile(latencies, 99) * 1000,
+            'latency_max_ms': max(latencies) * 1000 if latencies else float('nan'),
+            'server_cpu_percent': 100.0 * report['cpu'] / report['wall'],
+            'generator_cpu_percent': 100.0 * report['generatorCpu'] / report['wall'],
+            'client_cpu_seconds': clientCpu,
+            'per_client': perClient}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--clients', type=int, default=200, help='Number of WebSocket clients (select() limits the server to fewer than 1000).')
+    parser.add_argument('-r', '--rate', type=int, default=2000, help='Control points served per second.')
+    parser.add_argument('-s', '--seconds', type=float, default=10.0, help='Duration of the run.')
+    parser.add_argument('-b', '--batch', type=int, default=20, help='Control points per broadcast, as parsed batches arrive.')
+    parser.add_argument('-p', '--processes', type=int, default=multiprocessing.cpu_count(), help='Processes to share the clients between.')
+    parser.add_argument('-d', '--drain', type=float, default=2.0, help='Seconds to keep receiving after the server stops sending.')
+    parser.add_argument('--sampleEvery', type=int, default=10, help='Measure the latency of every Nth message per client.')
+    parser.add_argument('--perClient', action='store_true', help='Also print a row for every client.')
+    parser.add_argument('--json', required=False, help='Also write the results to this JSON file.')
+    args = parser.parse_args()
+
+    r = runLoadTest(args.clients, args.rate, args.seconds, args.batch, args.processes, args.drain, args.sampleEvery)
+
+    print("Clients:          %d (%d connected to the server)" % (r['clients'], r['connected']))
+    print("Sent per client:  %d messages in %.1f s (%d/s of %d/s asked for)" % (r['sent_per_client'], r['seconds'],
+                                                                          r['sent_per_client'] / r['seconds'], r['rate']))
+    print("Delivered rate:   min %.0f/s, median %.0f/s, max %.0f/s" % (r['delivered_min'], r['delivered_median'], r['delivered_max']))
+    print("Dropped:          %d messages not delivered within the drain time, %d clients disconnected" % (r['dropped'], r['disconnected']))
+    print("Server backlog:   %d messages queued for the slowest client" % r['max_backlog'])
+    print("Latency:          p50 %.2f ms, p90 %.2f ms, p99 %.2f ms, max %.2f ms" % (r['latency_p50_ms'], r['latency_p90_ms'],
+                                                                              r['latency_p99_ms'], r['latency_max_ms']))
+    print("Server CPU:       %.0f%% (generator thread %.0f%%)" % (r['server_cpu_percent'], r['generator_cpu_percent']))
+    print("Client CPU:       %.1f s" % r['client_cpu_seconds'])
+    if args.perClient:
+        print("%-8s %10s %10s %10s %10s" % ('client', 'rate', 'dropped', 'p50', 'p99'))
+        for c in r['per_client']:
+            print("%-8d %10.0f %10d %10.2f %10.2f" % (c['client'], c['rate'], c['dropped'], c['p50_ms'], c['p99_ms']))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(r, f, indent=2)
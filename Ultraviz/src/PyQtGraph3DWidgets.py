@@ -12,23 +12,152 @@ Based on GLScatterPlotItem.py example from PyQtGraph
 License: MIT
 ----------------------------------------------------------
 """
-from PyQt5 import QtCore, Qt
+import inspect
+from contextlib import contextmanager
+from PyQt5 import QtCore, QtGui, QtWidgets, Qt
 import pyqtgraph.opengl as gl
 import numpy as np
 import pyqtgraph as pg
+from OpenGL.GL import *
+from OpenGL.arrays import vbo
 from atom.api import Atom, Float, Value, observe, Coerced, Int, Typed
 
 #: Cyclic guard flags
 VIEW_SYNC_FLAG = 0x1
 PLOT_CHANGE_FLAG = 0x2
 
+#: Before pyqtgraph 0.13, paintGL(region, viewport) drew the scene and the
+#: viewport came from opts. Since then paintGL() takes no arguments, the
+#: scene is drawn by paint(region=, viewport=), and scatter plots keep their
+#: own vertex buffers.
+LEGACY_PAINT = 'viewport' in inspect.signature(gl.GLViewWidget.paintGL).parameters
+
 class MyGLViewWidget(gl.GLViewWidget):
     """ Override GLViewWidget with enhanced behavior and Atom integration.
     
     """
     #: Fired in update() method to synchronize listeners.
     sigUpdate = QtCore.pyqtSignal()
-    
+
+    #: Cameras drawn next to the interactive one in a split layout, as
+    #: dicts of elevation/azimuth. Empty for a single view.
+    splitCameras = []
+
+    def splitViewports(self):
+        """ The (x, y, w, h) viewport of each camera, interactive camera first.
+
+        Viewports are in GL window coordinates, with y up.
+        """
+        x0, y0, w, h = self.getViewport()
+        w2, h2 = w // 2, h // 2
+        return [(x0, y0 + h2, w2, h - h2), (x0 + w2, y0 + h2, w - w2, h - h2),
+                (x0, y0, w2, h2), (x0 + w2, y0, w - w2, h2)][:len(self.splitCameras) + 1]
+
+    @contextmanager
+    def viewingFrom(self, camera, vp):
+        """ Temporarily look through 'camera' into viewport 'vp'.
+        
+        """
+        keys = ('elevation', 'azimuth', 'viewport') if LEGACY_PAINT else ('elevation', 'azimuth')
+        saved = {key: self.opts[key] for key in keys}
+        self.opts.update(camera)
+        # Before 0.13, the viewport in opts sets the aspect ratio of the projection
+        if LEGACY_PAINT:
+            self.opts['viewport'] = vp
+        try:
+            yield
+        finally:
+            self.opts.update(saved)
+
+    def paintGL(self, region=None, viewport=None, useItemNames=False):
+        """ Draw each camera into its own part of the widget.
+
+        All viewports share this GL context and its items, so the point data
+        is uploaded once per frame however many views there are.
+        """
+        if not LEGACY_PAINT:
+            # Calls paint() for the whole widget
+            return super(MyGLViewWidget, self).paintGL()
+        if not self.splitCameras or viewport is not None:
+            return super(MyGLViewWidget, self).paintGL(region=region, viewport=viewport, useItemNames=useItemNames)
+        glEnable(GL_SCISSOR_TEST)
+        try:
+            for camera, vp in zip([{}] + self.splitCameras, self.splitViewports()):
+                with self.viewingFrom(camera, vp):
+                    glScissor(*vp)
+                    super(MyGLViewWidget, self).paintGL(region=vp, viewport=vp, useItemNames=useItemNames)
+        finally:
+            glDisable(GL_SCISSOR_TEST)
+
+    def paint(self, *, region, viewport, useItemNames=False):
+        """ As paintGL, for pyqtgraph 0.13 and later.
+
+        Only a paint of the whole widget is split; renderToArray and itemsAt
+        draw regions of it through the interactive camera.
+        """
+        full = tuple(self.getViewport())
+        if not self.splitCameras or tuple(region) != full or tuple(viewport) != full:
+            return super(MyGLViewWidget, self).paint(region=region, viewport=viewport, useItemNames=useItemNames)
+        glEnable(GL_SCISSOR_TEST)
+        try:
+            for camera, vp in zip([{}] + self.splitCameras, self.splitViewports()):
+                with self.viewingFrom(camera, vp):
+                    glViewport(*vp)
+                    glScissor(*vp)
+                    super(MyGLViewWidget, self).paint(region=vp, viewport=vp, useItemNames=useItemNames)
+        finally:
+            glDisable(GL_SCISSOR_TEST)
+            glViewport(*full)
+
+    def rayAt(self, pos):
+        """ The world space ray under widget position 'pos'.
+
+        Returns (origin, direction, pixel angle), where the pixel angle is the
+        width of one pixel per unit of distance from the camera.
+        """
+        full = self.getViewport()
+        scale = full[2] / float(super(MyGLViewWidget, self).width())
+        x = pos.x() * scale
+        y = full[3] - pos.y() * scale
+        camera, vp = {}, full
+        if self.splitCameras:
+            for camera, vp in zip([{}] + self.splitCameras, self.splitViewports()):
+                if vp[0] <= x < vp[0] + vp[2] and vp[1] <= y < vp[1] + vp[3]:
+                    break
+        with self.viewingFrom(camera, vp):
+            # Before pyqtgraph 0.13 the viewport came from opts
+            projection = self.projectionMatrix(region=vp) if LEGACY_PAINT else self.projectionMatrix(vp, vp)
+            inverse, invertible = (projection * self.viewMatrix()).inverted()
+        nx = 2.0 * (x - vp[0]) / vp[2] - 1.0
+        ny = 2.0 * (y - vp[1]) / vp[3] - 1.0
+        near = inverse.map(QtGui.QVector4D(nx, ny, -1.0, 1.0))
+        far = inverse.map(QtGui.QVector4D(nx, ny, 1.0, 1.0))
+        near = np.array([near.x(), near.y(), near.z()]) / near.w()
+        far = np.array([far.x(), far.y(), far.z()]) / far.w()
+        pixelAngle = 2.0 * np.tan(np.radians(self.opts['fov']) / 2.0) / vp[2]
+        return near, far - near, pixelAngle
+
+    def pickAt(self, pos, clicked=False):
+        """ Show the sample under 'pos' in a tooltip, and print it when clicked.
+        
+        """
+        if not hasattr(self.parent(), 'pickSample'):
+            return
+        sample = self.parent().pickSample(*self.rayAt(pos))
+        if sample is None:
+            QtWidgets.QToolTip.hideText()
+            return
+        text = ("Control point %(controlPoint)d\n"
+                "X %(x).4f  Y %(y).4f  Z %(z).4f\n"
+                "Intensity %(intensity).3f\n"
+                "Time %(time).6f s (%(age).1f ms ago)" % sample)
+        QtWidgets.QToolTip.showText(self.mapToGlobal(pos), text, self)
+        if clicked:
+            print(text.replace("\n", ", "))
+
+    def hoverPick(self):
+        self.pickAt(self._hoverPos)
+
     def mousePressEvent(self, ev):
         """ Store the position of the mouse press for later use.
         
@@ -44,7 +173,7 @@ class MyGLViewWidget(gl.GLViewWidget):
         super(MyGLViewWidget, self).mouseReleaseEvent(ev)
         if self._downpos == ev.pos():
             if ev.button() == 2:
-                print('show context menu')
+                self.pickAt(ev.pos(), clicked=True)
             elif ev.button() == 1:
                 x = ev.pos().x() - self.width() / 2
                 y = ev.pos().y() - self.height() / 2
@@ -63,6 +192,22 @@ class MyGLViewWidget(gl.GLViewWidget):
         if ev.key() == 84:
             print(str(self.parent().scene3D.setCameraPresetByName("TOP")))
 
+        # F-key for "FRONT"
+        if ev.key() == 70:
+            print(str(self.parent().scene3D.setCameraPresetByName("FRONT")))
+
+        # S-key for "SIDE"
+        if ev.key() == 83:
+            print(str(self.parent().scene3D.setCameraPresetByName("SIDE")))
+
+        # V-key to toggle the split view
+        if ev.key() == 86:
+            self.parent().scene3D.setSplitView(not self.splitCameras)
+
+        # C-key to cycle the colour mode
+        if ev.key() == 67:
+            print("Colour mode: " + self.parent().cycleColorMode())
+
     def width(self):
         return super().width() * self.devicePixelRatio()
 
@@ -97,8 +242,110 @@ class MyGLViewWidget(gl.GLViewWidget):
             self._prev_pan_pos = pos
         else:
             super(MyGLViewWidget, self).mouseMoveEvent(ev)
+            if ev.buttons() == QtCore.Qt.NoButton:
+                # Pick at most once per frame or so while hovering
+                if not hasattr(self, '_hoverTimer'):
+                    self._hoverTimer = QtCore.QTimer()
+                    self._hoverTimer.setSingleShot(True)
+                    self._hoverTimer.timeout.connect(self.hoverPick)
+                self._hoverPos = ev.pos()
+                if not self._hoverTimer.isActive():
+                    self._hoverTimer.start(30)
         
 
+class SharedScatterPlotItem(gl.GLScatterPlotItem):
+    """ A GLScatterPlotItem which draws from vertex buffers.
+
+    Point data is uploaded once after each setData, and every viewport
+    drawing the item reuses the same buffers.
+    """
+    def __init__(self, **kwds):
+        self._buffers = None
+        self._dirty = True
+        self._count = 0
+        super(SharedScatterPlotItem, self).__init__(**kwds)
+
+    def setData(self, **kwds):
+        super(SharedScatterPlotItem, self).setData(**kwds)
+        self._dirty = True
+
+    def _upload(self):
+        """ Hand the latest arrays to the buffers, which copy them on their next bind.
+        
+        """
+        if self._buffers is None:
+            self._buffers = {name: vbo.VBO(np.zeros((1, 4), dtype=np.float32)) for name in ('pos', 'color', 'size')}
+        pos = np.ascontiguousarray(self.pos, dtype=np.float32).reshape(-1, 3)
+        self._count = len(pos)
+        self._buffers['pos'].set_array(pos)
+        if isinstance(self.color, np.ndarray):
+            self._buffers['color'].set_array(np.ascontiguousarray(self.color, dtype=np.float32).reshape(-1, 4))
+        if isinstance(self.size, np.ndarray):
+            # The vertex shader takes each point's size from its normal's x
+            norm = np.zeros((self._count, 3), dtype=np.float32)
+            norm[:, 0] = self.size
+            self._buffers['size'].set_array(norm)
+        self._dirty = False
+
+    def paint(self):
+        # From pyqtgraph 0.13 the base class already draws from vertex
+        # buffers, which are only refilled after setData
+        if not LEGACY_PAINT or not self.pxMode or isinstance(self.color, QtGui.QColor):
+            return super(SharedScatterPlotItem, self).paint()
+        if self._dirty:
+            self._upload()
+        if self._count == 0:
+            return
+
+        self.setupGLState()
+        glEnable(GL_POINT_SPRITE)
+        glActiveTexture(GL_TEXTURE0)
+        glEnable(GL_TEXTURE_2D)
+        glBindTexture(GL_TEXTURE_2D, self.pointTexture)
+        glTexEnvi(GL_POINT_SPRITE, GL_COORD_REPLACE, GL_TRUE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MIN_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_MAG_FILTER, GL_LINEAR)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_S, GL_CLAMP_TO_EDGE)
+        glTexParameteri(GL_TEXTURE_2D, GL_TEXTURE_WRAP_T, GL_CLAMP_TO_EDGE)
+        glEnable(GL_PROGRAM_POINT_SIZE)
+
+        bound = []
+        with self.shader:
+            glEnableClientState(GL_VERTEX_ARRAY)
+            try:
+                buf = self._buffers['pos']
+                buf.bind()
+                bound.append(buf)
+                glVertexPointer(3, GL_FLOAT, 0, buf)
+
+                if isinstance(self.color, np.ndarray):
+                    glEnableClientState(GL_COLOR_ARRAY)
+                    buf = self._buffers['color']
+                    buf.bind()
+                    bound.append(buf)
+                    glColorPointer(4, GL_FLOAT, 0, buf)
+                else:
+                    glColor4f(*self.color)
+
+                if isinstance(self.size, np.ndarray):
+                    glEnableClientState(GL_NORMAL_ARRAY)
+                    buf = self._buffers['size']
+                    buf.bind()
+                    bound.append(buf)
+                    glNormalPointer(GL_FLOAT, 0, buf)
+                else:
+                    glNormal3f(self.size, 0, 0)
+
+                glDrawArrays(GL_POINTS, 0, self._count)
+            finally:
+                for buf in bound:
+                    buf.unbind()
+                glDisableClientState(GL_NORMAL_ARRAY)
+                glDisableClientState(GL_VERTEX_ARRAY)
+                glDisableClientState(GL_COLOR_ARRAY)
+                glDisable(GL_TEXTURE_2D)
+
+
 class Scatter3DPlot(Atom):
     """ A Scatter3D Point Manager.
 
@@ -117,19 +364,63 @@ class Scatter3DPlot(Atom):
     
      #: GLScatterPlotIem instance.
     _plot = Value()
+
+    #: Changes held back until the outermost batch ends, by attribute name.
+    _pending = Typed(dict, ())
+
+    #: Depth of nested batch() blocks.
+    _batch_depth = Int(0)
     
     def _default__plot(self):
         """ Create a GLScatterPlot item with our current attributes.
         
         """
-        return gl.GLScatterPlotItem(pos=self.pos, color=self.color, 
-                                    size=self.size)
+        return SharedScatterPlotItem(pos=self.pos, color=self.color,
+                                     size=self.size)
     
+    @contextmanager
+    def batch(self):
+        """ Coalesce changes to point properties into one setData.
+
+        Changes made inside the block reach the GLScatterPlot object together
+        when the outermost block ends.
+        """
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                self.flush()
+
+    def flush(self):
+        """ Pass any pending changes to the GLScatterPlot object.
+        
+        """
+        if self._pending:
+            kwargs, self._pending = self._pending, {}
+            self._plot.setData(**kwargs)
+
+    def setData(self, **kwargs):
+        """ Set several point properties at once, e.g. once per frame.
+
+        Notifications are suppressed while assigning, which also skips atom's
+        comparison of each old and new array.
+        """
+        with self.batch():
+            with self.suppress_notifications():
+                for (name, value) in kwargs.items():
+                    setattr(self, name, value)
+            self._pending.update(kwargs)
+
     @observe('color', 'pos', 'size')
     def _plot_change(self, change):
         """ Pass changes to point properties to the GLScatterPlot object.
         
-        """        
+        """
+        if self._batch_depth:
+            self._pending[change['name']] = change['value']
+            return
         kwargs = {change['name']: change['value']}
         self._plot.setData(**kwargs)
 
@@ -168,6 +459,9 @@ class Scatter3DScene(Atom):
     
     #: GLAxisItem instance.
     _orientation_axes = Value()
+
+    #: Scatter3DPlot of a reference capture, drawn under the live points.
+    reference = Value()
     
     #: Cyclic notification guard flags.
     _guard = Int(0)
@@ -188,14 +482,30 @@ class Scatter3DScene(Atom):
                               'distance'   : 7.,
                               'fov'        : 60.,
                               'elevation'  : 90.,
-                              'azimuth'    : -90.0}
+                              'azimuth'    : -90.0},
+                     'FRONT': {'center'    : pg.Vector(0, 0, 0),
+                              'distance'   : 7.,
+                              'fov'        : 60.,
+                              'elevation'  : 0.,
+                              'azimuth'    : -90.0},
+                     'SIDE': {'center'     : pg.Vector(0, 0, 0),
+                              'distance'   : 7.,
+                              'fov'        : 60.,
+                              'elevation'  : 0.,
+                              'azimuth'    : 0.0}
                     }
+
+    # Drawn around the interactive camera in the split view. These share its
+    # center and distance, so panning or zooming any view moves them all.
+    SPLIT_VIEW_PRESETS = ('TOP', 'FRONT', 'SIDE')
     
     def _default__widget(self, parent=None):
         """ Create a GLViewWidget and add plot, grid, and orientation axes.
         
         """
         w = MyGLViewWidget(parent)
+        # Hovering over a sample shows its details
+        w.setMouseTracking(True)
         g = gl.GLGridItem()
         g.setSize(x=5,y=5,z=0.2)
         g.setSpacing(x=0.25,y=0.25,z=1)
@@ -249,6 +559,33 @@ class Scatter3DScene(Atom):
                 self.elevation = preset['elevation']
                 self.azimuth = preset['azimuth']
     
+    def setReference(self, pos, color=(0.6, 0.6, 0.6, 0.3), size=3):
+        """ Draw a fixed set of points, such as a reference capture, alongside the plot.
+        
+        """
+        if self.reference is None:
+            self.reference = Scatter3DPlot(pos=pos, color=color, size=size)
+            self._widget.addItem(self.reference._plot)
+        else:
+            self.reference.setData(pos=pos, color=color, size=size)
+
+    def clearReference(self):
+        if self.reference is not None:
+            self._widget.removeItem(self.reference._plot)
+            self.reference = None
+
+    def setSplitView(self, enabled):
+        """ Show the interactive camera alone, or alongside the top, front and side views.
+        
+        """
+        cameras = []
+        if enabled:
+            for name in self.SPLIT_VIEW_PRESETS:
+                preset = self.CAMERA_PRESETS[name]
+                cameras.append({'elevation': preset['elevation'], 'azimuth': preset['azimuth']})
+        self._widget.splitCameras = cameras
+        self._widget.update()
+
     def _update_model(self):
         """ Synchronize view attributes to the model.
         
@@ -256,7 +593,10 @@ class Scatter3DScene(Atom):
         if self._guard & PLOT_CHANGE_FLAG:
             return
         self._guard &= VIEW_SYNC_FLAG
+        members = self.members()
         for (key, value) in self._widget.opts.items():
-            setattr(self, key, value)
+            # Newer pyqtgraph versions keep more in opts, e.g. rotationMethod
+            if key in members:
+                setattr(self, key, value)
 
         self._guard &= ~VIEW_SYNC_FLAG
\ No newline at end of file
@@ -9,12 +9,12 @@
 # On Windows, pywin32 is also required.
 import sys
 import os
-import re
 import threading
+import time
 import argparse
 import platform
 from subprocess import Popen
-import json
+import multiprocessing
 
 # To apply dark style and modern window appearance
 import qtmodern
@@ -27,15 +27,35 @@ setupPyInstallerBuild()
 IS_WINDOWS = platform.system().lower() == "windows"
 IS_UNIX = platform.system().lower() in ("darwin", "linux", "mac")
 
+# UDP senders never disconnect, so their parsers are dropped after this long without data
+SOURCE_IDLE_SECONDS = 60.0
+
 from log_handler import SDKLogPipeHandler
 from bookmarks import BookmarksManager
 from ui import UHSDKLogViewer
-from websocket import createWebSocketServer, get_clients, socketIsOpen
+from colormaps import COLOR_MODES, COLORMAP_ANCHORS
+from scope import ScopeWidget
+from spectrum import SpectrumWidget, ControlPointSpectra
+from network import LogIngestServer, DEFAULT_PORT as LOG_INGEST_PORT
+from shm_ring import SharedMemoryRingWriter, DEFAULT_NAME as SHM_DEFAULT_NAME
+from parse_worker import ParseWorker
+from transform import CoordinateTransform, TRANSFORM_PRESETS
+from metrics import MetricsRegistry
+from profiling import Profiler
+from compare import SessionComparison
+from capture import loadCapture
+from triggers import TriggerCapture, parseTrigger
+from filters import FilterChain, parseFilter
+from bus import StreamBus, ParsedBatch
+from log_store import LogStore
+from segment_store import SegmentedLogWriter
+from log_panel import LogPanel
+from websocket import createWebSocketServer, get_clients, socketIsOpen, encodePoints, broadcast
 
 try:
     from PyQt5.QtWidgets import *
     from PyQt5.QtGui import QIcon
-    from PyQt5.QtCore import Qt
+    from PyQt5.QtCore import Qt, QTimer
 except Exception as e:
     print("Exception on thirdparty import: " + str(e))
     if IS_WINDOWS:
@@ -47,12 +67,45 @@ except Exception as e:
 import resources
 
 class MainWindow(QMainWindow):
-    def __init__(self, exe_path=None, auto_launch=True, parent = None):
+    def __init__(self, exe_path=None, auto_launch=True, window_ms=None, buffer_size=512, trigger_capture=None,
+                 listen_port=None, listen_udp=False, shm_name=None, parse_in_process=False,
+                 color_mode='intensity', colormap='white', transform=None, metrics_port=None, profiler=None, split_view=False, reference_path=None,
+                 filter_chain=None, websocket_stream='filtered', log_memory_mb=256, segment_options=None, lossless=False, parent = None):
         super(MainWindow, self).__init__(parent)
 
+        # Device to world transform, applied to each batch before it is viewed or served
+        self.transform = transform if transform else CoordinateTransform.fromPreset('default')
+
+        # An optional TriggerCapture, which keeps samples around glitches
+        self.triggerCapture = trigger_capture
+
+        # An optional Profiler (--profile), which profiles the reader and WebSocket threads
+        self.profiler = profiler
+
+        # An optional SessionComparison of live samples against a reference capture
+        self.comparison = None
+
+        # An optional FilterChain, smoothing control point positions after parsing.
+        # The 3D view shows the filtered stream unless showRaw is set, and the
+        # WebSocket serves 'filtered', 'raw' or 'both' streams.
+        self.filterChain = filter_chain
+        self.showRaw = False
+        self.webSocketStream = websocket_stream
+
         self.log_reader_thread = None
         self.executable_process = None
 
+        # The SDK log text, kept for the searchable Log panel
+        self.logStore = LogStore(max_bytes=int(log_memory_mb * 1024 * 1024))
+        self.logStore.startIndexer()
+
+        # Optionally, SegmentedLogWriter arguments to also keep the raw log text
+        # on disk. A ParseWorker writes the segments itself when parsing in a process.
+        self.segmentOptions = segment_options
+        self.segmentWriter = None
+        if segment_options and not parse_in_process:
+            self.segmentWriter = SegmentedLogWriter(**segment_options)
+
         # An Optional WebSocket, to serve control point data
         self.webSocket = None
         self.webSocketActive = False
@@ -60,6 +113,34 @@ class MainWindow(QMainWindow):
         self.processingSDKLog = False
         self.my_env = None
 
+        # If True, the log is read and parsed in a ParseWorker process
+        self.parseInProcess = parse_in_process
+        self.parseWorker = None
+
+        # Log data may arrive from the local pipe and from the network at once
+        self.ingestLock = threading.Lock()
+        self.ingestServer = None
+        # A log parser per network source, each with its own partial line, and
+        # when each source last sent data
+        self.sourceHandlers = {}
+        self.sourceLastSeen = {}
+        self.sourcesExpired = time.monotonic()
+
+        # If True, the trigger and shared memory consumers hold up log reading
+        # (for up to 0.5s per batch) rather than drop batches when they fall behind
+        self.lossless = lossless
+
+        # Optionally publish parsed control points to local consumers through shared memory.
+        # shmLock keeps it from being closed while the shm subscriber is writing.
+        self.shmWriter = None
+        self.shmLock = threading.Lock()
+        if shm_name:
+            try:
+                self.shmWriter = SharedMemoryRingWriter(name=shm_name)
+                print("Publishing control points to shared memory: %s" % shm_name)
+            except Exception as e:
+                print("Unable to create shared memory ring: " + str(e))
+
         self.statusBar = QStatusBar()
         self.openProcessButton = QPushButton("")
         self.openProcessButton.setIcon(QIcon(":/icons/open.png"))
@@ -74,10 +155,38 @@ class MainWindow(QMainWindow):
         self.items.setWidget(self.bookmarkListWidget)
         self.items.setFloating(False)
 
-        self.viewer = UHSDKLogViewer(exe_path=exe_path, auto_launch=auto_launch)
+        self.viewer = UHSDKLogViewer(exe_path=exe_path, auto_launch=auto_launch,
+                                     window_ms=window_ms, buffer_size=buffer_size,
+                                     color_mode=color_mode, colormap=colormap, split_view=split_view)
         self.setCentralWidget(self.viewer)
         self.addDockWidget(Qt.BottomDockWidgetArea, self.items)
 
+        # Time-series view of the same point buffer, next to the Bookmarks
+        self.scopeDock = QDockWidget("Scope", self)
+        self.scope = ScopeWidget(self.viewer)
+        self.scopeDock.setWidget(self.scope)
+        self.scopeDock.setFloating(False)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.scopeDock)
+        self.splitDockWidget(self.items, self.scopeDock, Qt.Horizontal)
+
+        # Live spectrum and spectrogram of every parsed sample, fed by the stream bus
+        self.spectra = ControlPointSpectra()
+        self.spectrumDock = QDockWidget("Spectrum", self)
+        self.spectrum = SpectrumWidget(self.spectra)
+        self.spectrumDock.setWidget(self.spectrum)
+        self.spectrumDock.setFloating(False)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.spectrumDock)
+        self.tabifyDockWidget(self.scopeDock, self.spectrumDock)
+
+        # The full SDK log text, searchable, in the same place
+        self.logDock = QDockWidget("Log", self)
+        self.logPanel = LogPanel(self.logStore)
+        self.logDock.setWidget(self.logPanel)
+        self.logDock.setFloating(False)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.logDock)
+        self.tabifyDockWidget(self.spectrumDock, self.logDock)
+        self.scopeDock.raise_()
+
         # MenuBar actions
         self.openProcessAction = QAction("Open Process", self)
         self.openProcessAction.setShortcut("Ctrl+O")
@@ -102,6 +211,21 @@ class MainWindow(QMainWindow):
         self.webSocket_enableDisable_action = QAction("Enable Web Socket", self)
         self.webSocket_enableDisable_action.triggered.connect(self.toggleWebSocketEnabled)
 
+        self.loadReferenceAction = QAction("Compare With Capture...", self)
+        self.loadReferenceAction.triggered.connect(self.loadReferenceFromFileDialog)
+        self.clearReferenceAction = QAction("Clear Comparison", self)
+        self.clearReferenceAction.triggered.connect(self.clearReference)
+
+        self.toggleRawAction = QAction("Show Raw Samples", self)
+        self.toggleRawAction.triggered.connect(self.toggleRawShown)
+
+        # Deviation from the reference capture, refreshed once a second
+        self.comparisonLabel = QLabel("")
+        self.statusBar.addPermanentWidget(self.comparisonLabel)
+        self.comparisonTimer = QTimer()
+        self.comparisonTimer.timeout.connect(self.updateComparisonLabel)
+        self.comparisonTimer.start(1000)
+
         # Init QSystemTrayIcon
         self.tray_icon = QSystemTrayIcon(self)
         if IS_WINDOWS:
@@ -115,15 +239,39 @@ class MainWindow(QMainWindow):
         tray_menu.addAction(self.openProcessAction)
         tray_menu.addAction(self.toggleVisualizer_action)
         tray_menu.addAction(self.webSocket_enableDisable_action)
+        tray_menu.addAction(self.scopeDock.toggleViewAction())
+        tray_menu.addAction(self.spectrumDock.toggleViewAction())
+        tray_menu.addAction(self.logDock.toggleViewAction())
         tray_menu.addAction(self.clearBookmarksAction)
+        tray_menu.addAction(self.loadReferenceAction)
+        tray_menu.addAction(self.clearReferenceAction)
+        if self.filterChain:
+            tray_menu.addAction(self.toggleRawAction)
+        if self.triggerCapture:
+            self.rearmTriggerAction = QAction("Re-arm Trigger", self)
+            self.rearmTriggerAction.triggered.connect(self.triggerCapture.arm)
+            tray_menu.addAction(self.rearmTriggerAction)
         tray_menu.addAction(self.quit_action)
         self.tray_icon.setContextMenu(tray_menu)
         self.tray_icon.show()                
 
+        # Parsed batches are published to each consumer's own queue and thread
+        self.setupStreamBus()
+
+        # Counters and gauges, optionally served over HTTP
+        self.setupMetrics(metrics_port)
+
+        if reference_path:
+            self.loadReference(reference_path)
+
         # Set up an empty log file location
         self.setEnvironmentForLogging()
         self.startPollingLogReaderThread()
 
+        # Optionally receive log data forwarded from another host
+        if listen_port:
+            self.startLogIngestServer(listen_port, listen_udp)
+
 
         if exe_path:
             print("An executable process was provided: %s" % exe_path)
@@ -137,6 +285,105 @@ class MainWindow(QMainWindow):
         # Setup the bookmarks list
         self.updateBookmarkList()
 
+    # Consumers of parsed batches, with their queue sizes and what to do when
+    # they fall behind: the view and WebSocket only need recent samples. Triggers
+    # and shared memory readers get larger queues, and with --lossless they
+    # block the log reader rather than lose a batch.
+    def setupStreamBus(self):
+        policy = 'block' if self.lossless else 'drop-oldest'
+        self.streamBus = StreamBus(wrap=self.threadTarget)
+        self.streamBus.subscribe('renderer', self.renderBatch, maxsize=64, policy='decimate')
+        self.streamBus.subscribe('websocket', self.serveBatch, maxsize=64, policy='drop-oldest')
+        self.spectrumSubscription = self.streamBus.subscribe('spectrum', self.spectrumBatch, maxsize=256, policy='drop-oldest')
+        self.spectrumDropped = 0
+        if self.triggerCapture:
+            self.streamBus.subscribe('triggers', self.triggerBatch, maxsize=256, policy=policy)
+        if self.shmWriter:
+            self.streamBus.subscribe('shm', self.shmBatch, maxsize=256, policy=policy)
+
+    # Counters are incremented by the reader and server threads; gauges read
+    # their values when scraped, so serving them never involves the GUI thread.
+    def setupMetrics(self, port=None):
+        self.metrics = MetricsRegistry()
+        self.linesRead = self.metrics.counter('log_lines_read_total', 'SDK log lines read.')
+        self.samplesParsed = self.metrics.counter('samples_parsed_total', 'Control point samples parsed.')
+        self.parseErrors = self.metrics.counter('parse_errors_total', 'Errors reading or parsing the SDK log.')
+        self.metrics.counter('samples_dropped_total', 'Parsed samples dropped before reaching the viewer.',
+                             fn=lambda: self.parseWorker.reader.dropped if self.parseWorker else 0)
+        self.metrics.gauge('buffer_fill_ratio', 'Fraction of the point buffer in use.',
+                           fn=lambda: len(self.viewer.pointBuffer) / float(self.viewer.pointBuffer.size))
+        framesRendered = self.metrics.counter('frames_rendered_total', 'Frames uploaded to the 3D view.',
+                                              fn=lambda: self.viewer.framesRendered)
+        self.metrics.rate('render_fps', '3D view frames per second since the last scrape.', framesRendered)
+        self.metrics.gauge('websocket_clients', 'Connected WebSocket clients.',
+                           fn=lambda: len(get_clients()) if self.webSocketActive else 0)
+        self.webSocketMessages = self.metrics.counter('websocket_messages_sent_total', 'WebSocket messages sent.')
+        self.webSocketBytes = self.metrics.counter('websocket_bytes_sent_total', 'WebSocket message bytes sent.')
+        self.metrics.gauge('monitored_process_running', '1 if the monitored process is running.',
+                           fn=lambda: 1 if self.executable_process and self.executable_process.poll() is None else 0)
+        self.metrics.counter('parse_worker_restarts_total', 'Times the parse worker process was restarted.',
+                             fn=lambda: self.parseWorker.restarts if self.parseWorker else 0)
+        self.metrics.counter('trigger_captures_total', 'Trigger captures completed.',
+                             fn=lambda: self.triggerCapture.captureCount if self.triggerCapture else 0)
+        self.metrics.gauge('log_store_lines', 'SDK log lines held for the Log panel.', fn=lambda: len(self.logStore))
+        self.metrics.gauge('log_store_unindexed_lines', 'SDK log lines not yet indexed for search.',
+                           fn=lambda: self.logStore.count - max(self.logStore.indexed, self.logStore.first))
+        self.metrics.gauge('log_segment_lines', 'Session line number reached by the SDK log segments on disk.',
+                           fn=lambda: self.segmentWriter.count if self.segmentWriter else 0)
+        for subscription in self.streamBus.subscriptions:
+            name = subscription.name
+            self.metrics.gauge('bus_%s_lag_batches' % name, 'Batches queued for the %s.' % name,
+                               fn=subscription.lag)
+            self.metrics.gauge('bus_%s_lag_seconds' % name, 'Age of the oldest batch queued for the %s.' % name,
+                               fn=subscription.lagSeconds)
+            self.metrics.counter('bus_%s_dropped_batches_total' % name, 'Batches the %s fell too far behind to handle.' % name,
+                                 fn=lambda s=subscription: s.dropped)
+            self.metrics.counter('bus_%s_dropped_samples_total' % name, 'Samples the %s fell too far behind to handle.' % name,
+                                 fn=lambda s=subscription: s.droppedSamples)
+        if port:
+            try:
+                self.metrics.serve(port)
+                print("Serving metrics on port %d" % port)
+            except Exception as e:
+                print("Unable to serve metrics: " + str(e))
+
+    # Compare live samples against a capture, overlaid in the 3D view
+    def loadReference(self, path):
+        try:
+            _, points, _ = loadCapture(path)
+            comparison = SessionComparison(points)
+        except Exception as e:
+            self.logMessage("Unable to load reference capture: " + str(e))
+            return
+        comparison.start()
+        if self.comparison:
+            self.comparison.stop()
+        self.comparison = comparison
+        self.viewer.setReference(self.transform.apply(points))
+        self.logMessage("Comparing with %s" % path)
+
+    def loadReferenceFromFileDialog(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Compare With Capture", "", "Captures (*.npz)")
+        if path:
+            self.loadReference(path)
+
+    def clearReference(self):
+        if self.comparison:
+            self.comparison.stop()
+        self.comparison = None
+        self.viewer.setReference(None)
+        self.comparisonLabel.setText("")
+
+    def updateComparisonLabel(self):
+        comparison = self.comparison
+        if not comparison or not comparison.summary:
+            return
+        summary = comparison.summary
+        text = "RMS %.2f mm, max %.2f mm" % (summary['rms'] * 1000, summary['max'] * 1000)
+        if summary['hausdorff'] is not None:
+            text += ", Hausdorff %.2f mm" % (summary['hausdorff'] * 1000)
+        self.comparisonLabel.setText(text)
+
     def logMessage(self, msg):
         print(msg)
         self.statusBar.showMessage(msg, 2000)
@@ -149,6 +396,11 @@ class MainWindow(QMainWindow):
             self.hide()
             self.toggleVisualizer_action.setText("Show Visualizer")
 
+    # Switch the 3D view between the filtered and raw control point streams
+    def toggleRawShown(self):
+        self.showRaw = not self.showRaw
+        self.toggleRawAction.setText("Show Filtered Samples" if self.showRaw else "Show Raw Samples")
+
     def launchProcessFromFileDialog(self):
         dialog = QFileDialog()
         fname = dialog.getOpenFileName(None, 'Open Ultrahaptics Process', '.', '*',    '*', QFileDialog.DontUseNativeDialog)
@@ -194,6 +446,35 @@ class MainWindow(QMainWindow):
             else:
                 self.killMonitoredProcess()
 
+        # Join the worker's reader thread before its rings are closed under a read()
+        if self.parseWorker:
+            self.stopPollingLogReaderThread()
+            self.parseWorker.stop()
+            self.parseWorker = None
+
+        # Stop the reader and WebSocket threads, so that with --profile their
+        # profiles are stopped, and can be collected by writeReport()
+        if self.log_reader_thread and self.log_reader_thread.is_alive():
+            self.stopPollingLogReaderThread(timeout=1.0)
+        if self.webSocketActive:
+            self.stopWebSocketServerThread(timeout=1.0)
+
+        # Stop the consumers before closing what they write to
+        self.streamBus.close()
+
+        # The bus only waits briefly for each subscriber, so one may still be writing
+        with self.shmLock:
+            if self.shmWriter:
+                self.shmWriter.close()
+                self.shmWriter = None
+
+        if self.segmentWriter:
+            with self.ingestLock:
+                self.segmentWriter.close()
+
+        if self.profiler:
+            self.profiler.writeReport()
+
         sys.exit(app.exec_())
 
     def closeEvent(self, event):
@@ -228,7 +509,10 @@ class MainWindow(QMainWindow):
 
     def setEnvironmentForLogging(self):
         self.logHandler = SDKLogPipeHandler(is_windows=IS_WINDOWS)
-        self.logHandler.setupNamedPipe()        
+        self.logHandler.lineSink = self.storeLogLines
+        # On Windows a parse worker creates its own pipe instance
+        if not (IS_WINDOWS and self.parseInProcess):
+            self.logHandler.setupNamedPipe()
         os.environ["UH_LOG_LEVEL"] = "4"
         os.environ["UH_LOG_DEST"] = self.logHandler.pipe_name
         os.environ["UH_LOG_LEVEL_FORCE"] = "1"
@@ -238,24 +522,144 @@ class MainWindow(QMainWindow):
         self.my_env = os.environ.copy()
 
     # For serving control point data over websocket
-    def serveControlPoints(self, data):
+    # The raw points, if given, are sent alongside as 'raw'
+    def serveControlPoints(self, points, raw=None):
         if self.webSocketActive:
-            for client in get_clients():
-                if data:
-                    msg = json.dumps({'x': data[1], 'y': data[2], 'z': data[3]})
-                    client.sendMessage(str(msg))
+            if not get_clients():
+                return
+            # Encode each point once, whatever the number of clients
+            msgs = encodePoints(points, raw=raw)
+            sent = broadcast(msgs)
+            self.webSocketMessages.inc(len(msgs) * sent)
+            self.webSocketBytes.inc(sum(len(msg) for msg in msgs) * sent)
+
+    # Parse a chunk of log data from the local pipe or a network source, stamped with its read time
+    def processLogData(self, data, source=None):
+        with self.ingestLock:
+            now = time.monotonic()
+            handler = self.logHandler if source is None else self.sourceHandler(source, now)
+            times, points, gapTimes, gaps = handler.parseChunk(data, now)
+            self.handleParsedBatch(times, points, gapTimes, gaps)
+
+    # With the ingest lock held
+    def sourceHandler(self, source, now):
+        handler = self.sourceHandlers.get(source)
+        if handler is None:
+            handler = SDKLogPipeHandler(is_windows=IS_WINDOWS, pipe_name=self.logHandler.pipe_name)
+            handler.lineSink = self.logHandler.lineSink
+            self.sourceHandlers[source] = handler
+        self.sourceLastSeen[source] = now
+
+        # TCP sources are dropped when they disconnect, UDP ones once idle
+        if now - self.sourcesExpired > SOURCE_IDLE_SECONDS:
+            self.sourcesExpired = now
+            for idle in [s for s, seen in self.sourceLastSeen.items()
+                         if s[0] == 'udp' and now - seen > SOURCE_IDLE_SECONDS]:
+                del self.sourceHandlers[idle]
+                del self.sourceLastSeen[idle]
+        return handler
+
+    def sourceClosed(self, source):
+        with self.ingestLock:
+            self.sourceHandlers.pop(source, None)
+            self.sourceLastSeen.pop(source, None)
+
+    # Publish a batch of parsed, timestamped control points, and the gaps
+    # between them, to the stream bus. Filtering is part of ingestion, so
+    # every consumer sees the same raw and filtered samples.
+    def handleParsedBatch(self, times, points, gapTimes, gaps):
+        self.linesRead.inc(len(times) + int(gaps[:, 0].sum()))
+        self.samplesParsed.inc(len(times))
+        if len(times) == 0 and len(gapTimes) == 0:
+            return
+        filtered = self.filterChain.apply(times, points) if self.filterChain and len(times) else points
+        self.streamBus.publish(ParsedBatch(times, points, filtered, gapTimes, gaps), len(times))
+
+    # Stream bus consumers, each called on its own thread.
+    # The viewer and WebSocket get world coordinates; triggers and shared memory get device coordinates.
+    # With a filter chain, triggers and shared memory see raw samples, and captures keep both.
+    def renderBatch(self, batch):
+        if len(batch.gapTimes):
+            self.viewer.setGaps(batch.gapTimes, batch.gaps)
+        if len(batch.times) == 0:
+            return
+        shown = batch.points if self.showRaw else batch.filtered
+        comparison = self.comparison
+        deviations = comparison.add(batch.times, shown) if comparison else None
+        self.viewer.setControlPointsWithTimes(self.transform.apply(shown), batch.times, deviations)
+
+    def serveBatch(self, batch):
+        if not self.webSocketActive or len(batch.times) == 0 or not get_clients():
+            return
+        stream = self.webSocketStream if self.filterChain else 'raw'
+        served = batch.points if stream == 'raw' else batch.filtered
+        self.serveControlPoints(self.transform.apply(served),
+                                self.transform.apply(batch.points) if stream == 'both' else None)
+
+    # Frames mustn't span batches the bus dropped, so start them afresh after a drop
+    def spectrumBatch(self, batch):
+        dropped = self.spectrumSubscription.dropped
+        if dropped != self.spectrumDropped:
+            self.spectrumDropped = dropped
+            self.spectra.restart()
+        if len(batch.times):
+            self.spectra.add(batch.times, batch.points)
+
+    def triggerBatch(self, batch):
+        if len(batch.times) == 0:
+            return
+        if self.filterChain:
+            self.triggerCapture.add(batch.times, batch.points, batch.filtered)
+        else:
+            self.triggerCapture.add(batch.times, batch.points)
+
+    def shmBatch(self, batch):
+        with self.shmLock:
+            if len(batch.times) and self.shmWriter:
+                self.shmWriter.write(batch.times, batch.points)
+
+    # Method for thread to collect batches parsed by the ParseWorker process
+    def processLogFromWorker(self):
+        while self.processingSDKLog:
+            self.parseWorker.ensureRunning()
+            times, points, gapTimes, gaps = self.parseWorker.read()
+            if len(times) == 0 and len(gapTimes) == 0:
+                time.sleep(0.001)
+                continue
+            with self.ingestLock:
+                self.handleParsedBatch(times, points, gapTimes, gaps)
 
     # Method for thread to process the Log on Unix - consider moving to SDKLogHandler Class
     def processLogUnix(self):
-        with open(self.logHandler.pipe_name) as fifo:
-            while self.processingSDKLog:
-                try:               
-                    data = fifo.readline()
-                    match = re.search(self.logHandler.xyzi_regex, data)
-                    self.viewer.setControlPointsFromFromRegexMatch(match)
-                    self.serveControlPoints(match)
-                except Exception as e:
-                    print (e)
+        while self.processingSDKLog:
+            # Opening the fifo blocks until a writer connects, so reopen it
+            # whenever the monitored process closes its end, or it fails.
+            try:
+                fifo = os.open(self.logHandler.pipe_name, os.O_RDONLY)
+            except OSError as e:
+                self.parseErrors.inc()
+                print ("Errors opening the log pipe: " + str(e))
+                # Recreate the fifo if it was removed, and don't spin if it can't be opened
+                if not os.path.exists(self.logHandler.pipe_name):
+                    self.logHandler.setupNamedPipe()
+                time.sleep(1.0)
+                continue
+            try:
+                while self.processingSDKLog:
+                    data = os.read(fifo, self.logHandler.num_bytes)
+                    if not data:
+                        break
+                    # A parse error only loses this chunk, and never closes the pipe on the writer
+                    try:
+                        self.processLogData(data)
+                    except Exception as e:
+                        self.parseErrors.inc()
+                        print (e)
+            except OSError as e:
+                self.parseErrors.inc()
+                print ("Errors reading the log pipe: " + str(e))
+            finally:
+                os.close(fifo)
 
     # Methof for thread to process the Log on Windows - consider moving to SDKLogHandler Class
     def processLogWindows(self):
@@ -266,6 +670,7 @@ class MainWindow(QMainWindow):
             try:
                 data = self.logHandler.getDataFromNamedPipe()
             except Exception as e:
+                self.parseErrors.inc()
                 print ("Errors processing log on Windows: " + str(e))
                 self.logHandler.namedPipe = None
                 continue
@@ -274,28 +679,71 @@ class MainWindow(QMainWindow):
                 self.logMessage("No valid Pipe data available")
                 continue
 
-            lines = str(data[1], "utf-8").split(os.linesep)
+            try:
+                self.processLogData(data[1])
+            except Exception as e:
+                self.parseErrors.inc()
+                print (e)
+
+    # Keep complete log lines, with their times, for the Log panel and on disk
+    def storeLogLines(self, block, times):
+        self.logStore.append(block, times)
+        if self.segmentWriter:
+            self.segmentWriter.append(block, times)
 
-            for line in lines:
-                match = re.search(self.logHandler.xyzi_regex, line)
-                self.viewer.setControlPointsFromFromRegexMatch(match)
-                self.serveControlPoints(match)
+    # Thread targets are profiled when running with --profile
+    def threadTarget(self, name, target):
+        if self.profiler:
+            return self.profiler.wrap(name, target)
+        return target
 
     def startPollingLogReaderThread(self):
-        if IS_UNIX:
-            self.log_reader_thread = threading.Thread(target=self.processLogUnix)
+        if self.parseInProcess:
+            if not self.parseWorker:
+                self.parseWorker = ParseWorker(self.logHandler.pipe_name, IS_WINDOWS, segment_options=self.segmentOptions)
+            target = self.processLogFromWorker
+        elif IS_UNIX:
+            target = self.processLogUnix
         elif IS_WINDOWS:
-            self.log_reader_thread = threading.Thread(target=self.processLogWindows)
+            target = self.processLogWindows
+        self.log_reader_thread = threading.Thread(target=self.threadTarget('reader', target), name='log-reader')
 
         self.log_reader_thread.daemon = True
         self.processingSDKLog = True
         self.log_reader_thread.start()
 
-    def stopPollingLogReaderThread(self):
+    # Receive log data sent by forwarder.py running on the device host
+    def startLogIngestServer(self, port, udp=False):
+        try:
+            self.ingestServer = LogIngestServer(self.processLogData, port=port, udp=udp, closed=self.sourceClosed)
+            self.ingestServer.start()
+            self.logMessage("Listening for forwarded logs on port %d" % port)
+        except Exception as e:
+            self.ingestServer = None
+            self.logMessage("Unable to listen for forwarded logs: " + str(e))
+
+    def stopPollingLogReaderThread(self, timeout=None):
         self.processingSDKLog = False
+        if IS_UNIX and not self.parseInProcess:
+            self.wakeLogReaderUnix()
         if self.log_reader_thread.is_alive():
             # Fix this - it will quit the process!
-            self.log_reader_thread.join()
+            self.log_reader_thread.join(timeout)
+
+    # The Unix reader blocks opening or reading the fifo, so write a newline
+    # to it, after which the reader sees processingSDKLog is False and returns
+    def wakeLogReaderUnix(self):
+        try:
+            fifo = os.open(self.logHandler.pipe_name, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError:
+            # Nothing has the fifo open for reading
+            return
+        try:
+            os.write(fifo, b'\n')
+        except OSError:
+            pass
+        finally:
+            os.close(fifo)
 
     def toggleWebSocketEnabled(self):
         if not self.webSocketActive:
@@ -308,10 +756,10 @@ class MainWindow(QMainWindow):
         try:
             if not socketIsOpen():
                 self.webSocket = createWebSocketServer()
-                self.webSocketThread = threading.Thread(target=self.webSocket.serveforever)
+                self.webSocketActive = True
+                self.webSocketThread = threading.Thread(target=self.threadTarget('websocket', self.serveWebSocket), name='websocket')
                 self.webSocketThread.daemon = True
                 self.webSocketThread.start()
-                self.webSocketActive = True
             else:
                 self.logMessage("SOCKET PORT ALREADY OPEN.")
                 self.webSocketActive = True
@@ -320,16 +768,24 @@ class MainWindow(QMainWindow):
             print(e)
 
 
-    def stopWebSocketServerThread(self):
+    # Unlike serveforever(), returns once the server is stopped. Each
+    # serveonce() waits at most the server's selectInterval.
+    def serveWebSocket(self):
+        while self.webSocketActive:
+            self.webSocket.serveonce()
+
+    def stopWebSocketServerThread(self, timeout=0.25):
         self.logMessage("Stopping Server")
+        self.webSocketActive = False
         if self.webSocket:
             try:
-                # TODO: Reliably close the Socket
-                self.webSocketThread.join(0.25)
+                self.webSocketThread.join(timeout)
+                if not self.webSocketThread.is_alive():
+                    self.webSocket.close()
+                    self.webSocket = None
             except Exception as e:
                 print("Closing, exception:" + str(e))                
-            self.webSocketActive = False
-            self.webSocket_enableDisable_action.setText("Enable Web Socket")
+        self.webSocket_enableDisable_action.setText("Enable Web Socket")
 
     def toggleProcessingLog(self):
         self.processingSDKLog = not self.processingSDKLog
@@ -340,6 +796,9 @@ class MainWindow(QMainWindow):
 
 
 if __name__ == '__main__':
+    # Needed for the parse worker process in PyInstaller builds
+    multiprocessing.freeze_support()
+
     app = QApplication(sys.argv)
 
     app.setOrganizationName("Ultraleap");
@@ -350,12 +809,96 @@ if __name__ == '__main__':
     parser = argparse.ArgumentParser(usage="-e <executable path> -a <add to automatically launch the executable>")
     parser.add_argument('-e', '--exePath', required=False, help='The executable process to lauch. If specified, the specified executable will be launched and monitored.')
     parser.add_argument('-a', '--autoLaunch', action="store_true", default=True, required=False, help='If specified, will automatically launch the specified executable on launch.')
+    parser.add_argument('-w', '--windowMs', type=float, required=False, help='If specified, only plot control points from the last windowMs milliseconds (e.g. 5 for one 200Hz period).')
+    parser.add_argument('-b', '--bufferSize', type=int, required=False, help='Number of samples held in the point buffer. Defaults to 512, or 65536 when --windowMs is used.')
+    parser.add_argument('-t', '--trigger', action='append', required=False, help='A trigger condition to capture samples around, e.g. "intensity<=0" or "outside:xmin,ymin,zmin,xmax,ymax,zmax" (metres). May be given more than once.')
+    parser.add_argument('--triggerMode', choices=TriggerCapture.MODES, default='normal', help='single: capture once, normal: re-arm after each capture, auto: also capture when nothing triggers.')
+    parser.add_argument('--preTrigger', type=int, default=1000, help='Number of samples to keep from before each trigger.')
+    parser.add_argument('--postTrigger', type=int, default=1000, help='Number of samples to keep from after each trigger.')
+    parser.add_argument('--captureDir', required=False, help='If specified, trigger captures are also saved to this directory.')
+    parser.add_argument('-l', '--listen', type=int, nargs='?', const=LOG_INGEST_PORT, required=False, help='Listen on this TCP port (default %d) for log data sent by forwarder.py from another host.' % LOG_INGEST_PORT)
+    parser.add_argument('--listenUdp', action='store_true', help='Also accept forwarded log data over UDP on the --listen port.')
+    parser.add_argument('--shm', nargs='?', const=SHM_DEFAULT_NAME, required=False, help='Publish parsed control points to a shared memory ring with this name (default "%s"), for local readers using shm_ring.py.' % SHM_DEFAULT_NAME)
+    parser.add_argument('--lossless', action='store_true', help='Make the trigger and shared memory consumers hold up log reading, for up to 0.5s per batch, rather than drop batches when they fall behind.')
+    parser.add_argument('-p', '--parseProcess', action='store_true', help='Read and parse the SDK log in a separate process, to keep the 3D view smooth at high log rates.')
+    parser.add_argument('-s', '--splitView', action='store_true', help='Show top, front and side views next to the 3D view. Press V in the 3D view to toggle.')
+    parser.add_argument('--colorMode', choices=COLOR_MODES, default='intensity', help='What control point colour shows. Press C in the 3D view to cycle.')
+    parser.add_argument('--colorMap', choices=sorted(COLORMAP_ANCHORS.keys()), default='white', help='Colour map for the intensity, age and speed colour modes.')
+    parser.add_argument('--transform', choices=sorted(TRANSFORM_PRESETS.keys()), default='default', help='Device to world coordinate transform preset, applied before viewing and serving over WebSocket.')
+    parser.add_argument('--scale', type=float, required=False, help='Override the transform scale (world units per metre).')
+    parser.add_argument('--axes', required=False, help='Override the transform axis permutation, e.g. "x,z,-y".')
+    parser.add_argument('--rotation', required=False, help='Override the transform rotation, as "rx,ry,rz" degrees.')
+    parser.add_argument('--offset', required=False, help='Override the transform offset, as "x,y,z" world units.')
+    parser.add_argument('-f', '--filter', action='append', required=False, help='Smooth control point positions with a filter, e.g. "average:8", "exponential:0.005" (seconds), "oneeuro:1,0.5,1" (min cutoff Hz, beta, derivative cutoff Hz) or "kalman:0.001,10" (measurement noise m, acceleration m/s^2). May be given more than once, to chain filters in order.')
+    parser.add_argument('--webSocketStream', choices=('filtered', 'raw', 'both'), default='filtered', help='With --filter, which control point stream to serve over the WebSocket. "both" adds the raw position to each message as "raw".')
+    parser.add_argument('--compare', required=False, help='A capture file to compare live samples with. It is drawn in the 3D view, and samples are coloured by their distance from it.')
+    parser.add_argument('--logMemoryMb', type=float, default=256, help='Memory for the SDK log text shown in the Log panel, in MB. The oldest half is discarded when it is full.')
+    parser.add_argument('--logDir', nargs='?', const='ultraviz_logs', required=False, help='Also append the raw SDK log to rotating segment files in this directory (default "ultraviz_logs"), for reading back with segment_store.py.')
+    parser.add_argument('--logSegmentMb', type=float, default=256, help='With --logDir, start a new segment file after this many MB.')
+    parser.add_argument('--logMaxGb', type=float, required=False, help='With --logDir, delete the oldest segments to keep them within this many GB.')
+    parser.add_argument('--logMaxAgeHours', type=float, required=False, help='With --logDir, delete segments last written more than this many hours ago.')
+    parser.add_argument('-m', '--metricsPort', type=int, required=False, help='Serve Prometheus metrics over HTTP on this port, at /metrics.')
+    parser.add_argument('--profile', nargs='?', const='ultraviz_profile_%s.txt' % time.strftime('%Y%m%d_%H%M%S'), required=False, help='Profile the reader, WebSocket and GUI threads and watch for GUI stalls, writing a report to this file on exit.')
+    parser.add_argument('--profileMemory', action='store_true', help='With --profile, also record tracemalloc snapshots.')
+    parser.add_argument('--stallMs', type=float, default=100, help='With --profile, GUI event loop stalls longer than this are recorded with every thread\'s stack.')
     args = parser.parse_args()
 
     exePath = args.exePath
     autoLaunch = args.autoLaunch
+    bufferSize = args.bufferSize
+    if not bufferSize:
+        bufferSize = 65536 if args.windowMs else 512
     
-    ex = MainWindow(exe_path = exePath, auto_launch = autoLaunch)
+    # --rotation and --offset are each three comma separated numbers
+    vectors = {}
+    for option in ('rotation', 'offset'):
+        text = getattr(args, option)
+        if text is None:
+            continue
+        try:
+            values = [float(v) for v in text.split(',')]
+        except ValueError:
+            values = []
+        if len(values) != 3:
+            parser.error("--%s needs three comma separated numbers, not '%s'" % (option, text))
+        vectors[option] = values
+
+    transform = CoordinateTransform.fromPreset(args.transform, scale=args.scale, axes=args.axes,
+        rotation=vectors.get('rotation'), offset=vectors.get('offset'))
+
+    filterChain = None
+    if args.filter:
+        filterChain = FilterChain([parseFilter(spec) for spec in args.filter])
+        print("Filtering control points: %s" % filterChain)
+
+    if args.preTrigger < 0 or args.postTrigger < 0:
+        parser.error("--preTrigger and --postTrigger can't be negative")
+
+    triggerCapture = None
+    if args.trigger:
+        triggerCapture = TriggerCapture([parseTrigger(spec) for spec in args.trigger], mode=args.triggerMode,
+                                        pre=args.preTrigger, post=args.postTrigger, capture_dir=args.captureDir,
+                                        width=8 if filterChain else 5)
+
+    segmentOptions = None
+    if args.logDir:
+        segmentOptions = dict(directory=args.logDir, segment_bytes=int(args.logSegmentMb * 1024 * 1024),
+                              max_bytes=int(args.logMaxGb * 1024 ** 3) if args.logMaxGb else None,
+                              max_age=args.logMaxAgeHours * 3600 if args.logMaxAgeHours else None)
+        print("Writing the SDK log to: %s" % os.path.abspath(args.logDir))
+
+    profiler = None
+    if args.profile:
+        profiler = Profiler(args.profile, stall_ms=args.stallMs, trace_memory=args.profileMemory)
+
+    ex = MainWindow(exe_path = exePath, auto_launch = autoLaunch, window_ms = args.windowMs, buffer_size = bufferSize,
+                    trigger_capture = triggerCapture, listen_port = args.listen, listen_udp = args.listenUdp,
+                    shm_name = args.shm, parse_in_process = args.parseProcess,
+                    color_mode = args.colorMode, colormap = args.colorMap, transform = transform,
+                    metrics_port = args.metricsPort, profiler = profiler,
+                    split_view = args.splitView, reference_path = args.compare,
+                    filter_chain = filterChain, websocket_stream = args.webSocketStream,
+                    log_memory_mb = args.logMemoryMb, segment_options = segmentOptions, lossless = args.lossless)
     darkMode(app)
 
     # TODO: Understand why qtmodern.ModernWindow renders differently on macOS/Windows
@@ -366,4 +909,8 @@ if __name__ == '__main__':
     else:
         ex.setWindowTitle("Ultraviz")
         ex.show()
+
+    if profiler:
+        profiler.profileCurrentThread('qt')
+        profiler.startWatchdog()
     sys.exit(app.exec_())
@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Batch analysis of saved SDK logs and capture files
+----------------------------------------------------------
+Summarises every raw SDK log (.log, .txt) and capture file (.npz) in some
+directories, one file per process of a pool, into a single CSV or JSON
+report with a row per file: sample and control point counts, update rate,
+bounding box, intensity, gaps in the updates, and the dominant intensity
+and position modulation frequencies.
+
+Logs are parsed with the same SDKLogPipeHandler as the live view, a chunk
+at a time, and each file's statistics are accumulated as it is read, so
+logs of any size are summarised in constant memory. Update intervals go
+into a log-spaced histogram (2% wide bins), which gives the rate
+percentiles and gaps; spectra are averaged over Hann-windowed frames of
+each control point's samples.
+
+Lines in a raw log have no times of their own. A log written by
+Ultraviz.py --logDir has an index file beside it giving each line's time;
+for other logs give the control point update rate with --sampleRate, or
+the timing columns are left empty. If an index is shorter than its log,
+the samples past its end are left untimed, and the row's error says so.
+
+$ python3 batch_analysis.py rig_logs/ -o report.csv
+$ python3 batch_analysis.py rig_logs/ captures/ -r -o report.json --sampleRate 16000
+"""
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+from capture import loadCapture
+from log_handler import SDKLogPipeHandler
+from segment_store import INDEX_DTYPE, indexLength
+
+LOG_EXTENSIONS = ('.log', '.txt')
+CAPTURE_EXTENSIONS = ('.npz',)
+
+# Edges of the update interval histogram, in seconds: 0.1 us to 1000 s, 120 bins per decade
+INTERVAL_EDGES = np.logspace(-7, 3, 1201)
+
+# Report columns, in order
+FIELDS = ('file', 'kind', 'bytes', 'lines', 'lines_without_points', 'longest_line_run',
+          'samples', 'control_points', 'duration_s',
+          'rate_mean_hz', 'rate_median_hz', 'rate_p1_hz', 'interval_std_us', 'interval_max_ms',
+          'x_min', 'x_max', 'y_min', 'y_max', 'z_min', 'z_max',
+          'intensity_mean', 'intensity_std', 'intensity_min', 'intensity_max',
+          'gaps', 'gap_total_s', 'intensity_modulation_hz', 'position_modulation_hz',
+          'analysis_s', 'error')
+
+class SampleStatistics(object):
+    def __init__(self, gap_factor=5.0, window_size=8192, max_spectra=16):
+        super(SampleStatistics, self).__init__()
+        # An update interval longer than gap_factor times the median is a gap
+        self.gapFactor = gap_factor
+        self.windowSize = window_size
+        self.window = np.hanning(window_size)
+        # Spectra are only kept for the first max_spectra control points seen
+        self.maxSpectra = max_spectra
+
+        self.samples = 0
+        self.counts = {}
+        self.lower = np.full(3, np.inf)
+        self.upper = np.full(3, -np.inf)
+        # Intensity count, sum, sum of squares, minimum and maximum
+        self.intensity = [0, 0.0, 0.0, np.inf, -np.inf]
+        self.startTime = None
+        self.endTime = None
+
+        # Per control point, its last sample time
+        self._lastTimes = {}
+        # Interval histogram: count and total of the intervals in each bin
+        self.intervalCounts = np.zeros(len(INTERVAL_EDGES) + 1, dtype=np.int64)
+        self.intervalSums = np.zeros(len(INTERVAL_EDGES) + 1)
+        self.intervalSquares = 0.0
+        self.maxInterval = 0.0
+
+        # Per control point, [X-Y-Z-I samples not yet in a frame, (bins, 4) summed power, frames]
+        self._spectra = {}
+
+    def add(self, times, points):
+        """Add (N,5) X-Y-Z-I-ID points, with their (N,) times or None if not known"""
+        if len(points) == 0:
+            return
+        points = np.asarray(points, dtype=np.float64)
+        self.samples += len(points)
+        self.lower = np.minimum(self.lower, points[:, 0:3].min(axis=0))
+        self.upper = np.maximum(self.upper, points[:, 0:3].max(axis=0))
+        intensity = points[:, 3]
+        self.intensity[0] += len(intensity)
+        self.intensity[1] += intensity.sum()
+        self.intensity[2] += np.dot(intensity, intensity)
+        self.intensity[3] = min(self.intensity[3], intensity.min())
+        self.intensity[4] = max(self.intensity[4], intensity.max())
+
+        ids = points[:, 4]
+        for key in np.unique(ids):
+            rows = np.flatnonzero(ids == key)
+            self.counts[key] = self.counts.get(key, 0) + len(rows)
+            if key in self._spectra or len(self._spectra) < self.maxSpectra:
+                self._addSpectrum(key, points[rows, 0:4])
+            if times is not None:
+                self._addIntervals(key, np.asarray(times, dtype=np.float64)[rows])
+        if times is not None:
+            self.startTime = times[0] if self.startTime is None else min(self.startTime, times[0])
+            self.endTime = times[-1] if self.endTime is None else max(self.endTime, times[-1])
+
+    def _addIntervals(self, key, t):
+        last = self._lastTimes.get(key)
+        intervals = np.diff(t) if last is None else np.diff(np.concatenate(([last], t)))
+        self._lastTimes[key] = t[-1]
+        if len(intervals) == 0:
+            return
+        bins = np.searchsorted(INTERVAL_EDGES, intervals)
+        self.intervalCounts += np.bincount(bins, minlength=len(self.intervalCounts))
+        self.intervalSums += np.bincount(bins, weights=intervals, minlength=len(self.intervalSums))
+        self.intervalSquares += np.dot(intervals, intervals)
+        self.maxInterval = max(self.maxInterval, intervals.max())
+
+    def _addSpectrum(self, key, xyzi):
+        carry, power, frames = self._spectra.get(key, (np.zeros((0, 4)), 0.0, 0))
+        samples = np.concatenate((carry, xyzi))
+        count = len(samples) // self.windowSize
+        if count:
+            framed = samples[:count * self.windowSize].reshape(count, self.windowSize, 4)
+            framed = (framed - framed.mean(axis=1, keepdims=True)) * self.window[None, :, None]
+            spectrum = np.fft.rfft(framed, axis=1)
+            power = power + (spectrum.real ** 2 + spectrum.imag ** 2).sum(axis=0)
+            frames += count
+        self._spectra[key] = (samples[count * self.windowSize:], power, frames)
+
+    def intervalPercentile(self, q):
+        """Approximate q'th percentile of the update intervals, from the histogram"""
+        total = self.intervalCounts.sum()
+        if total == 0:
+            return None
+        b = int(np.searchsorted(np.cumsum(self.intervalCounts), q / 100.0 * total))
+        # The mean of the intervals in that bin
+        return self.intervalSums[b] / max(self.intervalCounts[b], 1)
+
+    def dominantFrequencies(self, interval):
+        """(intensity, position) frequencies with the most power, for the control point with the most frames"""
+        spectra = [(frames, power) for _, power, frames in self._spectra.values() if frames]
+        if not spectra or not interval:
+            return None, None
+        _, power = max(spectra, key=lambda spectrum: spectrum[0])
+        frequencies = np.fft.rfftfreq(self.windowSize, interval)
+        result = []
+        for channels in (power[1:, 3], power[1:, 0:3].sum(axis=1)):
+            # A constant channel has no modulation to speak of
+            if channels.max() <= 1e-12 * self.windowSize:
+                result.append(None)
+            else:
+                result.append(float(frequencies[1 + np.argmax(channels)]))
+        return tuple(result)
+
+    def summary(self):
+        """A dict of FIELDS values for the samples added"""
+        result = {'samples': self.samples, 'control_points': len(self.counts)}
+        if self.samples:
+            result.update(x_min=self.lower[0], x_max=self.upper[0], y_min=self.lower[1], y_max=self.upper[1],
+                          z_min=self.lower[2], z_max=self.upper[2])
+            count, total, squares, lowest, highest = self.intensity
+            mean = total / count
+            result.update(intensity_mean=mean, intensity_std=np.sqrt(max(squares / count - mean * mean, 0)),
+                          intensity_min=lowest, intensity_max=highest)
+
+        intervals = self.intervalCounts.sum()
+        median = self.intervalPercentile(50)
+        if intervals and median:
+            mean = self.intervalSums.sum() / intervals
+            result.update(duration_s=self.endTime - self.startTime,
+                          rate_mean_hz=1.0 / mean if mean > 0 else None,
+                          rate_median_hz=1.0 / median,
+                          rate_p1_hz=1.0 / self.intervalPercentile(99),
+                          interval_std_us=np.sqrt(max(self.intervalSquares / intervals - mean * mean, 0)) * 1e6,
+                          interval_max_ms=self.maxInterval * 1e3)
+            # Whole bins above the gap threshold
+            first = int(np.searchsorted(INTERVAL_EDGES, self.gapFactor * median)) + 1
+            result.update(gaps=int(self.intervalCounts[first:].sum()), gap_total_s=float(self.intervalSums[first:].sum()))
+        result['intensity_modulation_hz'], result['position_modulation_hz'] = self.dominantFrequencies(median)
+        return result
+
+
+def indexTimes(path):
+    """Line times from the index beside a log written with --logDir, or None"""
+    indexPath = os.path.splitext(path)[0] + '.idx'
+    length = indexLength(indexPath)
+    if not length:
+        return None
+    return np.memmap(indexPath, dtype=INDEX_DTYPE, mode='r', shape=(length,))['time']
+
+def analyseLog(path, statistics, sample_rate=None, chunk_bytes=16 * 1024 * 1024):
+    """Parse a raw SDK log into statistics, returning the line counts for the summary"""
+    # Only its parser is used; on Windows the constructor makes no temporary directory for a pipe
+    handler = SDKLogPipeHandler(is_windows=True)
+    lineTimes = indexTimes(path)
+    lines = 0
+    without = 0
+    run = 0
+    longestRun = 0
+    # Per control point, the number of samples so far, for times at sample_rate
+    sampleCounts = {}
+    partial = b''
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_bytes)
+            data = partial + data if data else (partial + b'\n' if partial else b'')
+            if not data:
+                break
+            end = data.rfind(b'\n') + 1
+            block, partial = data[:end], data[end:]
+            count = block.count(b'\n')
+            points, pointLines = handler.parseControlPoints(block)
+
+            # Runs of lines without a control point, which may continue from the last block
+            bounds = np.concatenate(([-1], pointLines, [count]))
+            runs = np.diff(bounds) - 1
+            if len(pointLines):
+                longestRun = max(longestRun, run + runs[0], runs[1:-1].max() if len(runs) > 2 else 0)
+                run = runs[-1]
+            else:
+                run += count
+            longestRun = max(longestRun, run)
+            without += count - len(pointLines)
+
+            if lineTimes is not None:
+                # Index times are never mixed with others, so samples on lines
+                # past the end of the index are left untimed
+                indexed = int(np.searchsorted(pointLines, len(lineTimes) - lines))
+                statistics.add(np.asarray(lineTimes[lines + pointLines[:indexed]]), points[:indexed])
+                statistics.add(None, points[indexed:])
+            else:
+                times = None
+                if sample_rate:
+                    times = np.empty(len(points))
+                    for key in np.unique(points[:, 4]):
+                        rows = np.flatnonzero(points[:, 4] == key)
+                        first = sampleCounts.get(key, 0)
+                        times[rows] = (first + np.arange(len(rows))) / float(sample_rate)
+                        sampleCounts[key] = first + len(rows)
+                statistics.add(times, points)
+            lines += count
+    result = {'lines': lines, 'lines_without_points': without, 'longest_line_run': longestRun}
+    if lineTimes is not None and len(lineTimes) < lines:
+        result['error'] = ("index has times for %d of %d lines, samples after that are untimed"
+                           % (len(lineTimes), lines))
+    return result
+
+def analyseFile(job):
+    """Summarise one file, given (path, options). Errors are reported in the summary rather than raised."""
+    path, options = job
+    start = time.time()
+    summary = {'file': path, 'bytes': os.path.getsize(path)}
+    statistics = SampleStatistics(gap_factor=options['gapFactor'], window_size=options['windowSize'])
+    try:
+        if path.lower().endswith(CAPTURE_EXTENSIONS):
+            summary['kind'] = 'capture'
+            times, points, _ = loadCapture(path)
+            statistics.add(times, points[:, 0:5])
+        else:
+            summary['kind'] = 'log'
+            summary.update(analyseLog(path, statistics, sample_rate=options['sampleRate']))
+        summary.update(statistics.summary())
+    except Exception as e:
+        summary['error'] = str(e)
+    summary['analysis_s'] = time.time() - start
+    return summary
+
+def findFiles(paths, recursive=False):
+    """Logs and captures among paths, and in any directories among them"""
+    extensions = LOG_EXTENSIONS + CAPTURE_EXTENSIONS
+    found = []
+    for path in paths:
+        if os.path.isfile(path):
+            found.append(path)
+        elif recursive:
+            for root, _, names in os.walk(path):
+                found.extend(os.path.join(root, name) for name in names if name.lower().endswith(extensions))
+        elif os.path.isdir(path):
+            found.extend(os.path.join(path, name) for name in os.listdir(path)
+                         if name.lower().endswith(extensions) and os.path.isfile(os.path.join(path, name)))
+    return sorted(set(found))
+
+def plain(value):
+    """A report value as a plain Python number or string"""
+    if isinstance(value, (np.integer, np.floating)):
+        value = value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+def writeReport(path, summaries):
+    rows = [{field: plain(summary.get(field)) for field in FIELDS} for summary in summaries]
+    if path.lower().endswith('.json'):
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=1)
+    else:
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=FIELDS)
+            writer.writeheader()
+            writer.writerows(rows)
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    parser = argparse.ArgumentParser(description='Summarise SDK logs and capture files into one report.')
+    parser.add_argument('paths', nargs='+', help='Log (%s) and capture (%s) files, or directories of them.' % (', '.join(LOG_EXTENSIONS), ', '.join(CAPTURE_EXTENSIONS)))
+    parser.add_argument('-o', '--output', default='ultraviz_report.csv', help='The report: .json for JSON, otherwise CSV.')
+    parser.add_argument('-r', '--recursive', action='store_true', help='Also look in subdirectories.')
+    parser.add_argument('--sampleRate', type=float, required=False, help='Control point update rate, in Hz, to time the samples of logs without an index file.')
+    parser.add_argument('--gapFactor', type=float, default=5.0, help='Update intervals longer than this many times the median count as gaps.')
+    parser.add_argument('--windowSize', type=int, default=8192, help='Samples per spectrum frame, for the modulation frequencies.')
+    parser.add_argument('-j', '--workers', type=int, default=multiprocessing.cpu_count(), help='Number of analysis processes.')
+    args = parser.parse_args()
+
+    files = findFiles(args.paths, recursive=args.recursive)
+    if not files:
+        print("No logs or captures found in: %s" % ', '.join(args.paths))
+        sys.exit(1)
+
+    options = {'sampleRate': args.sampleRate, 'gapFactor': args.gapFactor, 'windowSize': args.windowSize}
+    # Largest first, so the pool isn't left waiting on one big file at the end
+    jobs = [(path, options) for path in sorted(files, key=os.path.getsize, reverse=True)]
+
+    start = time.time()
+    summaries = []
+    workers = max(1, min(args.workers, len(jobs)))
+    print("Analysing %d files with %d processes" % (len(jobs), workers))
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(workers) as pool:
+        for summary in pool.imap_unordered(analyseFile, jobs):
+            summaries.append(summary)
+            if summary.get('error'):
+                print("[%d/%d] %s: %s" % (len(summaries), len(jobs), summary['file'], summary['error']))
+            else:
+                print("[%d/%d] %s: %d samples" % (len(summaries), len(jobs), summary['file'], summary['samples']))
+
+    summaries.sort(key=lambda summary: summary['file'])
+    writeReport(args.output, summaries)
+    print("Wrote %s in %.1f s" % (args.output, time.time() - start))
@@ -1,3 +1,10 @@
+import numpy as np
+
+def spreadTimestamps(previous, timestamp, n):
+    """Timestamps for n rows read at 'timestamp', spread evenly since the 'previous' batch"""
+    start = previous if previous is not None else timestamp
+    return start + (timestamp - start) * np.arange(1, n + 1) / n
+
 # A circular buffer to handle X-Y-Z-I data
 class CircularBuffer(object):
     def __init__(self, size=512):
@@ -30,3 +37,96 @@ class CircularBuffer(object):
     def clear_all(self):
         """return a list of all the elements"""
         self._data = []
+
+
+# A circular buffer of X-Y-Z-I rows, each with a monotonic timestamp.
+# Every row is written twice (at slot and slot+size) so that the most recent
+# samples can always be returned as one contiguous NumPy view, without copying.
+class TimestampedBuffer(object):
+    def __init__(self, size=512, width=4):
+        """initialization"""
+        self.size = size
+        self.width = width
+        self.index = 0
+        self.count = 0
+        self._data = np.zeros((2*size, width), dtype=np.float32)
+        self._times = np.zeros(2*size, dtype=np.float64)
+        self._lastTime = None
+
+    def record_batch(self, values, timestamp):
+        """append a batch of rows read at time 'timestamp' (seconds, monotonic)
+
+        Rows are spread evenly between the previous batch time and this one,
+        so timestamps stay sorted and can be binary searched.
+        Returns the timestamps assigned to the rows.
+        """
+        values = np.asarray(values, dtype=np.float32).reshape(-1, self.width)
+        n = values.shape[0]
+        if n == 0:
+            return np.zeros(0)
+        times = spreadTimestamps(self._lastTime, timestamp, n)
+        self.record(values, times)
+        return times
+
+    def record(self, values, times):
+        """append rows with explicit, non-decreasing timestamps"""
+        values = np.asarray(values, dtype=np.float32).reshape(-1, self.width)
+        n = values.shape[0]
+        if n == 0:
+            return
+        times = np.asarray(times, dtype=np.float64)
+        self._lastTime = times[-1]
+
+        # Only the newest 'size' rows can survive the write
+        if n > self.size:
+            self.index = (self.index + n - self.size) % self.size
+            values = values[-self.size:]
+            times = times[-self.size:]
+            n = self.size
+
+        slots = (self.index + np.arange(n)) % self.size
+        self._data[slots] = values
+        self._data[slots + self.size] = values
+        self._times[slots] = times
+        self._times[slots + self.size] = times
+        self.index = (self.index + n) % self.size
+        self.count = min(self.count + n, self.size)
+
+    def latest(self, n=None):
+        """return (times, rows) views of the newest n rows, oldest first"""
+        if n is None or n > self.count:
+            n = self.count
+        end = self.index + self.size
+        return self._times[end - n:end], self._data[end - n:end]
+
+    def window(self, duration):
+        """return (times, rows) views covering the last 'duration' seconds"""
+        times, rows = self.latest()
+        if len(times) == 0:
+            return times, rows
+        first = np.searchsorted(times, times[-1] - duration, side='left')
+        return times[first:], rows[first:]
+
+    def between(self, start, end):
+        """return (times, rows) views with start <= time <= end"""
+        times, rows = self.latest()
+        first = np.searchsorted(times, start, side='left')
+        last = np.searchsorted(times, end, side='right')
+        return times[first:last], rows[first:last]
+
+    def last_time(self):
+        """return the timestamp of the newest row, or None if there isn't one"""
+        return self._lastTime
+
+    def slots(self, start, end):
+        """return (times, rows) views of ring slots start to end-1, for 0 <= start <= end <= size"""
+        return self._times[start:end], self._data[start:end]
+
+    def __len__(self):
+        return self.count
+
+    def clear_all(self):
+        """remove all of the elements"""
+        self.index = 0
+        self.count = 0
+        self._lastTime = None
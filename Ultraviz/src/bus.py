@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+# In-process publish/subscribe bus for parsed control point batches
+----------------------------------------------------------
+The log reader publishes each parsed batch once. Every consumer subscribes
+with its own bounded queue and thread, so a slow consumer falls behind on
+its own, without holding up ingestion or the other consumers. What happens
+when a subscriber's queue is full depends on its policy:
+  drop-oldest - discard the oldest queued batch
+  decimate    - discard every other queued batch, keeping the newest, so
+                what is left still spans the time it fell behind
+  block       - wait up to block_timeout for room, then discard the new batch
+
+Each subscription counts the batches it was sent, handled and discarded,
+and how far behind it is.
+"""
+import time
+import threading
+import collections
+
+POLICIES = ('drop-oldest', 'decimate', 'block')
+
+# A batch as published by the log reader, in device coordinates. 'filtered'
+# is the same as 'points' unless a filter chain is in use.
+ParsedBatch = collections.namedtuple('ParsedBatch', ['times', 'points', 'filtered', 'gapTimes', 'gaps'])
+
+class Subscription(object):
+    def __init__(self, name, handler, maxsize=64, policy='drop-oldest', block_timeout=0.5, wrap=None):
+        super(Subscription, self).__init__()
+        if policy not in POLICIES:
+            raise ValueError("Unknown drop policy: %s" % policy)
+        self.name = name
+        self.handler = handler
+        self.maxsize = max(int(maxsize), 1)
+        self.policy = policy
+        self.blockTimeout = block_timeout
+
+        # Counters: batches published to this subscriber, handled and dropped,
+        # samples dropped, and batches whose handler raised
+        self.published = 0
+        self.handled = 0
+        self.dropped = 0
+        self.droppedSamples = 0
+        self.errors = 0
+        # Seconds the last handled batch spent queued, and the longest any has
+        self.latency = 0.0
+        self.maxLatency = 0.0
+
+        # Queued (publish time, samples, batch), oldest first
+        self._queue = collections.deque()
+        self._condition = threading.Condition()
+        self._running = True
+        target = wrap(name, self._run) if wrap else self._run
+        self._thread = threading.Thread(target=target, name='bus-' + name)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _drop(self, samples):
+        self.dropped += 1
+        self.droppedSamples += samples
+
+    def offer(self, batch, samples, now):
+        """Queue a batch, applying the drop policy if the queue is full"""
+        with self._condition:
+            self.published += 1
+            if len(self._queue) >= self.maxsize:
+                if self.policy == 'block':
+                    deadline = now + self.blockTimeout
+                    while len(self._queue) >= self.maxsize and self._running:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            break
+                        self._condition.wait(remaining)
+                    if len(self._queue) >= self.maxsize:
+                        self._drop(samples)
+                        return
+                elif self.policy == 'decimate' and len(self._queue) > 1:
+                    newestFirst = list(self._queue)[::-1]
+                    for _, droppedSamples, _ in newestFirst[1::2]:
+                        self._drop(droppedSamples)
+                    self._queue = collections.deque(newestFirst[::2][::-1])
+                else:
+                    _, droppedSamples, _ = self._queue.popleft()
+                    self._drop(droppedSamples)
+            self._queue.append((now, samples, batch))
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._queue and self._running:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                published, _, batch = self._queue.popleft()
+                # Wake a publisher waiting for room
+                self._condition.notify_all()
+            self.latency = time.monotonic() - published
+            self.maxLatency = max(self.maxLatency, self.latency)
+            try:
+                self.handler(batch)
+            except Exception as e:
+                self.errors += 1
+                print("Error in %s subscriber: %s" % (self.name, e))
+            self.handled += 1
+
+    def lag(self):
+        """Batches waiting to be handled"""
+        return len(self._queue)
+
+    def lagSeconds(self):
+        """How long the oldest waiting batch has been queued"""
+        with self._condition:
+            return time.monotonic() - self._queue[0][0] if self._queue else 0.0
+
+    def stop(self, timeout=0.5):
+        """Stop the thread, discarding anything still queued"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def __repr__(self):
+        return ("Subscription(%s, %s, published=%d, handled=%d, dropped=%d, lag=%d)" %
+                (self.name, self.policy, self.published, self.handled, self.dropped, self.lag()))
+
+
+class StreamBus(object):
+    def __init__(self, wrap=None):
+        super(StreamBus, self).__init__()
+        # Optional function of (name, target) returning a thread target, e.g.
+        # to profile each subscriber's thread
+        self.wrap = wrap
+        self.subscriptions = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, name, handler, maxsize=64, policy='drop-oldest', block_timeout=0.5):
+        """Call handler(batch) on a new thread for every batch published from now on"""
+        subscription = Subscription(name, handler, maxsize=maxsize, policy=policy,
+                                    block_timeout=block_timeout, wrap=self.wrap)
+        with self._lock:
+            self.subscriptions = self.subscriptions + [subscription]
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self.subscriptions = [s for s in self.subscriptions if s is not subscription]
+        subscription.stop()
+
+    def publish(self, batch, samples=0):
+        """Offer a batch, of 'samples' samples, to every subscriber"""
+        now = time.monotonic()
+        for subscription in self.subscriptions:
+            subscription.offer(batch, samples, now)
+
+    def close(self):
+        with self._lock:
+            subscriptions, self.subscriptions = self.subscriptions, []
+        for subscription in subscriptions:
+            subscription.stop()
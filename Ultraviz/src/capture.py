@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+# Reading and writing of capture files: timestamped X-Y-Z-I-ID samples
+# saved as a compressed NumPy .npz archive.
+----------------------------------------------------------
+"""
+import os
+import time
+import numpy as np
+
+def saveCapture(path, times, points, **metadata):
+    """Save (N,) times and (N,5) X-Y-Z-I-ID points, plus any metadata values"""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    np.savez_compressed(path, times=np.asarray(times, dtype=np.float64),
+                        points=np.asarray(points, dtype=np.float32), **metadata)
+    return path
+
+def loadCapture(path):
+    """Returns (times, points, metadata) from a capture file"""
+    with np.load(path) as capture:
+        metadata = {key: capture[key] for key in capture.files if key not in ('times', 'points')}
+        return capture['times'], capture['points'], metadata
+
+def captureFileName(directory, number, prefix='capture'):
+    """A time-ordered file name for capture 'number' in directory"""
+    stamp = time.strftime('%Y%m%d-%H%M%S')
+    return os.path.join(directory, '%s_%s_%06d.npz' % (prefix, stamp, number))
@@ -0,0 +1,164 @@
+# -*- coding: utf-8 -*-
+"""
+# Colour and size mapping of control points for rendering.
+----------------------------------------------------------
+Colour maps are precomputed 256 entry uint8 RGBA lookup tables, indexed by
+a value mapped to 0-255: intensity, age within the plotted window, speed,
+or control point ID. RenderAttributes evaluates the mapping on the thread
+that produces the data, into two preallocated sets of arrays, so the GUI
+thread only has to swap to the newest set and upload it.
+"""
+import threading
+import numpy as np
+
+# Anchor colours (RGB, 0-255) which are interpolated to make each table
+COLORMAP_ANCHORS = {
+    'white':     [(255, 255, 255), (255, 255, 255)],
+    'ultraleap': [(0, 60, 35), (0, 207, 117), (190, 255, 220)],
+    'viridis':   [(68, 1, 84), (59, 82, 139), (33, 145, 140), (94, 201, 98), (253, 231, 37)],
+    'plasma':    [(13, 8, 135), (126, 3, 168), (204, 71, 120), (248, 149, 64), (240, 249, 33)],
+    'heat':      [(40, 0, 0), (200, 30, 0), (255, 160, 0), (255, 255, 200)],
+}
+
+# Distinct colours for control point IDs, repeated across the table
+CATEGORICAL_COLORS = [(0, 207, 117), (255, 127, 14), (31, 119, 180), (214, 39, 40), (148, 103, 189),
+                      (140, 86, 75), (227, 119, 194), (188, 189, 34), (23, 190, 207), (127, 127, 127)]
+
+COLOR_MODES = ('intensity', 'age', 'speed', 'controlPoint', 'deviation')
+
+def makeLUT(name):
+    """Returns a (256,4) uint8 RGBA lookup table for a named colour map"""
+    if name == 'categorical':
+        colors = np.array(CATEGORICAL_COLORS, dtype=np.float64)
+        rgb = colors[np.arange(256) % len(colors)]
+    else:
+        anchors = np.array(COLORMAP_ANCHORS[name], dtype=np.float64)
+        positions = np.linspace(0, 255, len(anchors))
+        rgb = np.stack([np.interp(np.arange(256), positions, anchors[:, c]) for c in range(3)], axis=1)
+    lut = np.empty((256, 4), dtype=np.uint8)
+    lut[:, 0:3] = np.round(rgb)
+    lut[:, 3] = 255
+    return lut
+
+
+class RenderAttributes(object):
+    def __init__(self, capacity, color_mode='intensity', colormap='white', speed_range=500.0, deviation_range=0.005):
+        super(RenderAttributes, self).__init__()
+        self.capacity = capacity
+        self.speedRange = speed_range
+        # Deviation from a reference capture, in metres, mapped to the top of the colour map
+        self.deviationRange = deviation_range
+        self.setColorMode(color_mode, colormap)
+
+        # Two sets of preallocated (pos, color, size) arrays
+        self._buffers = [(np.zeros((capacity, 3), dtype=np.float32),
+                          np.zeros((capacity, 4), dtype=np.float32),
+                          np.zeros(capacity, dtype=np.float32)) for _ in range(2)]
+        self._counts = [0, 0]
+        self._lock = threading.Lock()
+
+        # Only one thread may fill the back set at a time
+        self._writing = threading.Lock()
+
+        # The set the GUI is showing, and the newest finished set not yet shown
+        self._front = 0
+        self._ready = None
+
+        # True if data changed while the GUI hadn't taken the last set
+        self.stale = False
+
+    def setColorMode(self, color_mode, colormap=None):
+        if color_mode not in COLOR_MODES:
+            raise ValueError("Unknown colour mode: %s" % color_mode)
+        self.colorMode = color_mode
+        if colormap:
+            self.colormap = colormap
+        if color_mode == 'controlPoint':
+            self.lut = makeLUT('categorical')
+        elif color_mode == 'deviation' and self.colormap == 'white':
+            # Distance can't be shown in a single colour
+            self.lut = makeLUT('heat')
+        else:
+            self.lut = makeLUT(self.colormap)
+        # OpenGL takes float colours, so keep a normalised copy of the table
+        self._lutFloat = self.lut.astype(np.float32) / 255.0
+        self.stale = True
+
+    def update(self, times, pts, force=False, deviations=None):
+        """Map X-Y-Z-I-ID rows, and optionally each row's deviation from a
+        reference, to render attributes. Skipped, and marked stale, if the GUI
+        hasn't yet taken the previous set, unless force is given."""
+        if not self._writing.acquire(blocking=False):
+            self.stale = True
+            return False
+        try:
+            with self._lock:
+                if self._ready is not None and not force:
+                    self.stale = True
+                    return False
+                back = 1 - self._front
+                self._ready = None
+            self._fill(back, times, pts, deviations)
+        finally:
+            self._writing.release()
+        return True
+
+    def _fill(self, back, times, pts, deviations=None):
+        n = min(len(pts), self.capacity)
+        times, pts = times[-n:], pts[-n:]
+        if deviations is not None:
+            deviations = deviations[-n:]
+        pos, color, size = self._buffers[back]
+        np.copyto(pos[:n], pts[:, 0:3])
+        np.take(self._lutFloat, self._colorIndex(times, pts, deviations), axis=0, out=color[:n])
+        # Fade out low intensity points, as before
+        color[:n, 3] *= pts[:, 3]
+        np.multiply(pts[:, 3], 10, out=size[:n])
+
+        with self._lock:
+            self._counts[back] = n
+            self._ready = back
+            self.stale = False
+
+    def acquire(self):
+        """Swap to the newest set, returning (pos, color, size) views, or None if there's nothing new"""
+        with self._lock:
+            if self._ready is None:
+                return None
+            self._front = self._ready
+            self._ready = None
+        pos, color, size = self._buffers[self._front]
+        n = self._counts[self._front]
+        return pos[:n], color[:n], size[:n]
+
+    def _colorIndex(self, times, pts, deviations=None):
+        """Map rows to 0-255 lookup table indices for the current colour mode"""
+        if self.colorMode == 'intensity':
+            value = pts[:, 3]
+        elif self.colorMode == 'age':
+            span = times[-1] - times[0] if len(times) else 0
+            value = (times - times[0]) / span if span > 0 else np.ones(len(times))
+        elif self.colorMode == 'speed':
+            value = self._speed(times, pts) / self.speedRange
+        elif self.colorMode == 'deviation':
+            if deviations is None:
+                return np.zeros(len(pts), dtype=np.int64)
+            value = deviations / self.deviationRange
+        else:
+            return pts[:, 4].astype(np.int64) % 256
+        return np.clip(value * 255, 0, 255).astype(np.int64)
+
+    def _speed(self, times, pts):
+        """Speed of each row since the previous row of the same control point"""
+        speed = np.zeros(len(pts))
+        if len(pts) < 2:
+            return speed
+        order = np.argsort(pts[:, 4], kind='stable')
+        sortedPos = pts[order, 0:3]
+        sortedTimes = times[order]
+        distance = np.linalg.norm(np.diff(sortedPos, axis=0), axis=1)
+        elapsed = np.diff(sortedTimes)
+        sameControlPoint = np.diff(pts[order, 4]) == 0
+        valid = sameControlPoint & (elapsed > 0)
+        speed[order[1:][valid]] = distance[valid] / elapsed[valid]
+        return speed
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Comparing a session against a reference capture
+----------------------------------------------------------
+KDTree answers batched nearest-neighbour queries against a fixed set of
+points. The tree is a balanced, implicit one, built a level at a time, and
+every query in a batch is walked down it together: first straight to its
+own leaf, for a bound on its distance, then down every branch whose box is
+nearer than that bound.
+
+A path repeated many times puts many samples in almost the same place,
+which would make every query visit many leaves, so reference points
+closer together than a small resolution are merged first.
+
+SessionComparison keeps running RMS and maximum deviations of live samples
+from the reference, and recomputes the Hausdorff distance between the
+reference and the most recent samples on a background thread.
+
+Compare two capture files with:
+$ python3 compare.py reference.npz other.npz
+"""
+import time
+import threading
+import argparse
+import numpy as np
+
+from buffer import TimestampedBuffer
+from capture import loadCapture
+
+class KDTree(object):
+    # Points per leaf, roughly
+    LEAF_SIZE = 16
+
+    def __init__(self, points):
+        super(KDTree, self).__init__()
+        points = np.asarray(points, dtype=np.float64)[:, 0:3]
+        n = len(points)
+        self.depth = int(np.ceil(np.log2(n / float(self.LEAF_SIZE)))) if n > self.LEAF_SIZE else 0
+        nodes = 2 ** (self.depth + 1) - 1
+        # Nodes are numbered as in a heap: the children of node i are 2i+1 and 2i+2
+        self.axis = np.zeros(nodes, dtype=np.int64)
+        self.split = np.zeros(nodes)
+        self.lower = np.zeros((nodes, 3))
+        self.upper = np.zeros((nodes, 3))
+
+        # Sort each level's nodes along their widest axis, then halve them
+        order = np.arange(n)
+        for level in range(self.depth):
+            first = 2 ** level - 1
+            bounds = self.levelBounds(level, n)
+            segment = np.repeat(np.arange(2 ** level), np.diff(bounds))
+            p = points[order]
+            spread = np.maximum.reduceat(p, bounds[:-1]) - np.minimum.reduceat(p, bounds[:-1])
+            axis = np.argmax(spread, axis=1)
+            key = p[np.arange(n), axis[segment]]
+            sort = np.lexsort((key, segment))
+            order = order[sort]
+            key = key[sort]
+            self.axis[first:first + 2 ** level] = axis
+            # Values at or above the split are in the right child
+            self.split[first:first + 2 ** level] = key[self.levelBounds(level + 1, n)[1::2]]
+
+        self.order = order
+        self.points = points[order]
+        # Bounding boxes of every node, for pruning
+        for level in range(self.depth + 1):
+            first = 2 ** level - 1
+            bounds = self.levelBounds(level, n)
+            if n:
+                self.lower[first:first + 2 ** level] = np.minimum.reduceat(self.points, bounds[:-1])
+                self.upper[first:first + 2 ** level] = np.maximum.reduceat(self.points, bounds[:-1])
+        self.leafBounds = self.levelBounds(self.depth, n)
+
+    @staticmethod
+    def levelBounds(level, n):
+        """start of each node at 'level' in the sorted points, and the end of the last"""
+        return (np.arange(2 ** level + 1) * n) // 2 ** level
+
+    def __len__(self):
+        return len(self.points)
+
+    def _leafDistances(self, owner, leaf, queries, best, nearest):
+        """update each query's best squared distance from the points in the given leaves"""
+        starts = self.leafBounds[leaf]
+        lengths = self.leafBounds[leaf + 1] - starts
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) - np.repeat(offsets - starts, lengths)
+        owner = np.repeat(owner, lengths)
+        d = self.points[positions] - queries[owner]
+        distance = np.einsum('ij,ij->i', d, d)
+        np.minimum.at(best, owner, distance)
+        match = distance <= best[owner]
+        nearest[owner[match]] = positions[match]
+
+    def query(self, queries):
+        """Returns (distances, indices) of the nearest point to each (N,>=3) query row.
+
+        Indices refer to the rows of the points the tree was built from.
+        """
+        queries = np.asarray(queries, dtype=np.float64)[:, 0:3]
+        count = len(queries)
+        best = np.full(count, np.inf)
+        nearest = np.zeros(count, dtype=np.int64)
+        if len(self.points) == 0 or count == 0:
+            return np.sqrt(best), nearest
+        everyQuery = np.arange(count)
+        leafOffset = 2 ** self.depth - 1
+
+        # Each query's own leaf gives a first bound on its distance
+        node = np.zeros(count, dtype=np.int64)
+        for level in range(self.depth):
+            node = 2 * node + 1 + (queries[everyQuery, self.axis[node]] >= self.split[node])
+        ownLeaf = node - leafOffset
+        self._leafDistances(everyQuery, ownLeaf, queries, best, nearest)
+
+        # Then descend again, keeping only the nodes whose boxes are nearer than that
+        owner, node = everyQuery, np.zeros(count, dtype=np.int64)
+        for level in range(self.depth):
+            owner = np.repeat(owner, 2)
+            node = (2 * np.repeat(node, 2) + 1) + np.tile([0, 1], len(node))
+            q = queries[owner]
+            gap = np.maximum(np.maximum(self.lower[node] - q, q - self.upper[node]), 0)
+            keep = np.einsum('ij,ij->i', gap, gap) < best[owner]
+            owner, node = owner[keep], node[keep]
+        leaf = node - leafOffset
+        other = leaf != ownLeaf[owner]
+        if other.any():
+            self._leafDistances(owner[other], leaf[other], queries, best, nearest)
+        return np.sqrt(best), self.order[nearest]
+
+
+def mergeNearby(points, resolution):
+    """Returns the indices of (N,>=3) rows, keeping the first in each cube of side 'resolution'"""
+    points = np.asarray(points, dtype=np.float64)[:, 0:3]
+    if len(points) == 0:
+        return np.zeros(0, dtype=np.int64)
+    cells = np.floor((points - points.min(axis=0)) / resolution).astype(np.int64)
+    return np.sort(np.unique(cells, axis=0, return_index=True)[1])
+
+
+class SessionComparison(object):
+    def __init__(self, reference, recent=65536, interval=1.0, resolution=None):
+        super(SessionComparison, self).__init__()
+        # (N,>=3) reference points, in device coordinates, with nearby points
+        # merged. Deviations are exact to within 'resolution', by default
+        # 1/1024 of the reference's extent.
+        reference = np.asarray(reference, dtype=np.float64)[:, 0:3]
+        if resolution is None and len(reference):
+            resolution = max(float((reference.max(axis=0) - reference.min(axis=0)).max()) / 1024.0, 1e-9)
+        self.resolution = resolution
+        self.reference = reference[mergeNearby(reference, resolution)] if resolution else reference
+        self.index = KDTree(self.reference)
+
+        # Running statistics of every sample's deviation from the reference
+        self.count = 0
+        self.sumSquares = 0.0
+        self.maxDeviation = 0.0
+        self._lock = threading.Lock()
+
+        # Recent samples and their deviations, as X-Y-Z-deviation rows, for the Hausdorff distance
+        self.recent = TimestampedBuffer(size=recent, width=4)
+
+        # Latest summary, as a dict, refreshed every 'interval' seconds
+        self.summary = None
+        self.interval = interval
+        self._running = False
+
+    def add(self, times, points):
+        """Returns the deviation of each (N,>=3) row from the reference"""
+        points = np.asarray(points)
+        deviations, _ = self.index.query(points)
+        if len(deviations):
+            rows = np.empty((len(points), 4), dtype=np.float32)
+            rows[:, 0:3] = points[:, 0:3]
+            rows[:, 3] = deviations
+            with self._lock:
+                self.count += len(deviations)
+                self.sumSquares += float(np.dot(deviations, deviations))
+                self.maxDeviation = max(self.maxDeviation, float(deviations.max()))
+                self.recent.record(rows, times)
+        return deviations
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.sumSquares = 0.0
+            self.maxDeviation = 0.0
+            self.recent.clear_all()
+        self.summary = None
+
+    def rms(self):
+        return np.sqrt(self.sumSquares / self.count) if self.count else 0.0
+
+    def hausdorff(self, points, deviations=None):
+        """Hausdorff distance between the reference and (N,>=3) rows, given their deviations if known"""
+        if len(points) == 0:
+            return np.inf
+        if deviations is None:
+            deviations, _ = self.index.query(points)
+        backward, _ = KDTree(points).query(self.reference)
+        return max(float(deviations.max()), float(backward.max()))
+
+    def update(self):
+        """Recompute the summary"""
+        with self._lock:
+            times, rows = self.recent.latest()
+            rows = rows.copy()
+            summary = {'samples': self.count, 'rms': self.rms(), 'max': self.maxDeviation}
+        summary['hausdorff'] = self.hausdorff(rows[:, 0:3], rows[:, 3]) if len(rows) else None
+        summary['recent'] = len(rows)
+        self.summary = summary
+        return summary
+
+    def start(self):
+        """Refresh the summary on a background thread"""
+        def refresh():
+            while self._running:
+                try:
+                    self.update()
+                except Exception as e:
+                    print("Unable to compare with the reference: " + str(e))
+                time.sleep(self.interval)
+        self._running = True
+        thread = threading.Thread(target=refresh, name='comparison')
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        self._running = False
+
+
+def compareCaptures(reference_path, other_path):
+    """Returns (summary, deviations of each sample in the other capture)"""
+    _, reference, _ = loadCapture(reference_path)
+    times, points, _ = loadCapture(other_path)
+    comparison = SessionComparison(reference, recent=max(len(points), 1))
+    deviations = comparison.add(times, points)
+    return comparison.update(), deviations
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare a capture with a reference capture.')
+    parser.add_argument('reference', help='The reference capture (.npz).')
+    parser.add_argument('other', help='The capture to compare with it (.npz).')
+    parser.add_argument('-o', '--output', required=False, help='Also save each sample\'s deviation to this .npz file.')
+    args = parser.parse_args()
+
+    start = time.time()
+    summary, deviations = compareCaptures(args.reference, args.other)
+    print("Samples:    %d" % summary['samples'])
+    print("RMS:        %.3f mm" % (summary['rms'] * 1000))
+    print("Max:        %.3f mm" % (summary['max'] * 1000))
+    if summary['hausdorff'] is not None:
+        print("Hausdorff:  %.3f mm" % (summary['hausdorff'] * 1000))
+    print("Compared in %.2f s" % (time.time() - start))
+    if args.output:
+        np.savez_compressed(args.output, deviations=deviations)
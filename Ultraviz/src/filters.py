@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+# Smoothing filters for control point positions
+----------------------------------------------------------
+A FilterChain runs a list of filters over each parsed batch of X-Y-Z-I-ID
+rows, in device coordinates, keeping each control point's samples apart
+and carrying each filter's state for it from one batch to the next.
+
+Each filter works on a control point's whole run of samples in a batch:
+  average     - moving average of the last N samples
+  exponential - exponential smoothing with a time constant, so irregular
+                sample intervals are weighted correctly
+  oneeuro     - the One-Euro filter: exponential smoothing whose cutoff
+                rises with speed, for low jitter at rest and low lag in motion
+  kalman      - constant velocity Kalman filter
+
+The recursive filters are evaluated with linearScan, which solves a first
+order linear recurrence for a whole batch with cumulative products and
+sums. The Kalman filter uses its steady-state gain for the batch's sample
+interval (log timestamps are spread evenly over each chunk read), which
+makes it a fixed linear system, applied by convolution.
+"""
+import numpy as np
+
+# Recurrences are evaluated in blocks, short enough that the running product
+# of their decays can't underflow
+SCAN_BLOCK = 64
+MIN_DECAY = 1e-4
+
+def linearScan(decay, drive, initial):
+    """y[n] = decay[n] * y[n-1] + drive[n] for (N,) decay and (N,D) drive, from y[-1] = initial"""
+    out = np.empty(drive.shape)
+    y = np.asarray(initial, dtype=np.float64)
+    for start in range(0, len(decay), SCAN_BLOCK):
+        end = min(start + SCAN_BLOCK, len(decay))
+        product = np.cumprod(np.maximum(decay[start:end], MIN_DECAY))[:, None]
+        out[start:end] = product * (y + np.cumsum(drive[start:end] / product, axis=0))
+        y = out[end - 1]
+    return out
+
+def intervals(last_time, times):
+    """Time since the previous sample of each of (N,) times, 0 for the first ever"""
+    previous = np.empty(len(times))
+    previous[0] = times[0] if last_time is None else last_time
+    previous[1:] = times[:-1]
+    return np.maximum(times - previous, 0)
+
+def smoothingFactor(dt, cutoff):
+    """The weight of a new sample in exponential smoothing with a cutoff frequency, in Hz"""
+    tau = 1.0 / (2 * np.pi * cutoff)
+    return 1.0 / (1.0 + tau / np.maximum(dt, 1e-12)) * (dt > 0)
+
+
+class MovingAverageFilter(object):
+    def __init__(self, window=8):
+        super(MovingAverageFilter, self).__init__()
+        self.window = max(int(window), 1)
+        # Per control point, its last window-1 samples
+        self._state = {}
+
+    def run(self, key, times, xyz):
+        tail = self._state.get(key, np.zeros((0, 3)))
+        x = np.concatenate((tail, xyz))
+        sums = np.concatenate((np.zeros((1, 3)), np.cumsum(x, axis=0)))
+        end = np.arange(len(tail), len(x)) + 1
+        start = np.maximum(end - self.window, 0)
+        self._state[key] = x[len(x) - min(self.window - 1, len(x)):]
+        return (sums[end] - sums[start]) / (end - start)[:, None]
+
+    def reset(self):
+        self._state = {}
+
+    def __repr__(self):
+        return "MovingAverageFilter(%d)" % self.window
+
+
+class ExponentialFilter(object):
+    def __init__(self, time_constant=0.005):
+        super(ExponentialFilter, self).__init__()
+        # In seconds
+        self.timeConstant = time_constant
+        # Per control point, (last sample time, last output)
+        self._state = {}
+
+    def run(self, key, times, xyz):
+        lastTime, y = self._state.get(key, (None, xyz[0]))
+        decay = np.exp(-intervals(lastTime, times) / self.timeConstant)
+        out = linearScan(decay, (1 - decay)[:, None] * xyz, y)
+        self._state[key] = (times[-1], out[-1])
+        return out
+
+    def reset(self):
+        self._state = {}
+
+    def __repr__(self):
+        return "ExponentialFilter(%g)" % self.timeConstant
+
+
+class OneEuroFilter(object):
+    def __init__(self, min_cutoff=1.0, beta=0.0, derivative_cutoff=1.0):
+        super(OneEuroFilter, self).__init__()
+        # Cutoffs in Hz; beta in Hz per metre/s of speed
+        self.minCutoff = min_cutoff
+        self.beta = beta
+        self.derivativeCutoff = derivative_cutoff
+        # Per control point, (last sample time, last sample, last output, last smoothed velocity)
+        self._state = {}
+
+    def run(self, key, times, xyz):
+        lastTime, x, y, velocity = self._state.get(key, (None, xyz[0], xyz[0], np.zeros(3)))
+        dt = intervals(lastTime, times)
+        # Velocity is taken between raw samples, rather than from the previous
+        # output as in the original filter, so both stages are linear
+        # recurrences with coefficients known for the whole batch
+        previous = np.concatenate((x[None, :], xyz[:-1]))
+        raw = (xyz - previous) / np.maximum(dt, 1e-12)[:, None]
+        alpha = smoothingFactor(dt, self.derivativeCutoff)
+        velocity = linearScan(1 - alpha, alpha[:, None] * raw, velocity)
+        cutoff = self.minCutoff + self.beta * np.sqrt(np.einsum('ij,ij->i', velocity, velocity))
+        alpha = smoothingFactor(dt, cutoff)
+        out = linearScan(1 - alpha, alpha[:, None] * xyz, y)
+        self._state[key] = (times[-1], xyz[-1], out[-1], velocity[-1])
+        return out
+
+    def reset(self):
+        self._state = {}
+
+    def __repr__(self):
+        return "OneEuroFilter(%g, %g, %g)" % (self.minCutoff, self.beta, self.derivativeCutoff)
+
+
+class KalmanFilter(object):
+    # Impulse responses are cut off once they have decayed by this much
+    TOLERANCE = 1e-12
+
+    def __init__(self, measurement_noise=0.001, acceleration=10.0):
+        super(KalmanFilter, self).__init__()
+        # Standard deviations: of each measured position, in metres, and of
+        # the acceleration between samples, in metres/s^2
+        self.measurementNoise = measurement_noise
+        self.acceleration = acceleration
+        # Per control point, (last sample time, 2x3 position and velocity)
+        self._state = {}
+        # Powers of the system matrix and impulse response for the last sample
+        # interval used, and whether they reach TOLERANCE, so suit longer batches too
+        self._cache = (None, None, None, False)
+
+    def gains(self, dt):
+        """Steady-state (position, velocity) gains for samples dt apart, with
+        acceleration as white noise held over each interval"""
+        tracking = self.acceleration * dt * dt / self.measurementNoise
+        root = np.sqrt(tracking * tracking + 8 * tracking)
+        alpha = -(tracking * tracking + 8 * tracking - (tracking + 4) * root) / 8
+        beta = (tracking * tracking + 4 * tracking - tracking * root) / 4
+        return np.array([alpha, beta / dt])
+
+    def _system(self, dt, n):
+        """Powers 0..n of the updated state's transition matrix, and its response to a measurement"""
+        key, powers, response, complete = self._cache
+        if key == dt and (complete or len(powers) > n):
+            return powers[:n + 1], response[:n + 1]
+        gain = self.gains(dt)
+        # Predict with constant velocity, then correct by the gain times the error
+        transition = np.array([[1.0, dt], [0.0, 1.0]])
+        a = transition - np.outer(gain, [1.0, 0.0]).dot(transition)
+        radius = max(np.abs(np.linalg.eigvals(a)).max(), 1e-9)
+        decayed = n + 1 if radius >= 1 else int(np.log(self.TOLERANCE) / np.log(radius)) + 2
+        length = min(n + 1, decayed)
+        powers = np.identity(2)[None, :, :]
+        while len(powers) < length:
+            powers = np.concatenate((powers, np.matmul(powers, np.linalg.matrix_power(a, len(powers)))))
+        powers = powers[:max(length, 1)]
+        response = np.matmul(powers, gain)
+        self._cache = (dt, powers, response, decayed <= n + 1)
+        return powers, response
+
+    def run(self, key, times, xyz):
+        lastTime, state = self._state.get(key, (None, np.vstack((xyz[0], np.zeros(3)))))
+        dt = intervals(lastTime, times)
+        dt = dt[dt > 0]
+        if len(dt) == 0:
+            # Keep the time, so the next batch has an interval from this one
+            self._state[key] = (times[-1], state)
+            return np.repeat(state[0:1], len(xyz), axis=0)
+        # Rounded, so that batches at the same rate share the cached system
+        dt = float('%.3g' % np.median(dt))
+        n = len(xyz)
+        powers, response = self._system(dt, n)
+        length = len(response)
+
+        # Each state is the previous batch's last one carried forward, plus
+        # the response to every measurement since
+        size = 1 << int(np.ceil(np.log2(n + length)))
+        measurements = np.fft.rfft(xyz, size, axis=0)
+        out = np.empty((n, 2, 3))
+        for row in range(2):
+            out[:, row] = np.fft.irfft(measurements * np.fft.rfft(response[:, row], size)[:, None], size, axis=0)[:n]
+        carried = min(n, length - 1)
+        out[:carried] += np.matmul(powers[1:carried + 1], state)
+        self._state[key] = (times[-1], out[-1])
+        return out[:, 0]
+
+    def reset(self):
+        self._state = {}
+
+    def __repr__(self):
+        return "KalmanFilter(%g, %g)" % (self.measurementNoise, self.acceleration)
+
+
+FILTERS = {
+    'average':     (MovingAverageFilter, (8,)),
+    'exponential': (ExponentialFilter, (0.005,)),
+    'oneeuro':     (OneEuroFilter, (1.0, 0.0, 1.0)),
+    'kalman':      (KalmanFilter, (0.001, 10.0)),
+}
+
+def parseFilter(spec):
+    """Create a filter from a command line spec: a name from FILTERS, optionally
+    followed by parameters, e.g. 'average:16', 'exponential:0.01' (seconds),
+    'oneeuro:1,0.5,1' (Hz, Hz per m/s, Hz) or 'kalman:0.001,10' (m, m/s^2)."""
+    name, _, parameters = spec.replace(' ', '').partition(':')
+    if name not in FILTERS:
+        raise ValueError("Unrecognised filter: %s (choose from %s)" % (spec, ', '.join(sorted(FILTERS))))
+    cls, defaults = FILTERS[name]
+    values = [float(value) for value in parameters.split(',')] if parameters else []
+    if len(values) > len(defaults):
+        raise ValueError("Too many parameters for %s filter: %s" % (name, spec))
+    return cls(*(values + list(defaults[len(values):])))
+
+
+class FilterChain(object):
+    def __init__(self, filters):
+        super(FilterChain, self).__init__()
+        # Applied in order
+        self.filters = list(filters)
+
+    def apply(self, times, points):
+        """Returns a copy of (N,5) X-Y-Z-I-ID rows with each control point's positions filtered"""
+        out = np.array(points, dtype=np.float32)
+        if len(out) == 0 or not self.filters:
+            return out
+        ids = out[:, 4]
+        for key in np.unique(ids):
+            rows = np.flatnonzero(ids == key)
+            t = np.asarray(times, dtype=np.float64)[rows]
+            xyz = out[rows, 0:3].astype(np.float64)
+            for f in self.filters:
+                xyz = f.run(key, t, xyz)
+            out[rows, 0:3] = xyz
+        return out
+
+    def reset(self):
+        for f in self.filters:
+            f.reset()
+
+    def __repr__(self):
+        return "FilterChain(%s)" % ', '.join(repr(f) for f in self.filters)
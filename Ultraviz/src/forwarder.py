@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Ultraviz log forwarder - tails the Ultrahaptics SDK log on the device host
+# and ships it to an Ultraviz instance started with --listen on another host.
+# Only needs the Python standard library, plus network.py from this directory.
+#
+# Usage:
+#   $ UH_LOG_DEST=/tmp/uhsdk_log python3 forwarder.py --host=visualizer-host
+#   $ python3 forwarder.py --host=visualizer-host -e=/path/to/my/process
+import os
+import sys
+import time
+import stat
+import select
+import argparse
+import tempfile
+from subprocess import Popen
+
+from network import LogForwarder, DEFAULT_PORT
+
+class LogTail(object):
+    """Reads new data from UH_LOG_DEST, which may be a fifo or a regular file"""
+    def __init__(self, path, chunk_bytes=64*1024):
+        self.path = path
+        self.chunkBytes = chunk_bytes
+        self.fd = None
+
+        if not os.path.exists(path):
+            os.mkfifo(path)
+        self.isFifo = stat.S_ISFIFO(os.stat(path).st_mode)
+
+    def read(self, timeout):
+        """Returns new data, b'' if nothing arrived within timeout seconds,
+        or None if the writer closed the fifo"""
+        if self.fd is None:
+            # Opening a fifo blocks until the SDK opens it for writing
+            self.fd = os.open(self.path, os.O_RDONLY)
+            if not self.isFifo:
+                os.lseek(self.fd, 0, os.SEEK_END)
+
+        if self.isFifo:
+            readable, _, _ = select.select([self.fd], [], [], timeout)
+            if not readable:
+                return b''
+            data = os.read(self.fd, self.chunkBytes)
+            if not data:
+                # Writer has gone, wait for the next one
+                os.close(self.fd)
+                self.fd = None
+                return None
+            return data
+
+        data = os.read(self.fd, self.chunkBytes)
+        if not data:
+            time.sleep(timeout)
+        return data
+
+
+def terminated(data):
+    return data if data.endswith(b'\n') else data + b'\n'
+
+
+def send(forwarder, data, retry_interval=1.0):
+    """Send data, reconnecting for as long as it takes if the connection is lost"""
+    lost = False
+    while True:
+        try:
+            if forwarder.sock is None:
+                forwarder.connect()
+            forwarder.send(data)
+            if lost:
+                print("Reconnected to %s:%d" % forwarder.address)
+            return
+        except OSError as e:
+            if not lost:
+                print("Lost connection to %s:%d (%s), reconnecting" % (forwarder.address + (e,)))
+                lost = True
+            forwarder.close()
+            time.sleep(retry_interval)
+
+
+def forward(tail, forwarder, batch_bytes, interval):
+    pending = b''
+    lastSend = time.monotonic()
+    try:
+        while True:
+            data = tail.read(interval)
+            closed = data is None
+            if data:
+                pending += data
+
+            # Only whole lines are sent, so each frame can be parsed on its own.
+            # Once the writer has closed the fifo, its last line is whole too.
+            now = time.monotonic()
+            if len(pending) >= batch_bytes or (pending and (closed or now - lastSend >= interval)):
+                end = len(pending) if closed else pending.rfind(b'\n') + 1
+                if end:
+                    send(forwarder, terminated(pending[:end]))
+                    pending = pending[end:]
+                    lastSend = now
+    finally:
+        # Don't lose a partial last line when stopped
+        if pending and forwarder.sock is not None:
+            try:
+                forwarder.send(terminated(pending))
+            except OSError:
+                pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(usage="--host <visualizer host> [-p <port>] [-e <executable path>]")
+    parser.add_argument('--host', required=True, help='The host running Ultraviz with --listen.')
+    parser.add_argument('-p', '--port', type=int, default=DEFAULT_PORT, help='The port Ultraviz is listening on.')
+    parser.add_argument('-u', '--udp', action='store_true', help='Send over UDP instead of TCP. Data may be lost.')
+    parser.add_argument('-c', '--compress', action='store_true', help='zlib compress each batch.')
+    parser.add_argument('--batchBytes', type=int, default=64*1024, help='Send once this much log data is waiting.')
+    parser.add_argument('--interval', type=float, default=0.02, help='Send anything waiting at least this often, in seconds.')
+    parser.add_argument('-e', '--exePath', required=False, help='If specified, launch this executable with its SDK log forwarded.')
+    args = parser.parse_args()
+
+    logDest = os.environ.get("UH_LOG_DEST")
+    if args.exePath or not logDest:
+        logDest = os.path.join(tempfile.mkdtemp(), 'myfifo')
+
+    tail = LogTail(logDest, chunk_bytes=args.batchBytes)
+    forwarder = LogForwarder(args.host, args.port, udp=args.udp, compress=args.compress)
+    forwarder.connect()
+    print("Forwarding %s to %s:%d" % (logDest, args.host, args.port))
+
+    if args.exePath:
+        env = os.environ.copy()
+        env["UH_LOG_LEVEL"] = "4"
+        env["UH_LOG_DEST"] = logDest
+        env["UH_LOG_LEVEL_FORCE"] = "1"
+        env["UH_LOG_DEST_FORCE"] = "1"
+        Popen([args.exePath], env=env, cwd=os.path.dirname(args.exePath))
+    else:
+        print("Set UH_LOG_DEST=%s for the Ultrahaptics application" % logDest)
+
+    try:
+        forward(tail, forwarder, args.batchBytes, args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        forwarder.close()
+        sys.exit(0)
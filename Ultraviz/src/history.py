@@ -0,0 +1,188 @@
+# -*- coding: utf-8 -*-
+"""
+# A multi-resolution history of X-Y-Z-I samples, so that a whole session can
+# be browsed without keeping every sample in memory.
+----------------------------------------------------------
+Tier 0 holds the most recent raw samples. Each further tier summarises
+'factor' consecutive rows of the tier below as one bucket holding the
+min, max and mean of each column, stamped with the time of its first sample.
+Every tier is a fixed-size ring, and coarser tiers reach further back in
+time. Given an ID column, each control point has its own tiers, so no
+bucket mixes samples of different control points. All tiers of all control
+points share one memory budget, split between at most max_control_points
+sets of tiers. Control points seen after that many aren't recorded.
+"""
+import numpy as np
+from buffer import TimestampedBuffer
+
+class HistoryTier(object):
+    def __init__(self, factor, lowerFactor, capacity, width=4):
+        # Number of raw samples summarised by each row in this tier
+        self.factor = factor
+        self.width = width
+
+        # Rows of the tier below which make up one bucket of this tier
+        self.step = factor // lowerFactor
+
+        # Tier 0 stores raw rows, the others store [min, max, mean] rows
+        self.isRaw = factor == 1
+        self.rows = TimestampedBuffer(size=capacity, width=width if self.isRaw else 3*width)
+
+        # Rows from the tier below which don't yet fill a whole bucket
+        self._pendingTimes = np.zeros(0)
+        self._pendingRows = np.zeros((0, 3*width), dtype=np.float32)
+
+    def add(self, times, minimum, maximum, mean):
+        """Add rows from the tier below. Returns any completed buckets as
+        (times, minimum, maximum, mean), to be passed on to the next tier."""
+        if self.isRaw:
+            self.rows.record(mean, times)
+            return times, minimum, maximum, mean
+
+        times = np.concatenate((self._pendingTimes, times))
+        rows = np.concatenate((self._pendingRows, np.hstack((minimum, maximum, mean))))
+
+        step = self.step
+        complete = (len(times) // step) * step
+        self._pendingTimes = times[complete:]
+        self._pendingRows = rows[complete:]
+        if complete == 0:
+            return self._empty()
+
+        w = self.width
+        grouped = rows[:complete].reshape(-1, step, 3*w)
+        bucketTimes = times[:complete:step]
+        minimum = grouped[:, :, 0:w].min(axis=1)
+        maximum = grouped[:, :, w:2*w].max(axis=1)
+        mean = grouped[:, :, 2*w:3*w].mean(axis=1)
+        self.rows.record(np.hstack((minimum, maximum, mean)), bucketTimes)
+        return bucketTimes, minimum, maximum, mean
+
+    def oldestTime(self):
+        times, _ = self.rows.latest()
+        return times[0] if len(times) else None
+
+    def query(self, start, end):
+        """Returns (times, minimum, maximum, mean) views for start <= time <= end"""
+        times, rows = self.rows.between(start, end)
+        if self.isRaw:
+            return times, rows, rows, rows
+        w = self.width
+        return times, rows[:, 0:w], rows[:, w:2*w], rows[:, 2*w:3*w]
+
+    def countBetween(self, start, end):
+        times, _ = self.rows.latest()
+        return np.searchsorted(times, end, side='right') - np.searchsorted(times, start, side='left')
+
+    def clear(self):
+        self.rows.clear_all()
+        self._pendingTimes = self._pendingTimes[:0]
+        self._pendingRows = self._pendingRows[:0]
+
+    def _empty(self):
+        empty = np.zeros((0, self.width), dtype=np.float32)
+        return np.zeros(0), empty, empty, empty
+
+
+class HistoryPyramid(object):
+    def __init__(self, factors=(1, 16, 256, 4096), width=4, id_column=None,
+                 max_bytes=64*1024*1024, max_control_points=16):
+        super(HistoryPyramid, self).__init__()
+        self.factors = tuple(factors)
+        self.width = width
+
+        # If set, rows are split by the value in this column, e.g. 4 for the
+        # control point ID of X-Y-Z-I-ID rows, each with its own tiers
+        self.idColumn = id_column
+        self.maxControlPoints = max_control_points if id_column is not None else 1
+
+        # Rows per tier, so that every control point's tiers together fit in
+        # max_bytes. Each row is held twice by TimestampedBuffer, with a
+        # float64 time and float32 values, or [min, max, mean] above tier 0.
+        self.rowBytes = sum(2 * (8 + 4 * (width if factor == 1 else 3*width)) for factor in self.factors)
+        self.capacity = max(1, max_bytes // (self.rowBytes * self.maxControlPoints))
+
+        self.tiersById = {}
+
+        # Control points not recorded because max_control_points were already
+        self.ignored = set()
+
+    def tiers(self, control_point=0):
+        """The tiers for a control point, created when first needed"""
+        tiers = self.tiersById.get(control_point)
+        if tiers is None:
+            lowerFactors = (1,) + self.factors[:-1]
+            tiers = [HistoryTier(factor, lower, self.capacity, self.width)
+                     for factor, lower in zip(self.factors, lowerFactors)]
+            self.tiersById[control_point] = tiers
+        return tiers
+
+    # Add a batch of timestamped raw samples, updating every tier incrementally
+    def record(self, times, points):
+        if self.idColumn is None:
+            self._record(self.tiers(), times, points)
+            return
+        ids = points[:, self.idColumn]
+        for key in np.unique(ids):
+            key = int(key)
+            if key not in self.tiersById and len(self.tiersById) >= self.maxControlPoints:
+                if key not in self.ignored:
+                    self.ignored.add(key)
+                    print("History: already recording %d control points, not recording %d"
+                          % (self.maxControlPoints, key))
+                continue
+            rows = np.flatnonzero(ids == key)
+            self._record(self.tiers(key), times[rows], points[rows])
+
+    def _record(self, tiers, times, points):
+        data = (times, points, points, points)
+        for tier in tiers:
+            data = tier.add(*data)
+            if len(data[0]) == 0:
+                break
+
+    # Returns (factor, times, minimum, maximum, mean) of one control point for
+    # start <= time <= end, from the finest tier which still covers 'start'
+    # and returns no more than maxPoints rows. Falls back to the coarsest tier.
+    def query(self, start, end, maxPoints=4096, control_point=0):
+        tiers = self.tiersById.get(control_point)
+        if tiers is None:
+            empty = np.zeros((0, self.width), dtype=np.float32)
+            return self.factors[0], np.zeros(0), empty, empty, empty
+        for tier in tiers:
+            oldest = tier.oldestTime()
+            if oldest is None or oldest > start:
+                continue
+            if tier.countBetween(start, end) <= maxPoints:
+                return (tier.factor,) + tier.query(start, end)
+
+        # Nothing covers the whole range, so use whichever reaches furthest back
+        for tier in reversed(tiers):
+            if tier.oldestTime() is not None:
+                return (tier.factor,) + tier.query(start, end)
+        return (tiers[0].factor,) + tiers[0].query(start, end)
+
+    def controlPoints(self):
+        return sorted(self.tiersById)
+
+    def nbytes(self):
+        """Bytes held by the tiers of every control point"""
+        return self.rowBytes * self.capacity * len(self.tiersById)
+
+    def timeRange(self):
+        """Returns the (oldest, newest) times held in the history, or None"""
+        oldest, newest = [], []
+        for tiers in self.tiersById.values():
+            latest = tiers[0].rows.latest(1)[0]
+            if len(latest):
+                newest.append(latest[-1])
+                oldest.extend(t for t in (tier.oldestTime() for tier in tiers) if t is not None)
+        if not newest:
+            return None
+        return min(oldest), max(newest)
+
+    def clear(self):
+        self.ignored.clear()
+        for tiers in self.tiersById.values():
+            for tier in tiers:
+                tier.clear()
@@ -6,7 +6,11 @@
 """
 import platform
 import os
+import re
 import tempfile
+import numpy as np
+
+from buffer import spreadTimestamps
 
 IS_WINDOWS = platform.system().lower() == "windows"
 if IS_WINDOWS:
@@ -16,22 +20,37 @@ if IS_WINDOWS:
         print("*** WARNING: PyWin dependencies not found for Windows - Please install via:\n\n pip3 install --user pywin32 \n")
 
 class SDKLogPipeHandler(object):
-    def __init__(self, is_windows=True):
+    def __init__(self, is_windows=True, pipe_name=None):
         super(SDKLogPipeHandler, self).__init__()
         
         # Do we need Unix/Windows setup?
         self.isWindows = is_windows
 
-        # A default location to create a named pipe
+        # A default location to create a named pipe, unless given one
         # This shall be used instead of writing the SDK Log to a file.
-        if self.isWindows:
+        if pipe_name is not None:
+            self.pipe_name = pipe_name
+        elif self.isWindows:
             self.pipe_name = r'\\.\pipe\UHSDK'
         else:
             tmpdir = tempfile.mkdtemp()
             self.pipe_name = os.path.join(tmpdir, 'myfifo')
 
         self.namedPipe = None
-        self.xyzi_regex = r'\[(-?[0-9.]+),(-?[0-9.]+),(-?[0-9.]+)\] intensity (-?[0-9.]+)'
+        # Optionally preceded by a control point number, e.g. "point 1 ... [x,y,z] intensity i"
+        self.xyzi_regex = r'(?:point[ \t]*#?[ \t]*(\d+)[^\[\n]*)?\[(-?[0-9.]+),(-?[0-9.]+),(-?[0-9.]+)\] intensity (-?[0-9.]+)'
+        # Matched against whole blocks of raw log bytes
+        self.xyzi_pattern = re.compile(self.xyzi_regex.encode(), re.IGNORECASE)
+
+        # Any incomplete line left over from the previous chunk of log data
+        self._partialLine = b''
+
+        # When the previous chunk of log data was read
+        self._lastTimestamp = None
+
+        # Optionally called with each block of complete lines and their times,
+        # e.g. LogStore.append, to keep the log text
+        self.lineSink = None
 
         # Number of bytes to read from SDK Log on Windows
         self.num_bytes = 64*1024
@@ -61,4 +80,77 @@ class SDKLogPipeHandler(object):
 
     def getDataFromNamedPipe(self):
         data = win32file.ReadFile(self.namedPipe, self.num_bytes)
-        return data      
+        return data
+
+    # Returns the complete lines from a chunk of raw log bytes, as one block.
+    # A trailing partial line is held back and prepended to the next chunk.
+    def takeCompleteLines(self, data):
+        data = self._partialLine + data
+        end = data.rfind(b'\n') + 1
+        self._partialLine = data[end:]
+        return data[:end]
+
+    # Returns an (N,5) float32 array of X-Y-Z-I-ID values for the control
+    # points in a block of complete lines, and the line number of each.
+    # The control point ID is 0 if the line doesn't give one.
+    def parseControlPoints(self, block):
+        matches = list(self.xyzi_pattern.finditer(block))
+        if not matches:
+            return np.zeros((0, 5), dtype=np.float32), np.zeros(0, dtype=np.int64)
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+        lines = np.searchsorted(newlines, [match.start() for match in matches])
+        fields = np.array([(match[2], match[3], match[4], match[5], match[1] or b'0') for match in matches])
+        try:
+            points = fields.astype(np.float32)
+        except ValueError:
+            # Some matched text isn't a number (e.g. '1.2.3'), so drop just those matches
+            points, valid = parseFields(fields)
+            lines = lines[valid]
+
+        # Only the first control point on any line counts
+        lines, first = np.unique(lines, return_index=True)
+        return points[first], lines
+
+    # Parse a chunk of raw log data read at 'timestamp'.
+    # Returns (times, points, gapTimes, gaps) where points are X-Y-Z-I-ID rows,
+    # and each gap row is [line count, duration] for a run of lines without
+    # a control point, starting at the matching gapTime.
+    # Lines are given times spread evenly since the previous chunk.
+    def parseChunk(self, data, timestamp):
+        block = self.takeCompleteLines(data)
+        lineCount = block.count(b'\n')
+        if lineCount == 0:
+            return np.zeros(0), np.zeros((0, 5), dtype=np.float32), np.zeros(0), np.zeros((0, 2))
+        lineTimes = spreadTimestamps(self._lastTimestamp, timestamp, lineCount)
+        self._lastTimestamp = timestamp
+        # The raw lines are kept even if parsing them fails
+        if self.lineSink:
+            self.lineSink(block, lineTimes)
+        points, pointLines = self.parseControlPoints(block)
+
+        gapStarts, gapCounts = gapRuns(pointLines, lineCount)
+        gapEnds = gapStarts + gapCounts - 1
+        gaps = np.column_stack((gapCounts, lineTimes[gapEnds] - lineTimes[gapStarts]))
+        return lineTimes[pointLines], points, lineTimes[gapStarts], gaps
+
+
+def parseFields(fields):
+    """Convert the rows of matched fields one at a time, for when some don't
+    parse. Returns the float32 rows which did, and a mask of which they were."""
+    points = np.zeros(fields.shape, dtype=np.float32)
+    valid = np.ones(len(fields), dtype=bool)
+    for row, values in enumerate(fields):
+        try:
+            points[row] = values.astype(np.float32)
+        except ValueError:
+            valid[row] = False
+    return points[valid], valid
+
+def gapRuns(pointLines, lineCount):
+    """Run-length encode the lines without a control point, given the sorted
+    line numbers which have one. Returns (first line, line count) of each run."""
+    bounds = np.concatenate(([-1], pointLines, [lineCount]))
+    counts = np.diff(bounds) - 1
+    starts = bounds[:-1] + 1
+    runs = counts > 0
+    return starts[runs], counts[runs]
@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+# A searchable view of the SDK log text held in a LogStore.
+----------------------------------------------------------
+LogListModel presents a LogStore's lines, or the results of a search, as
+rows of a QAbstractListModel. It fetches a line's text only when the view
+asks for a visible row, so scrolling through millions of lines never
+creates an item per line. The view is a one column QTableView with fixed
+row heights: a QListView lays out every row again whenever rows are added,
+which takes seconds with millions of them. New lines are added to the
+model a batch at a time by a timer, and searches only look at lines which
+arrived since the last one.
+"""
+try:
+    import numpy as np
+    from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLineEdit, QComboBox, QTableView,
+                                 QHeaderView, QLabel, QCheckBox, QAbstractItemView)
+    from PyQt5.QtCore import Qt, QAbstractListModel, QModelIndex, QTimer, QVariant
+    from PyQt5.QtGui import QColor, QFontDatabase
+except Exception as e:
+    print("Exception on thirdparty import: " + str(e))
+    print("*** WARNING: Unable to import dependencies. Please install via:\n\n pip3 install --user pyqt5 \n")
+
+from log_store import LEVELS
+
+# Text colour of lines with each level, by LEVELS index
+LEVEL_COLOURS = {1: (130, 130, 130), 2: (160, 160, 160), 4: (255, 200, 80), 5: (255, 90, 90), 6: (255, 60, 200)}
+
+class LogListModel(QAbstractListModel):
+    def __init__(self, store, parent=None):
+        super(LogListModel, self).__init__(parent)
+        self.store = store
+        self.query = ''
+        self.minLevel = 0
+        # Line numbers of the rows when searching, otherwise None and the
+        # rows are every line from _first to _count
+        self._lines = None
+        self._first = store.first
+        self._count = store.first
+        # When searching, lines before this have been searched
+        self._searched = store.first
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._lines) if self._lines is not None else self._count - self._first
+
+    def lineNumber(self, row):
+        return int(self._lines[row]) if self._lines is not None else self._first + row
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return QVariant()
+        n = self.lineNumber(index.row())
+        if role == Qt.DisplayRole:
+            text = self.store.line(n)
+            return text if text is not None else ''
+        if role == Qt.ForegroundRole:
+            colour = LEVEL_COLOURS.get(self.store.level(n))
+            return QColor(*colour) if colour else QVariant()
+        if role == Qt.ToolTipRole:
+            return "Line %d, %s" % (n + 1, LEVELS[self.store.level(n)])
+        return QVariant()
+
+    def isFiltered(self):
+        return bool(self.query.strip()) or self.minLevel > 0
+
+    def setFilter(self, query, min_level):
+        """Show the lines matching a search query and minimum level, or every line if neither is set"""
+        self.beginResetModel()
+        self.query = query
+        self.minLevel = min_level
+        count = self.store.count
+        if self.isFiltered():
+            self._lines = self.store.search(query, min_level, end=count)
+            self._searched = count
+        else:
+            self._lines = None
+            self._first, self._count = self.store.first, count
+        self.endResetModel()
+
+    def refresh(self):
+        """Drop rows for discarded lines, and add rows for new ones. Returns True if rows were added."""
+        first, count = self.store.first, self.store.count
+        if self._lines is not None:
+            gone = int(np.searchsorted(self._lines, first))
+            if gone:
+                self.beginRemoveRows(QModelIndex(), 0, gone - 1)
+                self._lines = self._lines[gone:]
+                self.endRemoveRows()
+            if count <= self._searched:
+                return False
+            found = self.store.search(self.query, self.minLevel, start=self._searched, end=count)
+            self._searched = count
+            if len(found) == 0:
+                return False
+            rows = len(self._lines)
+            self.beginInsertRows(QModelIndex(), rows, rows + len(found) - 1)
+            self._lines = np.concatenate((self._lines, found))
+            self.endInsertRows()
+            return True
+
+        gone = min(first, self._count) - self._first
+        if gone > 0:
+            self.beginRemoveRows(QModelIndex(), 0, gone - 1)
+            self._first += gone
+            self.endRemoveRows()
+        self._first = max(self._first, first)
+        self._count = max(self._count, self._first)
+        if count <= self._count:
+            return False
+        rows = self._count - self._first
+        self.beginInsertRows(QModelIndex(), rows, rows + count - self._count - 1)
+        self._count = count
+        self.endInsertRows()
+        return True
+
+
+class LogPanel(QWidget):
+    # (label, minimum level) choices for the level filter
+    LEVEL_FILTERS = (('All levels', 0), ('Debug and above', 2), ('Info and above', 3),
+                     ('Warnings and above', 4), ('Errors only', 5))
+
+    # Interval, in ms, between adding new lines to the view
+    REFRESH_INTERVAL = 200
+
+    def __init__(self, store, parent=None):
+        super(LogPanel, self).__init__(parent)
+        self.store = store
+        self.model = LogListModel(store)
+
+        self.searchEdit = QLineEdit()
+        self.searchEdit.setPlaceholderText("Search the log (every word must match; the last may be partial)")
+        self.searchEdit.setClearButtonEnabled(True)
+        self.levelCombo = QComboBox()
+        for label, _ in self.LEVEL_FILTERS:
+            self.levelCombo.addItem(label)
+        self.followCheck = QCheckBox("Follow")
+        self.followCheck.setChecked(True)
+        self.countLabel = QLabel("")
+
+        self.lineView = QTableView()
+        self.lineView.setModel(self.model)
+        self.lineView.setFont(QFontDatabase.systemFont(QFontDatabase.FixedFont))
+        # Fixed heights let the view place any row without measuring the rest
+        rows = self.lineView.verticalHeader()
+        rows.setSectionResizeMode(QHeaderView.Fixed)
+        rows.setDefaultSectionSize(self.lineView.fontMetrics().height() + 2)
+        rows.hide()
+        self.lineView.horizontalHeader().setStretchLastSection(True)
+        self.lineView.horizontalHeader().hide()
+        self.lineView.setShowGrid(False)
+        self.lineView.setWordWrap(False)
+        self.lineView.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.lineView.setSelectionMode(QAbstractItemView.ExtendedSelection)
+
+        controls = QHBoxLayout()
+        controls.addWidget(self.searchEdit, 1)
+        controls.addWidget(self.levelCombo)
+        controls.addWidget(self.followCheck)
+        controls.addWidget(self.countLabel)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(controls)
+        layout.addWidget(self.lineView)
+        self.setLayout(layout)
+
+        # Search once typing pauses, rather than on every key
+        self.searchTimer = QTimer()
+        self.searchTimer.setSingleShot(True)
+        self.searchTimer.setInterval(150)
+        self.searchTimer.timeout.connect(self.applyFilter)
+        self.searchEdit.textChanged.connect(lambda _: self.searchTimer.start())
+        self.levelCombo.currentIndexChanged.connect(lambda _: self.applyFilter())
+
+        self.refreshTimer = QTimer()
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.refreshTimer.start(self.REFRESH_INTERVAL)
+
+    def applyFilter(self):
+        self.model.setFilter(self.searchEdit.text(), self.LEVEL_FILTERS[self.levelCombo.currentIndex()][1])
+        self.updateCountLabel()
+        if self.followCheck.isChecked():
+            self.lineView.scrollToBottom()
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+        if self.model.refresh():
+            if self.followCheck.isChecked():
+                self.lineView.scrollToBottom()
+        self.updateCountLabel()
+
+    def updateCountLabel(self):
+        held = len(self.store)
+        if self.model.isFiltered():
+            self.countLabel.setText("%d of %d lines" % (self.model.rowCount(), held))
+        else:
+            self.countLabel.setText("%d lines" % held)
@@ -0,0 +1,294 @@
+# -*- coding: utf-8 -*-
+"""
+# Searchable store of the full SDK log text
+----------------------------------------------------------
+LogStore keeps every line read from the SDK log in one bytes arena, with
+NumPy arrays of each line's start offset, time and level, so holding
+millions of lines costs little more than their text. Line numbers count
+from the start of the session; when the text and the index postings (8
+bytes per word per line) outgrow the store's byte budget the oldest half
+of the lines is discarded, and 'first' moves on.
+
+Appending only copies bytes and finds line ends and levels with NumPy and
+a regex over the whole block, so it is cheap enough for the log reader
+thread. An indexer thread then tokenises new lines into an inverted index
+(lowercase word -> increasing line numbers), and a search intersects the
+postings of its words, the last one taken as a prefix so results update
+as the query is typed. Lines not indexed yet are scanned directly, so
+results are always complete. A query without any words, such as '->', is
+searched for as text in every line.
+"""
+import re
+import time
+import array
+import threading
+import numpy as np
+
+# Line levels, from least to most severe; 0 is a line without one
+LEVELS = ('NONE', 'TRACE', 'DEBUG', 'INFO', 'WARNING', 'ERROR', 'FATAL')
+LEVEL_WORDS = {b'TRACE': 1, b'DEBUG': 2, b'INFO': 3, b'WARN': 4, b'WARNING': 4,
+               b'ERR': 5, b'ERROR': 5, b'FATAL': 6, b'CRITICAL': 6}
+LEVEL_PATTERN = re.compile(rb'\b(' + b'|'.join(sorted(LEVEL_WORDS, key=len, reverse=True)) + rb')\b')
+
+# Words are runs of letters, digits and underscores, so numbers and single
+# characters are words too
+TOKEN_PATTERN = re.compile(r'[a-z0-9_]+')
+
+def tokenize(text):
+    """The distinct lowercase words in some text"""
+    return set(TOKEN_PATTERN.findall(text.lower()))
+
+def mergeSorted(arrays):
+    """The distinct values of several sorted arrays, sorted"""
+    if len(arrays) == 1:
+        return arrays[0]
+    if not arrays:
+        return np.zeros(0, dtype=np.int64)
+    merged = np.sort(np.concatenate(arrays))
+    return merged[np.r_[True, merged[1:] != merged[:-1]]]
+
+class LogStore(object):
+    def __init__(self, max_bytes=256 * 1024 * 1024):
+        super(LogStore, self).__init__()
+        self.maxBytes = max_bytes
+
+        # Line text, without newlines, from byte offset 'byteBase' of the session
+        self._arena = bytearray()
+        self.byteBase = 0
+        # Per retained line, first is line number 'first': start offset in the
+        # session's bytes (each line ends where the next starts, less its
+        # newline), time and level
+        self._offsets = np.zeros(1024 + 1, dtype=np.int64)
+        self._times = np.zeros(1024)
+        self._levels = np.zeros(1024, dtype=np.uint8)
+        self.first = 0
+        self.count = 0
+
+        # Inverted index: word -> array of line numbers, in increasing order.
+        # Lines before 'indexed' are in it.
+        self._postings = {}
+        self.indexed = 0
+        # Bytes of line numbers held in the postings, counted against max_bytes
+        self._postingBytes = 0
+        # Set when lines are discarded, so the next index pass trims their postings
+        self._trimPostings = False
+
+        self._lock = threading.Lock()
+        self._running = False
+
+    def __len__(self):
+        return self.count - self.first
+
+    def _reserve(self, lines):
+        """Grow the per line arrays to hold 'lines' more lines"""
+        needed = self.count - self.first + lines
+        if needed > len(self._times):
+            size = max(needed, 2 * len(self._times))
+            used = self.count - self.first
+            offsets = np.zeros(size + 1, dtype=np.int64)
+            offsets[:used + 1] = self._offsets[:used + 1]
+            times = np.zeros(size)
+            times[:used] = self._times[:used]
+            levels = np.zeros(size, dtype=np.uint8)
+            levels[:used] = self._levels[:used]
+            self._offsets, self._times, self._levels = offsets, times, levels
+
+    def append(self, block, times=None):
+        """Add a block of complete, newline-terminated lines, optionally with each line's time"""
+        if not block:
+            return
+        ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+        n = len(ends)
+        if n == 0:
+            return
+        levels = np.zeros(n, dtype=np.uint8)
+        matches = [(match.start(), LEVEL_WORDS[match[1]]) for match in LEVEL_PATTERN.finditer(block)]
+        if matches:
+            starts, values = zip(*matches)
+            lines = np.searchsorted(ends, starts)
+            # Only the first level word on a line counts
+            lines, firstMatch = np.unique(lines, return_index=True)
+            levels[lines] = np.asarray(values, dtype=np.uint8)[firstMatch]
+
+        with self._lock:
+            self._reserve(n)
+            used = self.count - self.first
+            start = self._offsets[used]
+            self._offsets[used + 1:used + n + 1] = start + ends + 1
+            self._times[used:used + n] = time.monotonic() if times is None else times
+            self._levels[used:used + n] = levels
+            self._arena += block
+            self.count += n
+            self._keepWithinBudget()
+
+    def _keepWithinBudget(self):
+        """Discard the oldest half of the lines if over budget, with the lock held"""
+        if len(self._arena) + self._postingBytes > self.maxBytes:
+            self._discard((self.count - self.first) // 2)
+
+    def _discard(self, lines):
+        """Drop the oldest lines, with the lock held"""
+        used = self.count - self.first
+        cut = self._offsets[lines] - self.byteBase
+        del self._arena[:cut]
+        self.byteBase += cut
+        self._offsets[:used - lines + 1] = self._offsets[lines:used + 1].copy()
+        self._times[:used - lines] = self._times[lines:used].copy()
+        self._levels[:used - lines] = self._levels[lines:used].copy()
+        self.first += lines
+        self._trimPostingsBefore()
+        # An index pass may be adding postings for the discarded lines, so trim those too
+        self._trimPostings = True
+
+    def _trimPostingsBefore(self):
+        """Drop postings of lines before 'first', with the lock held"""
+        total = 0
+        for word in list(self._postings):
+            lines = np.frombuffer(self._postings[word], dtype=np.int64)
+            keep = np.searchsorted(lines, self.first)
+            if keep == len(lines):
+                del self._postings[word]
+                continue
+            if keep:
+                self._postings[word] = array.array('q', lines[keep:].tobytes())
+            total += len(lines) - keep
+        self._postingBytes = 8 * total
+
+    def clear(self):
+        with self._lock:
+            self._discard(self.count - self.first)
+            self._postings = {}
+            self._postingBytes = 0
+            self.indexed = self.count
+
+    def _text(self, n):
+        i = n - self.first
+        start = self._offsets[i] - self.byteBase
+        return bytes(self._arena[start:self._offsets[i + 1] - self.byteBase - 1])
+
+    def line(self, n):
+        """The text of line n, or None if it has been discarded"""
+        with self._lock:
+            if n < self.first or n >= self.count:
+                return None
+            return self._text(n).decode('utf-8', errors='replace').rstrip('\r')
+
+    def lines(self, start, end):
+        """The text of lines start..end-1 which are still held"""
+        with self._lock:
+            start, end = max(start, self.first), min(end, self.count)
+            if end <= start:
+                return []
+            a = self._offsets[start - self.first] - self.byteBase
+            b = self._offsets[end - self.first] - self.byteBase
+            text = bytes(self._arena[a:b - 1])
+        return [line.rstrip('\r') for line in text.decode('utf-8', errors='replace').split('\n')]
+
+    def level(self, n):
+        with self._lock:
+            return int(self._levels[n - self.first]) if self.first <= n < self.count else 0
+
+    def time(self, n):
+        with self._lock:
+            return float(self._times[n - self.first]) if self.first <= n < self.count else None
+
+    def _tokenizeLines(self, start, end):
+        """[(line number, words)] for lines start..end-1"""
+        return [(n, tokenize(text)) for n, text in enumerate(self.lines(start, end), max(start, self.first))]
+
+    def indexSome(self, max_lines=20000):
+        """Add up to max_lines more lines to the index. Returns how many were added."""
+        start = max(self.indexed, self.first)
+        end = min(self.count, start + max_lines)
+        if end <= start:
+            return 0
+        postings = {}
+        for n, words in self._tokenizeLines(start, end):
+            for word in words:
+                lines = postings.get(word)
+                if lines is None:
+                    postings[word] = lines = array.array('q')
+                lines.append(n)
+        with self._lock:
+            for word, lines in postings.items():
+                existing = self._postings.get(word)
+                if existing is None:
+                    self._postings[word] = lines
+                else:
+                    existing.extend(lines)
+                self._postingBytes += 8 * len(lines)
+            self._keepWithinBudget()
+            if self._trimPostings:
+                self._trimPostings = False
+                self._trimPostingsBefore()
+            self.indexed = end
+        return end - start
+
+    def startIndexer(self, interval=0.05):
+        """Keep the index up to date on a background thread"""
+        def run():
+            while self._running:
+                if not self.indexSome():
+                    time.sleep(interval)
+        self._running = True
+        thread = threading.Thread(target=run, name='log-indexer')
+        thread.daemon = True
+        thread.start()
+
+    def stopIndexer(self):
+        self._running = False
+
+    def _matching(self, words, prefix):
+        """Line numbers in the index containing every word, and a word starting with prefix"""
+        # Postings are copied, as an array can't grow while a view of it exists
+        with self._lock:
+            sets = [np.frombuffer(self._postings.get(word, b''), dtype=np.int64).copy() for word in words]
+            if prefix:
+                candidates = [np.frombuffer(lines, dtype=np.int64).copy() for word, lines in self._postings.items()
+                              if word.startswith(prefix)]
+                sets.append(mergeSorted(candidates))
+        if not sets:
+            return None
+        sets.sort(key=len)
+        result = sets[0]
+        for lines in sets[1:]:
+            if len(result) == 0:
+                break
+            result = np.intersect1d(result, lines, assume_unique=True)
+        return result
+
+    def search(self, query='', min_level=0, start=None, end=None):
+        """Line numbers from start to end (default: every line held) whose
+        words include each word of the query, the last as a prefix, and whose
+        level is at least min_level (a LEVELS index), in increasing order.
+        A query without words matches the lines containing its text."""
+        words = TOKEN_PATTERN.findall(query.lower())
+        text = query.strip().lower() if not words else None
+        # A query ending mid-word treats that word as a prefix
+        prefix = words.pop() if words and not query[-1:].isspace() else None
+        with self._lock:
+            start = self.first if start is None else max(start, self.first)
+            end = self.count if end is None else min(end, self.count)
+            indexed = min(max(self.indexed, start), end)
+        if end <= start:
+            return np.zeros(0, dtype=np.int64)
+
+        if words or prefix:
+            found = self._matching(words, prefix)
+            found = found[(found >= start) & (found < indexed)]
+            # Scan whatever the indexer hasn't reached yet
+            tail = [n for n, lineWords in self._tokenizeLines(indexed, end)
+                    if all(word in lineWords for word in words)
+                    and (not prefix or any(word.startswith(prefix) for word in lineWords))]
+            found = np.concatenate((found, np.asarray(tail, dtype=np.int64)))
+        elif text:
+            found = np.asarray([n for n, line in enumerate(self.lines(start, end), max(start, self.first))
+                                if text in line.lower()], dtype=np.int64)
+        else:
+            found = np.arange(start, end, dtype=np.int64)
+
+        if min_level:
+            with self._lock:
+                found = found[found >= self.first]
+                found = found[self._levels[found - self.first] >= min_level]
+        return found
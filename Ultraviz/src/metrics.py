@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+# Counters and gauges describing a running Ultraviz, served over HTTP in the
+# Prometheus text format so several test rigs can be watched from one place.
+----------------------------------------------------------
+Counters are incremented per batch by the threads doing the work. Gauges
+either hold a value set by their owner, or read one from a callback when
+scraped. Scrapes are served on their own thread and never wait on the GUI.
+"""
+import time
+import threading
+
+try:
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+except ImportError:
+    from http.server import HTTPServer as ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class Counter(object):
+    def __init__(self, name, description, fn=None):
+        self.name = name
+        self.description = description
+        self.type = 'counter'
+        self._fn = fn
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self._value += n
+
+    def value(self):
+        return self._fn() if self._fn else self._value
+
+class Gauge(object):
+    def __init__(self, name, description, fn=None):
+        self.name = name
+        self.description = description
+        self.type = 'gauge'
+        self._fn = fn
+        self._value = 0
+
+    def set(self, value):
+        self._value = value
+
+    def value(self):
+        return self._fn() if self._fn else self._value
+
+class RateGauge(Gauge):
+    """Per-second rate of change of a counter, measured between scrapes"""
+    def __init__(self, name, description, counter):
+        super(RateGauge, self).__init__(name, description)
+        self._counter = counter
+        self._last = (time.monotonic(), counter.value())
+
+    def value(self):
+        now, count = time.monotonic(), self._counter.value()
+        lastTime, lastCount = self._last
+        self._last = (now, count)
+        return (count - lastCount) / (now - lastTime) if now > lastTime else 0.0
+
+
+class MetricsRegistry(object):
+    def __init__(self, prefix='ultraviz_'):
+        super(MetricsRegistry, self).__init__()
+        self.prefix = prefix
+        self.metrics = []
+        self.server = None
+
+    def counter(self, name, description, fn=None):
+        return self._add(Counter(self.prefix + name, description, fn))
+
+    def gauge(self, name, description, fn=None):
+        return self._add(Gauge(self.prefix + name, description, fn))
+
+    def rate(self, name, description, counter):
+        return self._add(RateGauge(self.prefix + name, description, counter))
+
+    def _add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        lines = []
+        for metric in self.metrics:
+            try:
+                value = float(metric.value())
+            except Exception as e:
+                print("Metric %s failed: %s" % (metric.name, e))
+                continue
+            lines.append("# HELP %s %s" % (metric.name, metric.description))
+            lines.append("# TYPE %s %s" % (metric.name, metric.type))
+            lines.append("%s %r" % (metric.name, value))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host=''):
+        """Serve /metrics over HTTP on a daemon thread"""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def stop(self):
+        if self.server:
+            self.server.shutdown()
+            self.server = None
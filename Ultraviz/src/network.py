@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+# Network transport of raw SDK log data, so Ultraviz can run on a different
+# host to the monitored Ultrahaptics application.
+----------------------------------------------------------
+Log data is sent as frames of whole log lines, each with a small header:
+  flags (1 byte, bit 0 = zlib compressed), payload length (4 bytes, big-endian)
+Over TCP frames are streamed back to back; over UDP each datagram is one frame.
+Only the standard library is used, so the forwarder can run on a bare device host.
+"""
+import socket
+import struct
+import threading
+import zlib
+
+HEADER = struct.Struct('!BI')
+FLAG_COMPRESSED = 0x1
+DEFAULT_PORT = 9100
+
+# Largest frame payload accepted. UDP frames must also fit in one datagram.
+MAX_FRAME_BYTES = 4*1024*1024
+MAX_DATAGRAM_BYTES = 65507
+
+def encodeFrame(data, compress=False):
+    flags = 0
+    if compress:
+        data = zlib.compress(data, 1)
+        flags |= FLAG_COMPRESSED
+    return HEADER.pack(flags, len(data)) + data
+
+def decodePayload(flags, payload):
+    if flags & FLAG_COMPRESSED:
+        return zlib.decompress(payload)
+    return bytes(payload)
+
+
+class LogIngestServer(object):
+    """Receives framed log data over TCP (and optionally UDP), passing each
+    payload to handler(data, source), where source identifies the TCP
+    connection or UDP sender, and calling closed(source) when a connection
+    ends. Sockets read into preallocated buffers with recv_into, so no
+    per-read allocation is made."""
+    def __init__(self, handler, port=DEFAULT_PORT, host='', udp=False, closed=None):
+        super(LogIngestServer, self).__init__()
+        self.handler = handler
+        self.closed = closed
+        self.port = port
+        self.host = host
+        self.udp = udp
+        self.running = False
+        self.threads = []
+        self.sockets = []
+
+    def start(self):
+        self.running = True
+        tcp = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        tcp.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        tcp.bind((self.host, self.port))
+        tcp.listen(4)
+        self.sockets.append(tcp)
+        self._startThread(self._acceptTCP, tcp)
+
+        if self.udp:
+            udp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            udp.bind((self.host, self.port))
+            self.sockets.append(udp)
+            self._startThread(self._receiveUDP, udp)
+
+    def stop(self):
+        self.running = False
+        for sock in self.sockets:
+            try:
+                sock.close()
+            except Exception as e:
+                print(e)
+        self.sockets = []
+
+    def _startThread(self, target, *args):
+        thread = threading.Thread(target=target, args=args)
+        thread.daemon = True
+        thread.start()
+        self.threads.append(thread)
+
+    def _acceptTCP(self, server):
+        while self.running:
+            try:
+                connection, address = server.accept()
+            except OSError:
+                break
+            print("Log forwarder connected from %s:%d" % address)
+            self._startThread(self._receiveTCP, connection, ('tcp',) + address)
+
+    def _receiveTCP(self, connection, source):
+        buffer = bytearray(HEADER.size + MAX_FRAME_BYTES)
+        view = memoryview(buffer)
+        filled = 0
+        try:
+            while self.running:
+                received = connection.recv_into(view[filled:])
+                if received == 0:
+                    break
+                filled += received
+
+                # Hand on every complete frame, then move any partial frame to the front
+                start = 0
+                while filled - start >= HEADER.size:
+                    flags, length = HEADER.unpack_from(buffer, start)
+                    if length > MAX_FRAME_BYTES:
+                        raise ValueError("Log frame too large: %d bytes" % length)
+                    end = start + HEADER.size + length
+                    if end > filled:
+                        break
+                    self.handler(decodePayload(flags, view[start + HEADER.size:end]), source)
+                    start = end
+                if start:
+                    buffer[0:filled - start] = view[start:filled]
+                    filled -= start
+        except Exception as e:
+            print("Error receiving forwarded log: " + str(e))
+        finally:
+            connection.close()
+            if self.closed:
+                self.closed(source)
+            print("Log forwarder disconnected")
+
+    def _receiveUDP(self, sock):
+        buffer = bytearray(MAX_DATAGRAM_BYTES)
+        view = memoryview(buffer)
+        while self.running:
+            try:
+                received, address = sock.recvfrom_into(buffer)
+            except OSError:
+                break
+            if received < HEADER.size:
+                continue
+            flags, length = HEADER.unpack_from(buffer, 0)
+            if HEADER.size + length != received:
+                print("Dropping malformed log datagram from %s:%d" % address)
+                continue
+            try:
+                self.handler(decodePayload(flags, view[HEADER.size:received]), ('udp',) + address)
+            except Exception as e:
+                print("Error receiving forwarded log: " + str(e))
+
+
+class LogForwarder(object):
+    """Sends batches of whole log lines to a LogIngestServer"""
+    def __init__(self, host, port=DEFAULT_PORT, udp=False, compress=False):
+        super(LogForwarder, self).__init__()
+        self.address = (host, port)
+        self.udp = udp
+        self.compress = compress
+        self.sock = None
+
+    def connect(self):
+        if self.udp:
+            self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self.sock = socket.create_connection(self.address)
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send(self, data):
+        if not data:
+            return
+        # Keep UDP datagrams within size by splitting on line boundaries
+        if self.udp and len(data) > MAX_DATAGRAM_BYTES - HEADER.size:
+            split = data.rfind(b'\n', 0, MAX_DATAGRAM_BYTES - HEADER.size) + 1
+            if split <= 0:
+                split = MAX_DATAGRAM_BYTES - HEADER.size
+            self.send(data[:split])
+            self.send(data[split:])
+            return
+        frame = encodeFrame(data, self.compress)
+        if self.udp:
+            self.sock.sendto(frame, self.address)
+        else:
+            self.sock.sendall(frame)
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
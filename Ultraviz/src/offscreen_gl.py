@@ -0,0 +1,213 @@
+# -*- coding: utf-8 -*-
+"""
+# Headless OpenGL rendering of the 3D scene
+----------------------------------------------------------
+Qt's offscreen platform can't create an OpenGL context, so without a display
+a QOpenGLWidget never draws. OffscreenScene draws what Scatter3DScene shows
+(its grid, orientation axes and round point sprites, through the same
+camera maths as GLViewWidget) into a framebuffer object, using a surfaceless
+EGL context. With Mesa and no GPU that is its llvmpipe software rasteriser,
+so neither a GPU nor a display is needed.
+
+PyOpenGL has to use its EGL platform, so PYOPENGL_PLATFORM=egl must be set
+before OpenGL is first imported in the process (see render_capture.py).
+"""
+import ctypes
+import numpy as np
+from OpenGL import EGL
+from OpenGL.GL import *
+from OpenGL.GL import shaders
+from PyQt5 import QtGui
+
+# From EGL_MESA_platform_surfaceless
+EGL_PLATFORM_SURFACELESS_MESA = 0x31DD
+
+VERTEX_SHADER = """
+    #version 120
+    uniform mat4 u_mvp;
+    attribute vec3 a_position;
+    attribute vec4 a_color;
+    attribute float a_size;
+    varying vec4 v_color;
+    void main() {
+        gl_Position = u_mvp * vec4(a_position, 1.0);
+        gl_PointSize = a_size;
+        v_color = a_color;
+    }
+"""
+
+FRAGMENT_SHADER = """
+    #version 120
+    uniform bool u_points;
+    varying vec4 v_color;
+    void main() {
+        // Points are drawn round, as GLScatterPlotItem draws them
+        vec2 xy = (gl_PointCoord - 0.5) * 2.0;
+        if (u_points && dot(xy, xy) > 1.0)
+            discard;
+        gl_FragColor = v_color;
+    }
+"""
+
+def createSurfacelessContext():
+    """Make a surfaceless EGL OpenGL context current, returning (display, context)"""
+    address = EGL.eglGetProcAddress(b'eglGetPlatformDisplayEXT')
+    if not address:
+        raise RuntimeError("EGL doesn't support eglGetPlatformDisplayEXT")
+    getPlatformDisplay = ctypes.CFUNCTYPE(EGL.EGLDisplay, EGL.EGLenum, ctypes.c_void_p,
+                                          ctypes.POINTER(EGL.EGLint))(address)
+    display = getPlatformDisplay(EGL_PLATFORM_SURFACELESS_MESA, None, None)
+    major, minor = EGL.EGLint(), EGL.EGLint()
+    if not display or not EGL.eglInitialize(display, ctypes.pointer(major), ctypes.pointer(minor)):
+        raise RuntimeError("Unable to open a surfaceless EGL display")
+
+    attributes = (EGL.EGLint * 9)(EGL.EGL_SURFACE_TYPE, EGL.EGL_PBUFFER_BIT,
+                                  EGL.EGL_RENDERABLE_TYPE, EGL.EGL_OPENGL_BIT,
+                                  EGL.EGL_RED_SIZE, 8, EGL.EGL_DEPTH_SIZE, 24, EGL.EGL_NONE)
+    config, count = EGL.EGLConfig(), EGL.EGLint()
+    if not EGL.eglChooseConfig(display, attributes, ctypes.pointer(config), 1, ctypes.pointer(count)) or not count.value:
+        raise RuntimeError("No EGL config for OpenGL rendering")
+    EGL.eglBindAPI(EGL.EGL_OPENGL_API)
+    context = EGL.eglCreateContext(display, config, EGL.EGL_NO_CONTEXT, None)
+    if not context or not EGL.eglMakeCurrent(display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, context):
+        raise RuntimeError("Unable to make a surfaceless EGL context current")
+    return display, context
+
+
+class OffscreenScene(object):
+    # As Scatter3DScene's grid and orientation axes, and GLViewWidget's background
+    GRID_SIZE = 5.0
+    GRID_SPACING = 0.25
+    GRID_COLOR = (1.0, 1.0, 1.0, 0.3)
+    AXIS_SIZE = 5.0
+    BACKGROUND = (0.0, 0.0, 0.0, 1.0)
+
+    def __init__(self, size):
+        super(OffscreenScene, self).__init__()
+        self.width, self.height = [int(v) for v in size]
+        self.display, self.context = createSurfacelessContext()
+        self.renderer = glGetString(GL_RENDERER).decode()
+
+        # Camera, as in GLViewWidget.opts
+        self.opts = {'center': (0.0, 0.0, 0.0), 'distance': 7.0, 'fov': 60.0, 'elevation': 40.0, 'azimuth': -90.0}
+
+        self._framebuffer = glGenFramebuffers(1)
+        glBindFramebuffer(GL_FRAMEBUFFER, self._framebuffer)
+        color, depth = glGenRenderbuffers(2)
+        glBindRenderbuffer(GL_RENDERBUFFER, color)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_RGBA8, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_COLOR_ATTACHMENT0, GL_RENDERBUFFER, color)
+        glBindRenderbuffer(GL_RENDERBUFFER, depth)
+        glRenderbufferStorage(GL_RENDERBUFFER, GL_DEPTH_COMPONENT24, self.width, self.height)
+        glFramebufferRenderbuffer(GL_FRAMEBUFFER, GL_DEPTH_ATTACHMENT, GL_RENDERBUFFER, depth)
+        if glCheckFramebufferStatus(GL_FRAMEBUFFER) != GL_FRAMEBUFFER_COMPLETE:
+            raise RuntimeError("Unable to create a %dx%d framebuffer" % (self.width, self.height))
+
+        self._program = shaders.compileProgram(shaders.compileShader(VERTEX_SHADER, GL_VERTEX_SHADER),
+                                               shaders.compileShader(FRAGMENT_SHADER, GL_FRAGMENT_SHADER))
+        self._attributes = [glGetAttribLocation(self._program, name) for name in ('a_position', 'a_color', 'a_size')]
+        self._lines = self._gridAndAxes()
+
+    def _gridAndAxes(self):
+        """(positions, colours) of the line segments of the grid and axes"""
+        half = self.GRID_SIZE / 2.0
+        values = np.arange(-half, half + self.GRID_SPACING * 0.001, self.GRID_SPACING)
+        grid = np.zeros((2 * len(values), 2, 3), dtype=np.float32)
+        grid[:len(values), :, 0] = values[:, None]
+        grid[:len(values), :, 1] = (-half, half)
+        grid[len(values):, :, 0] = (-half, half)
+        grid[len(values):, :, 1] = values[:, None]
+        colors = np.tile(np.array(self.GRID_COLOR, dtype=np.float32), (len(grid) * 2, 1))
+
+        # z green, y yellow, x blue, as GLAxisItem
+        axes = np.zeros((3, 2, 3), dtype=np.float32)
+        axes[0, 1, 2] = axes[1, 1, 1] = axes[2, 1, 0] = self.AXIS_SIZE
+        axisColors = np.repeat(np.array([[0, 1, 0, 0.6], [1, 1, 0, 0.6], [0, 0, 1, 0.6]], dtype=np.float32), 2, axis=0)
+        return (np.concatenate((grid.reshape(-1, 3), axes.reshape(-1, 3))),
+                np.concatenate((colors, axisColors)))
+
+    def setCamera(self, **opts):
+        """Set any of center, distance, fov, elevation and azimuth, e.g. from Scatter3DScene.CAMERA_PRESETS"""
+        self.opts.update(opts)
+
+    def projectionMatrix(self):
+        """As GLViewWidget.projectionMatrix, for the whole frame"""
+        distance = self.opts['distance']
+        near, far = distance * 0.001, distance * 1000.0
+        right = near * np.tan(0.5 * np.radians(self.opts['fov']))
+        top = right * self.height / self.width
+        matrix = QtGui.QMatrix4x4()
+        matrix.frustum(-right, right, -top, top, near, far)
+        return matrix
+
+    def viewMatrix(self):
+        """As GLViewWidget.viewMatrix, with its default euler rotation"""
+        center = self.opts['center']
+        if isinstance(center, QtGui.QVector3D):
+            center = (center.x(), center.y(), center.z())
+        matrix = QtGui.QMatrix4x4()
+        matrix.translate(0.0, 0.0, -self.opts['distance'])
+        matrix.rotate(self.opts['elevation'] - 90, 1, 0, 0)
+        matrix.rotate(self.opts['azimuth'] + 90, 0, 0, -1)
+        matrix.translate(-center[0], -center[1], -center[2])
+        return matrix
+
+    def _draw(self, mode, pos, color, size, points):
+        glUniform1i(glGetUniformLocation(self._program, 'u_points'), int(points))
+        locPos, locColor, locSize = self._attributes
+        glEnableVertexAttribArray(locPos)
+        glVertexAttribPointer(locPos, 3, GL_FLOAT, False, 0, np.ascontiguousarray(pos, dtype=np.float32))
+        enabled = [locPos]
+        color = np.asarray(color, dtype=np.float32)
+        if color.ndim == 2:
+            glEnableVertexAttribArray(locColor)
+            glVertexAttribPointer(locColor, 4, GL_FLOAT, False, 0, np.ascontiguousarray(color))
+            enabled.append(locColor)
+        else:
+            glVertexAttrib4f(locColor, *color)
+        if np.ndim(size):
+            glEnableVertexAttribArray(locSize)
+            glVertexAttribPointer(locSize, 1, GL_FLOAT, False, 0, np.ascontiguousarray(size, dtype=np.float32))
+            enabled.append(locSize)
+        else:
+            glVertexAttrib1f(locSize, float(size))
+        try:
+            glDrawArrays(mode, 0, len(pos))
+        finally:
+            for loc in enabled:
+                glDisableVertexAttribArray(loc)
+
+    def render(self, pos, color, size):
+        """Draw the scene with points at (N,3) pos, with (N,4) or one color and (N,) or one
+        size in pixels. Returns the frame as an (height, width, 4) RGBA array, top row first."""
+        glBindFramebuffer(GL_FRAMEBUFFER, self._framebuffer)
+        glViewport(0, 0, self.width, self.height)
+        glClearColor(*self.BACKGROUND)
+        glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
+        mvp = self.projectionMatrix() * self.viewMatrix()
+
+        glUseProgram(self._program)
+        try:
+            glUniformMatrix4fv(glGetUniformLocation(self._program, 'u_mvp'), 1, False,
+                               np.array(mvp.data(), dtype=np.float32))
+            # The grid and axes are translucent, and the points additive, as in the 3D view
+            glEnable(GL_BLEND)
+            glEnable(GL_DEPTH_TEST)
+            glBlendFuncSeparate(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA, GL_ONE, GL_ONE_MINUS_SRC_ALPHA)
+            self._draw(GL_LINES, self._lines[0], self._lines[1], 1.0, False)
+
+            if len(pos):
+                glDisable(GL_DEPTH_TEST)
+                glBlendFunc(GL_SRC_ALPHA, GL_ONE)
+                glEnable(GL_PROGRAM_POINT_SIZE)
+                glEnable(GL_POINT_SPRITE)
+                self._draw(GL_POINTS, pos, color, size, True)
+        finally:
+            glUseProgram(0)
+
+        data = glReadPixels(0, 0, self.width, self.height, GL_RGBA, GL_UNSIGNED_BYTE)
+        return np.frombuffer(data, dtype=np.uint8).reshape(self.height, self.width, 4)[::-1]
+
+    def close(self):
+        EGL.eglMakeCurrent(self.display, EGL.EGL_NO_SURFACE, EGL.EGL_NO_SURFACE, EGL.EGL_NO_CONTEXT)
+        EGL.eglDestroyContext(self.display, self.context)
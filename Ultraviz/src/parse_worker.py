@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""
+# Reads and parses the SDK log in a separate process, so that heavy log rates
+# don't compete with the Qt render loop for the GIL.
+----------------------------------------------------------
+The worker process reads the pipe, stamps each chunk with time.monotonic()
+(shared by all processes on the machine), parses it with the usual
+SDKLogPipeHandler and writes the X-Y-Z-I-ID rows, and the gaps between
+them, into shared memory rings owned by the GUI process. The GUI process
+reads the rings and restarts the worker if it dies. Given segment_options,
+the worker also appends the raw log text to a SegmentedLogWriter.
+"""
+import os
+import time
+import multiprocessing
+import numpy as np
+
+from log_handler import SDKLogPipeHandler
+from shm_ring import SharedMemoryRingWriter, SharedMemoryRingReader
+from segment_store import SegmentedLogWriter
+
+def runParseWorker(pipe_name, is_windows, shm_name, stop_event, segment_options=None):
+    """Entry point of the worker process"""
+    ring = SharedMemoryRingWriter(name=shm_name, create=False)
+    gapRing = SharedMemoryRingWriter(name=shm_name + '_gaps', create=False)
+    logHandler = SDKLogPipeHandler(is_windows=is_windows)
+    logHandler.pipe_name = pipe_name
+    # A restarted worker carries on the line numbers of the segments already written
+    segmentWriter = SegmentedLogWriter(**segment_options) if segment_options else None
+    if segmentWriter:
+        logHandler.lineSink = segmentWriter.append
+
+    def publish(data):
+        times, points, gapTimes, gaps = logHandler.parseChunk(data, time.monotonic())
+        gapRing.write(gapTimes, gaps)
+        ring.write(times, points)
+
+    try:
+        if is_windows:
+            while not stop_event.is_set():
+                if not logHandler.namedPipe:
+                    logHandler.setupNamedPipe()
+                    logHandler.connectToSDKPipe()
+                try:
+                    data = logHandler.getDataFromNamedPipe()
+                except Exception as e:
+                    print("Errors processing log on Windows: " + str(e))
+                    logHandler.namedPipe = None
+                    continue
+                if len(data) >= 2:
+                    publish(data[1])
+        else:
+            while not stop_event.is_set():
+                fifo = os.open(pipe_name, os.O_RDONLY)
+                try:
+                    while not stop_event.is_set():
+                        data = os.read(fifo, logHandler.num_bytes)
+                        if not data:
+                            break
+                        publish(data)
+                finally:
+                    os.close(fifo)
+    finally:
+        ring.close()
+        gapRing.close()
+        if segmentWriter:
+            segmentWriter.close()
+
+
+class ParseWorker(object):
+    def __init__(self, pipe_name, is_windows, shm_name='ultraviz_parse_%d' % os.getpid(), capacity=1024*1024,
+                 segment_options=None):
+        super(ParseWorker, self).__init__()
+        self.pipeName = pipe_name
+        self.isWindows = is_windows
+        self.shmName = shm_name
+        # SegmentedLogWriter arguments, if the log text is to be kept on disk
+        self.segmentOptions = segment_options
+
+        # The GUI process owns the rings, so they outlive any worker restarts
+        self.ring = SharedMemoryRingWriter(name=shm_name, capacity=capacity)
+        self.reader = SharedMemoryRingReader(name=shm_name, same_process=True)
+        self.gapRing = SharedMemoryRingWriter(name=shm_name + '_gaps', capacity=capacity // 16, width=2)
+        self.gapReader = SharedMemoryRingReader(name=shm_name + '_gaps', same_process=True)
+
+        self.process = None
+        self.stopEvent = None
+        self.restarts = 0
+
+    def start(self):
+        self.stopEvent = multiprocessing.Event()
+        self.process = multiprocessing.Process(target=runParseWorker,
+                                               args=(self.pipeName, self.isWindows, self.shmName, self.stopEvent,
+                                                     self.segmentOptions))
+        self.process.daemon = True
+        self.process.start()
+
+    def ensureRunning(self):
+        """Restart the worker if it has died. Returns False if it had to be restarted"""
+        if self.process and self.process.is_alive():
+            return True
+        if self.process:
+            self.restarts += 1
+            print("Parse worker exited (code %s), restarting" % self.process.exitcode)
+        self.start()
+        return False
+
+    def read(self):
+        """Returns copies of the (times, points, gapTimes, gaps) parsed since the last read"""
+        gapTimes, gaps = self.gapReader.read()
+        times, points = self.reader.read()
+        return np.array(times), np.array(points), np.array(gapTimes), np.array(gaps)
+
+    def stop(self):
+        if self.process:
+            self.stopEvent.set()
+            self.process.terminate()
+            self.process.join(1.0)
+            self.process = None
+        self.reader.close()
+        self.ring.close()
+        self.gapReader.close()
+        self.gapRing.close()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+# Picking samples in the 3D view
+----------------------------------------------------------
+PointIndex keeps a uniform grid over the rows of a TimestampedBuffer. The
+ring is split into blocks, each holding its slots sorted by grid cell. The
+reader thread rebuilds a block once the write position has moved past it,
+so only the block being written needs rebuilding when picking.
+
+Each block sizes its own grid to the spread of its samples. A pick bounds
+how close each occupied cell can come to the mouse ray, then tests the
+samples in the closest cells exactly.
+"""
+import threading
+import numpy as np
+
+# Grid coordinates are packed into one int64 key, 21 bits per axis
+KEY_BITS = 21
+
+def cellKeys(coords):
+    """pack (N,3) non-negative integer grid coordinates into sortable int64 keys"""
+    c = np.clip(coords, 0, (1 << KEY_BITS) - 1).astype(np.int64)
+    return (c[:, 0] << (2 * KEY_BITS)) | (c[:, 1] << KEY_BITS) | c[:, 2]
+
+class PointIndex(object):
+    # Each block's grid starts at 1/16 of its extent, and is coarsened
+    # until its cells hold this many samples on average
+    CELLS_ACROSS = 16
+    MIN_OCCUPANCY = 4
+    # Samples tested in each best-first round of a pick
+    PASS = 4096
+
+    def __init__(self, buffer, block=4096):
+        super(PointIndex, self).__init__()
+        # A TimestampedBuffer of rows starting X-Y-Z
+        self.buffer = buffer
+        self.block = min(block, buffer.size)
+
+        blockCount = -(-buffer.size // self.block)
+        # Slots sorted by cell within each block, laid out block by block,
+        # and a copy of their positions in the same order
+        self._sorted = np.zeros(buffer.size, dtype=np.int32)
+        self._points = np.zeros((buffer.size, 3), dtype=np.float32)
+        # Per block: (cell centres, cell radius, first position of each cell in _sorted, cell counts)
+        self._blocks = [None] * blockCount
+        self._dirty = np.zeros(blockCount, dtype=bool)
+        # All blocks' cells joined, for picking; rebuilt when any block changes
+        self._merged = None
+        # The block being written isn't indexed; picks test it directly
+        self._writing = -1
+        self._lock = threading.Lock()
+
+    def _rebuild(self, b):
+        start = b * self.block
+        end = min(start + self.block, self.buffer.size)
+        # Slots past count haven't been written yet
+        if self.buffer.count < self.buffer.size:
+            end = min(end, self.buffer.count)
+        if end <= start:
+            self._blocks[b] = None
+        else:
+            pts = self.buffer.slots(start, end)[1][:, :3]
+            lower = pts.min(axis=0)
+            cell = max(float((pts.max(axis=0) - lower).max()) / self.CELLS_ACROSS, 1e-6)
+            while True:
+                coords = np.floor((pts - lower) / cell).astype(np.int64)
+                keys = cellKeys(coords)
+                order = np.argsort(keys, kind='stable')
+                keys = keys[order]
+                first = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+                if len(first) * self.MIN_OCCUPANCY <= len(keys) or len(first) == 1:
+                    break
+                cell *= 2
+            counts = np.diff(np.r_[first, len(keys)])
+            centres = (lower + (coords[order[first]] + 0.5) * cell).astype(np.float32)
+            self._sorted[start:end] = order + start
+            self._points[start:end] = pts[order]
+            self._blocks[b] = (centres, cell * 0.87, first + start, counts)
+        self._dirty[b] = False
+        self._merged = None
+
+    def update(self, n):
+        """call after recording n rows into the buffer"""
+        if n <= 0:
+            return
+        size = self.buffer.size
+        end = self.buffer.index
+        with self._lock:
+            if n >= size:
+                self._dirty[:] = True
+            else:
+                first = ((end - n) % size) // self.block
+                last = ((end - 1) % size) // self.block
+                if first <= last:
+                    self._dirty[first:last + 1] = True
+                else:
+                    self._dirty[first:] = True
+                    self._dirty[:last + 1] = True
+
+            # Blocks the write position has left won't change again until
+            # it wraps round, so index them now rather than when picking
+            writing = end // self.block if end % self.block else -1
+            for b in np.flatnonzero(self._dirty):
+                if b != writing:
+                    self._rebuild(b)
+            if writing >= 0 and self._blocks[writing] is not None:
+                self._blocks[writing] = None
+                self._merged = None
+            self._writing = writing
+
+    def clear(self):
+        with self._lock:
+            self._blocks = [None] * len(self._blocks)
+            self._dirty[:] = False
+            self._merged = None
+            self._writing = -1
+
+    def _merge(self):
+        blocks = [block for block in self._blocks if block is not None]
+        if not blocks:
+            return None
+        centres = np.concatenate([block[0] for block in blocks])
+        radius = np.concatenate([np.full(len(block[0]), block[1], dtype=np.float32) for block in blocks])
+        first = np.concatenate([block[2] for block in blocks])
+        counts = np.concatenate([block[3] for block in blocks])
+        return centres, radius, first, counts
+
+    def _distances(self, points, origin, ray, pixel_angle):
+        """distance of each point from the ray, in pixels at its depth"""
+        d = points - origin
+        t = d @ ray
+        # Measured from the nearest point on the ray, rather than by
+        # subtracting squares, to stay precise to a fraction of a pixel
+        d -= t[:, None] * ray
+        distance = np.sqrt(np.einsum('ij,ij->i', d, d)) / np.maximum(t * pixel_angle, 1e-9)
+        distance[t <= 0] = np.inf
+        return distance
+
+    def _expand(self, cells, first, counts):
+        """the positions in _sorted of the samples in 'cells'"""
+        lengths = counts[cells]
+        offsets = np.cumsum(lengths) - lengths
+        return np.arange(lengths.sum()) - np.repeat(offsets - first[cells], lengths)
+
+    def pick(self, origin, direction, pixel_angle, pixels=8, since=None):
+        """return the slot of the sample nearest the ray, or None
+
+        pixel_angle is the width of one pixel per unit of distance from the
+        camera; samples within 'pixels' of the ray are considered, and ones
+        recorded before 'since' are ignored.
+        """
+        origin = np.asarray(origin, dtype=np.float32)
+        ray = np.asarray(direction, dtype=np.float32)
+        ray = ray / np.linalg.norm(ray)
+        best, bestDistance = None, pixels
+        with self._lock:
+            writing = self._writing
+            for b in np.flatnonzero(self._dirty):
+                if b != writing:
+                    self._rebuild(b)
+            if self._merged is None:
+                self._merged = self._merge()
+            merged = self._merged
+
+        if writing >= 0:
+            start = writing * self.block
+            end = min(start + self.block, self.buffer.size)
+            if self.buffer.count < self.buffer.size:
+                end = min(end, self.buffer.count)
+            times, rows = self.buffer.slots(start, end)
+            distance = self._distances(rows[:, :3], origin, ray, pixel_angle)
+            if since is not None:
+                distance[times < since] = np.inf
+            if end > start:
+                i = np.argmin(distance)
+                if distance[i] <= bestDistance:
+                    best, bestDistance = start + int(i), distance[i]
+
+        if merged is None:
+            return best
+        centres, radius, first, counts = merged
+
+        # Cells whose bounding sphere reaches into the cone around the ray.
+        # Squared distances are a little imprecise, so allow some margin.
+        d = centres - origin
+        t = d @ ray
+        dd = np.einsum('ij,ij->i', d, d)
+        reach = (t + radius) * (pixel_angle * bestDistance) + radius
+        cells = np.flatnonzero((t + radius > 0) & (dd - t * t <= reach * reach + dd * 1e-5))
+        if len(cells) == 0:
+            return best
+
+        # A lower bound on the pixel distance of any sample in each of those
+        d = d[cells]
+        d -= t[cells, None] * ray
+        perp = np.sqrt(np.einsum('ij,ij->i', d, d))
+        r = radius[cells]
+        near = np.maximum(perp - r, 0) / (np.maximum(t[cells] + r, 1e-9) * pixel_angle)
+        order = np.argsort(near)
+        cells, near = cells[order], near[order]
+
+        # Test the most promising cells first, in rounds, skipping cells which
+        # can't hold anything nearer than the best sample found so far
+        ends = np.unique(np.searchsorted(np.cumsum(counts[cells]), np.arange(1, len(cells) + 1) * self.PASS) + 1)
+        start = 0
+        for end in ends:
+            group = cells[start:end][near[start:end] <= bestDistance]
+            start = end
+            if len(group) == 0:
+                break
+            positions = self._expand(group, first, counts)
+            if since is not None:
+                times = self.buffer.slots(0, self.buffer.size)[0]
+                positions = positions[times[self._sorted[positions]] >= since]
+                if len(positions) == 0:
+                    continue
+            distance = self._distances(self._points[positions], origin, ray, pixel_angle)
+            i = np.argmin(distance)
+            if distance[i] <= bestDistance:
+                best, bestDistance = int(self._sorted[positions[i]]), distance[i]
+            if start >= len(cells):
+                break
+        return best
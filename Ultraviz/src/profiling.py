@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+"""
+# Profiling mode (--profile) and a watchdog for GUI thread stalls.
+----------------------------------------------------------
+Each interesting thread (log reader, WebSocket server, Qt event loop) runs
+under its own cProfile.Profile. From Python 3.12 cProfile profiles every
+thread at once and only one can be active, so a single process-wide profile
+is used instead. A profile is only read once it has been stopped, so the
+reader and WebSocket threads are stopped before the report is written.
+
+A QTimer on the GUI thread records a heartbeat; a watchdog thread notices
+when the heartbeat is older than the stall budget and dumps every thread's
+stack, so there's something to look at when the view freezes. Optionally,
+tracemalloc snapshots are taken too. Everything is written to a report file
+on exit.
+"""
+import io
+import sys
+import time
+import atexit
+import pstats
+import cProfile
+import threading
+import traceback
+import tracemalloc
+
+try:
+    from PyQt5.QtCore import QTimer
+except Exception as e:
+    print("Exception on thirdparty import: " + str(e))
+
+# From 3.12 cProfile is built on sys.monitoring, which covers all threads
+PROCESS_WIDE = sys.version_info >= (3, 12)
+
+class Profiler(object):
+    # How often the GUI thread records a heartbeat, in ms
+    HEARTBEAT_INTERVAL = 5
+
+    def __init__(self, report_path, stall_ms=100.0, trace_memory=False, memory_interval=60.0):
+        super(Profiler, self).__init__()
+        self.reportPath = report_path
+        self.stallBudget = stall_ms / 1000.0
+        self.traceMemory = trace_memory
+        self.memoryInterval = memory_interval
+        self.started = time.time()
+
+        # Thread name -> dict of its cProfile.Profile, thread id and whether it's stopped.
+        # With PROCESS_WIDE there's a single profile, and the names of the threads it covers.
+        self.profiles = {}
+        self.processProfile = None
+        self.threadNames = []
+        self._lock = threading.Lock()
+
+        # Each stall is a dict of start time, duration and the stacks seen
+        self.stalls = []
+        self._heartbeat = time.monotonic()
+        self._currentStall = None
+        self._guiThreadId = None
+
+        self.memorySnapshots = []
+        if trace_memory:
+            tracemalloc.start(25)
+
+        self._reportWritten = False
+        atexit.register(self.writeReport)
+
+    def _startProfile(self, name):
+        """Profile the calling thread, returning a function which stops it"""
+        if PROCESS_WIDE:
+            with self._lock:
+                self.threadNames.append(name)
+                if self.processProfile is None:
+                    self.processProfile = cProfile.Profile()
+                    self.processProfile.enable()
+            # Runs until the report is written
+            return lambda: None
+
+        entry = {'profile': cProfile.Profile(), 'thread': threading.get_ident(), 'stopped': False}
+        with self._lock:
+            # Keep names unique if a thread is restarted
+            key, n = name, 1
+            while key in self.profiles:
+                n += 1
+                key = "%s-%d" % (name, n)
+            self.profiles[key] = entry
+        entry['profile'].enable()
+
+        def stop():
+            entry['profile'].disable()
+            entry['stopped'] = True
+        return stop
+
+    def wrap(self, name, target):
+        """Returns a thread target which runs 'target' under its own profile"""
+        def profiledTarget(*args, **kwargs):
+            stop = self._startProfile(name)
+            try:
+                return target(*args, **kwargs)
+            finally:
+                stop()
+        return profiledTarget
+
+    def profileCurrentThread(self, name):
+        """Start profiling the calling thread, e.g. the Qt main thread"""
+        self._startProfile(name)
+
+    def startWatchdog(self):
+        """Call from the GUI thread, once its event loop is about to run"""
+        self._guiThreadId = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self.heartbeatTimer = QTimer()
+        self.heartbeatTimer.timeout.connect(self._beat)
+        self.heartbeatTimer.start(self.HEARTBEAT_INTERVAL)
+
+        watchdog = threading.Thread(target=self._watch, name='stall-watchdog')
+        watchdog.daemon = True
+        watchdog.start()
+
+    def _beat(self):
+        self._heartbeat = time.monotonic()
+
+    def _watch(self):
+        lastSnapshot = time.monotonic()
+        while True:
+            time.sleep(self.stallBudget / 4)
+            now = time.monotonic()
+            late = now - self._heartbeat
+            if late > self.stallBudget:
+                if self._currentStall is None:
+                    self._currentStall = {'start': time.time() - late, 'duration': late, 'stacks': self._dumpStacks()}
+                    print("GUI thread stalled for %.0f ms, thread stacks recorded" % (late * 1000), file=sys.stderr)
+                else:
+                    self._currentStall['duration'] = late
+            elif self._currentStall is not None:
+                self.stalls.append(self._currentStall)
+                self._currentStall = None
+
+            if self.traceMemory and now - lastSnapshot > self.memoryInterval:
+                self.memorySnapshots.append((time.time(), tracemalloc.take_snapshot()))
+                lastSnapshot = now
+
+    def _dumpStacks(self):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        stacks = []
+        for ident, frame in sys._current_frames().items():
+            if ident == threading.get_ident():
+                continue
+            name = names.get(ident, str(ident))
+            if ident == self._guiThreadId:
+                name += " (GUI)"
+            stacks.append((name, "".join(traceback.format_stack(frame))))
+        return stacks
+
+    def writeReport(self):
+        if self._reportWritten:
+            return
+        self._reportWritten = True
+        if self._currentStall is not None:
+            self.stalls.append(self._currentStall)
+
+        out = io.StringIO()
+        out.write("Ultraviz profile, %s to %s\n" % (time.ctime(self.started), time.ctime()))
+        out.write("Stall budget: %.0f ms\n\n" % (self.stallBudget * 1000))
+
+        out.write("=== GUI thread stalls: %d ===\n" % len(self.stalls))
+        for stall in self.stalls:
+            out.write("\n--- %s, %.0f ms ---\n" % (time.strftime('%H:%M:%S', time.localtime(stall['start'])), stall['duration'] * 1000))
+            for name, stack in stall['stacks']:
+                out.write("Thread %s:\n%s\n" % (name, stack))
+
+        with self._lock:
+            profiles = list(self.profiles.items())
+            if self.processProfile is not None:
+                self.processProfile.disable()
+                profiles.append(("all threads (%s)" % ", ".join(self.threadNames),
+                                 {'profile': self.processProfile, 'stopped': True}))
+        for name, entry in profiles:
+            # A profile can only be stopped by its own thread, and reading one
+            # which is still running would race with it
+            if not entry['stopped'] and entry['thread'] == threading.get_ident():
+                entry['profile'].disable()
+                entry['stopped'] = True
+            out.write("\n=== Thread profile: %s ===\n" % name)
+            if not entry['stopped']:
+                out.write("Thread still running, so its profile wasn't collected\n")
+                continue
+            try:
+                pstats.Stats(entry['profile'], stream=out).sort_stats('cumulative').print_stats(40)
+            except Exception as e:
+                out.write("Unable to collect profile: %s\n" % e)
+
+        if self.traceMemory:
+            self.memorySnapshots.append((time.time(), tracemalloc.take_snapshot()))
+            first = self.memorySnapshots[0][1]
+            last = self.memorySnapshots[-1][1]
+            out.write("\n=== Memory: top allocations ===\n")
+            for stat in last.statistics('lineno')[:20]:
+                out.write("%s\n" % stat)
+            out.write("\n=== Memory: growth since the first snapshot ===\n")
+            for stat in last.compare_to(first, 'lineno')[:20]:
+                out.write("%s\n" % stat)
+
+        with open(self.reportPath, 'w') as report:
+            report.write(out.getvalue())
+        print("Profile report written to %s" % self.reportPath)
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+# Renders a capture file (see capture.py) offscreen to PNG frames or a video,
+# using the same 3D scene, camera presets, transform and colour mapping as Ultraviz.
+# Frames are split across a pool of processes. With the default --renderer=egl
+# (Linux), no GPU or display is needed: each process draws with a surfaceless
+# EGL context (see offscreen_gl.py), which without a GPU is Mesa's llvmpipe.
+# --renderer=qt draws with the Ultraviz 3D widget itself, which needs a display,
+# e.g. from xvfb-run. Qt's offscreen platform has no OpenGL, so it can't be used.
+#
+# Usage:
+#   $ python3 render_capture.py captures/capture_20200101-120000_000001.npz -o frames/
+#   $ python3 render_capture.py capture.npz -o sensation.mp4 --camera TOP --fps 60 --windowMs 5
+# Videos are encoded with ffmpeg, which must be on the PATH.
+import os
+import sys
+import shutil
+import argparse
+import tempfile
+import subprocess
+import multiprocessing
+import numpy as np
+
+from capture import loadCapture
+from colormaps import COLOR_MODES, COLORMAP_ANCHORS
+from transform import CoordinateTransform, TRANSFORM_PRESETS
+
+VIDEO_EXTENSIONS = ('.mp4', '.mkv', '.mov', '.avi', '.gif')
+
+# Per worker process state, set up once by initWorker
+_worker = {}
+
+def initWorker(options):
+    if options['renderer'] == 'egl':
+        # Must be set before OpenGL is first imported in this process
+        os.environ["PYOPENGL_PLATFORM"] = "egl"
+        from offscreen_gl import OffscreenScene
+        from PyQtGraph3DWidgets import Scatter3DScene
+        scene = OffscreenScene(options['size'])
+        scene.setCamera(**Scatter3DScene.CAMERA_PRESETS[options['camera']])
+        _worker.update(scene=scene)
+    else:
+        import pyqtgraph as pg
+        from PyQtGraph3DWidgets import Scatter3DPlot, Scatter3DScene
+        app = pg.mkQApp()
+        plot = Scatter3DPlot(pos=np.zeros((1, 3)), size=0, color=(0, 0, 0, 0))
+        scene = Scatter3DScene(plot=plot)
+        scene.setCameraPresetByName(options['camera'])
+        scene._widget.resize(*options['size'])
+        scene._widget.show()
+        _worker.update(app=app, pg=pg, scene=scene, plot=plot)
+
+    from colormaps import RenderAttributes
+    times, points, _ = loadCapture(options['capture'])
+    transform = CoordinateTransform.fromPreset(options['transform'])
+    _worker.update(times=times, points=transform.apply(points), options=options,
+                   attributes=RenderAttributes(len(points), color_mode=options['colorMode'], colormap=options['colorMap']))
+
+def renderFrame(pos, color, size, path):
+    """Draw one frame with the worker's renderer and save it as a PNG"""
+    width, height = _worker['options']['size']
+    if _worker['options']['renderer'] == 'egl':
+        image = np.ascontiguousarray(_worker['scene'].render(pos, color, size))
+        from PyQt5 import QtGui
+        QtGui.QImage(image.data, width, height, 4 * width, QtGui.QImage.Format_RGBA8888).save(path)
+    else:
+        _worker['plot'].setData(pos=pos, color=color, size=size)
+        # renderToArray gives (height, width) rows of BGRA
+        image = _worker['scene']._widget.renderToArray((width, height))
+        _worker['pg'].makeQImage(image, transpose=False).save(path)
+        _worker['app'].processEvents()
+
+def renderFrames(frames):
+    """Render (index, time) frames to PNG files, returning how many were written"""
+    options = _worker['options']
+    times, points = _worker['times'], _worker['points']
+    attributes = _worker['attributes']
+    window = options['windowMs'] / 1000.0
+
+    for index, frameTime in frames:
+        first = np.searchsorted(times, frameTime - window, side='right')
+        last = np.searchsorted(times, frameTime, side='right')
+        if last > first:
+            attributes.update(times[first:last], points[first:last], force=True)
+            pos, color, size = attributes.acquire()
+        else:
+            pos, color, size = np.zeros((1, 3)), (0, 0, 0, 0), 0
+        renderFrame(pos, color, size, os.path.join(options['frameDir'], 'frame_%06d.png' % index))
+    return len(frames)
+
+def frameTimes(times, fps, speed):
+    """Capture times of each output frame, at 'fps' frames per second of output video"""
+    duration = (times[-1] - times[0]) / speed
+    count = max(1, int(duration * fps) + 1)
+    return times[0] + np.arange(count) * speed / fps
+
+def encodeVideo(frame_dir, fps, output):
+    ffmpeg = shutil.which('ffmpeg')
+    if not ffmpeg:
+        print("ffmpeg not found - frames left in %s" % frame_dir)
+        return False
+    command = [ffmpeg, '-y', '-loglevel', 'error', '-framerate', str(fps),
+               '-i', os.path.join(frame_dir, 'frame_%06d.png')]
+    if not output.lower().endswith('.gif'):
+        command += ['-pix_fmt', 'yuv420p', '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2']
+    subprocess.check_call(command + [output])
+    return True
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+
+    # Only used for the camera preset names, so no display is needed
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from PyQtGraph3DWidgets import Scatter3DScene
+
+    parser = argparse.ArgumentParser(usage="<capture file> -o <frame directory or video file>")
+    parser.add_argument('capture', help='A capture file saved by Ultraviz trigger capture.')
+    parser.add_argument('-o', '--output', required=True, help='Directory for PNG frames, or a video file (%s).' % ', '.join(VIDEO_EXTENSIONS))
+    parser.add_argument('-c', '--camera', choices=sorted(Scatter3DScene.CAMERA_PRESETS.keys()), default='DEFAULT', help='Camera preset.')
+    parser.add_argument('--fps', type=float, default=60.0, help='Output frames per second.')
+    parser.add_argument('--speed', type=float, default=1.0, help='Playback speed; below 1 for slow motion.')
+    parser.add_argument('-w', '--windowMs', type=float, default=50.0, help='Length of the trail shown in each frame, in milliseconds.')
+    parser.add_argument('--size', default='1280x720', help='Frame size, as WIDTHxHEIGHT.')
+    parser.add_argument('--transform', choices=sorted(TRANSFORM_PRESETS.keys()), default='default', help='Device to world coordinate transform preset.')
+    parser.add_argument('--colorMode', choices=COLOR_MODES, default='intensity')
+    parser.add_argument('--colorMap', choices=sorted(COLORMAP_ANCHORS.keys()), default='white')
+    parser.add_argument('-r', '--renderer', choices=('egl', 'qt'), default='egl' if sys.platform.startswith('linux') else 'qt', help='egl: draw headless with a surfaceless EGL context (Linux, no display needed). qt: draw with the Ultraviz 3D widget, which needs a display.')
+    parser.add_argument('-j', '--workers', type=int, default=multiprocessing.cpu_count(), help='Number of render processes.')
+    args = parser.parse_args()
+
+    times, points, _ = loadCapture(args.capture)
+    if len(times) == 0:
+        print("Capture is empty: %s" % args.capture)
+        sys.exit(1)
+
+    isVideo = args.output.lower().endswith(VIDEO_EXTENSIONS)
+    frameDir = tempfile.mkdtemp(prefix='ultraviz_frames_') if isVideo else args.output
+    if not os.path.isdir(frameDir):
+        os.makedirs(frameDir)
+
+    options = {'capture': args.capture, 'camera': args.camera, 'windowMs': args.windowMs,
+               'size': tuple(int(v) for v in args.size.lower().split('x')),
+               'transform': args.transform, 'colorMode': args.colorMode, 'colorMap': args.colorMap,
+               'frameDir': frameDir, 'renderer': args.renderer}
+
+    # Several contiguous chunks per worker keeps the pool busy until the end
+    frames = list(enumerate(frameTimes(times, args.fps, args.speed)))
+    chunkCount = max(1, min(len(frames), args.workers * 4))
+    bounds = np.linspace(0, len(frames), chunkCount + 1).astype(int)
+    chunks = [frames[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    print("Rendering %d frames with %d processes" % (len(frames), args.workers))
+    context = multiprocessing.get_context('spawn')
+    with context.Pool(args.workers, initializer=initWorker, initargs=(options,)) as pool:
+        written = sum(pool.imap_unordered(renderFrames, chunks))
+    print("Rendered %d frames to %s" % (written, frameDir))
+
+    if isVideo and encodeVideo(frameDir, args.fps, args.output):
+        shutil.rmtree(frameDir)
+        print("Wrote %s" % args.output)
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+"""
+# A 2D oscilloscope-style view of control point X-Y-Z and intensity over time.
+----------------------------------------------------------
+Curves are given views straight into the TimestampedBuffer, so no copy is
+made per frame, and pyqtgraph's peak downsampling and clip-to-view keep the
+number of drawn vertices close to the plot's pixel width.
+Runs of log lines without a control point are marked along the bottom
+of the intensity plot.
+"""
+try:
+    import numpy as np
+    import pyqtgraph as pg
+    from PyQt5.QtWidgets import QWidget, QVBoxLayout
+    from PyQt5.QtCore import QTimer
+except Exception as e:
+    print("Exception on thirdparty import: " + str(e))
+    print("*** WARNING: Unable to import dependencies. Please install via:\n\n pip3 install --user pyqt5 pyqtgraph \n")
+
+class ScopeWidget(QWidget):
+    # (name, buffer column, pen colour)
+    POSITION_CHANNELS = (('x', 0, (255, 90, 90)),
+                         ('y', 1, (90, 255, 90)),
+                         ('z', 2, (90, 150, 255)))
+    INTENSITY_CHANNELS = (('intensity', 3, (0, 207, 117)),)
+
+    # Refresh interval, in ms, for ~60 FPS
+    REFRESH_INTERVAL = 16
+
+    def __init__(self, viewer, parent=None):
+        super(ScopeWidget, self).__init__(parent)
+
+        # The UHSDKLogViewer whose point buffer we display
+        self.viewer = viewer
+        self._lastTime = None
+
+        self.positionPlot = self._createPlot('position')
+        self.intensityPlot = self._createPlot('intensity')
+        self.intensityPlot.setXLink(self.positionPlot)
+        self.intensityPlot.setLabel('bottom', 'time', units='s')
+
+        self.curves = []
+        for plot, channels in ((self.positionPlot, self.POSITION_CHANNELS),
+                               (self.intensityPlot, self.INTENSITY_CHANNELS)):
+            for name, column, colour in channels:
+                curve = plot.plot(pen=pg.mkPen(colour, width=1), name=name)
+                self.curves.append((curve, column))
+
+        self.gapMarkers = self.intensityPlot.plot(pen=None, symbol='t', symbolSize=6,
+                                                  symbolPen=None, symbolBrush=(200, 200, 200, 160), name='gaps')
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addWidget(self.positionPlot, 2)
+        layout.addWidget(self.intensityPlot, 1)
+        self.setLayout(layout)
+
+        self.refreshTimer = QTimer()
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.refreshTimer.start(self.REFRESH_INTERVAL)
+
+    def _createPlot(self, label):
+        plot = pg.PlotWidget()
+        plot.setLabel('left', label)
+        plot.addLegend(offset=(-10, 10))
+        plot.showGrid(x=True, y=True, alpha=0.3)
+        plot.setDownsampling(auto=True, mode='peak')
+        plot.setClipToView(True)
+        plot.setMouseEnabled(x=False, y=True)
+        return plot
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+
+        times, pts = self.viewer.getPlotPoints()
+        if len(times) == 0 or times[-1] == self._lastTime:
+            return
+        self._lastTime = times[-1]
+
+        for curve, column in self.curves:
+            curve.setData(x=times, y=pts[:, column])
+
+        gapTimes, gaps = self.viewer.gapBuffer.between(times[0], times[-1])
+        self.gapMarkers.setData(x=gapTimes, y=np.zeros(len(gapTimes)))
+        self.positionPlot.setXRange(times[0], times[-1], padding=0)
@@ -0,0 +1,343 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Emulates the logging of an Ultrahaptics SDK application
+----------------------------------------------------------
+Stands in for a real application, so that launching, reading the log
+pipe, parsing and rendering can all be exercised without a device. Like
+an application using the SDK, it takes its log destination and level from
+UH_LOG_DEST and UH_LOG_LEVEL, which override its own settings
+(--appLogDest, --appLogLevel) when UH_LOG_DEST_FORCE and UH_LOG_LEVEL_FORCE
+are "1", as Ultraviz sets them. The destination may be a fifo, a Windows
+named pipe, or a file; without one the log goes to stdout.
+
+Levels are modelled as 1 errors, 2 warnings, 3 info and 4 everything,
+including a line per control point per update:
+  2020-01-01 12:00:00.000125 TRACE point 0 position [0.02000,0.00000,0.20000] intensity 1.0000
+
+Control points follow a path shape at up to 40 kHz, mixed with noise
+lines, and the update rate can burst, stall, and the application exit and
+restart. Ultraviz launches its executable without arguments, so options
+can also be given in UH_EMULATOR_ARGS.
+
+$ python3 Ultraviz.py -e=/path/to/Ultraviz/src/sdk_emulator.py
+$ UH_EMULATOR_ARGS="--controlPoints 4 --rate 40000 --path lissajous" python3 Ultraviz.py -e=...
+$ UH_LOG_DEST=/tmp/uhsdk_log UH_LOG_LEVEL=4 python3 sdk_emulator.py --stallEvery 10 --stallSeconds 0.5
+"""
+import os
+import sys
+import time
+import shlex
+import argparse
+import numpy as np
+
+MAX_RATE = 40000.0
+
+# Each write is kept within the message size of Ultraviz's Windows pipe
+MAX_WRITE_BYTES = 64 * 1024
+
+# (level, message) of lines logged among the control points
+NOISE_MESSAGES = (
+    (4, 'DEBUG Emitter update queue depth %d'),
+    (4, 'DEBUG Transducer array temperature %d.5 C'),
+    (3, 'INFO Sensation evaluated in %d us'),
+    (3, 'INFO Tracking frame %d received'),
+    (2, 'WARNING Update late by %d us'),
+    (1, 'ERROR Device message %d checksum mismatch, resending'),
+)
+
+PATH_SHAPES = ('circle', 'line', 'figure8', 'lissajous', 'static', 'random')
+
+def loggingSettings(environ, app_level=None, app_dest=None):
+    """(level, destination) as the SDK decides them: the application's own
+    settings, unless unset or overridden by forced environment variables"""
+    level = app_level
+    if 'UH_LOG_LEVEL' in environ and (level is None or environ.get('UH_LOG_LEVEL_FORCE') == '1'):
+        level = int(environ['UH_LOG_LEVEL'])
+    dest = app_dest
+    if environ.get('UH_LOG_DEST') and (dest is None or environ.get('UH_LOG_DEST_FORCE') == '1'):
+        dest = environ['UH_LOG_DEST']
+    return (3 if level is None else level), dest
+
+
+class LogDestination(object):
+    def __init__(self, path=None):
+        super(LogDestination, self).__init__()
+        self.path = path
+        self.file = None
+        # Times the reader went away and the destination was reopened
+        self.reopens = 0
+
+    def open(self):
+        if not self.path:
+            self.file = sys.stdout.buffer
+            return
+        # Opening a fifo or pipe blocks until Ultraviz opens it for reading
+        mode = 'ab' if os.path.isfile(self.path) or not os.path.exists(self.path) else 'wb'
+        self.file = open(self.path, mode, buffering=0)
+
+    def write(self, data):
+        for start in range(0, len(data), MAX_WRITE_BYTES):
+            chunk = data[start:start + MAX_WRITE_BYTES]
+            try:
+                self.file.write(chunk)
+            except OSError as e:
+                if not self.path:
+                    raise
+                # The reader has gone; wait for it to come back, as the SDK would
+                print("Log destination closed (%s), reopening" % e, file=sys.stderr)
+                self.close()
+                self.reopens += 1
+                self.open()
+                self.file.write(chunk)
+        if not self.path:
+            self.file.flush()
+
+    def close(self):
+        if self.file and self.path:
+            try:
+                self.file.close()
+            except OSError:
+                pass
+        self.file = None
+
+
+class PathGenerator(object):
+    def __init__(self, shape='circle', count=1, radius=0.02, height=0.2, path_hz=100.0, am_hz=0.0,
+                 jitter=0.0, seed=None):
+        super(PathGenerator, self).__init__()
+        if shape not in PATH_SHAPES:
+            raise ValueError("Unknown path shape: %s" % shape)
+        self.shape = shape
+        self.count = count
+        # In metres and Hz
+        self.radius = radius
+        self.height = height
+        self.pathHz = path_hz
+        self.amHz = am_hz
+        self.jitter = jitter
+        self.rng = np.random.RandomState(seed)
+        # Control points are spread evenly around the path
+        self.offsets = 2 * np.pi * np.arange(count) / count
+        # For the random walk, each control point's last position, and when
+        self._walk = np.zeros((count, 2))
+        self._lastTime = None
+
+    def sample(self, times):
+        """(N, count, 4) X-Y-Z-I of each control point at (N,) times"""
+        n = len(times)
+        phase = 2 * np.pi * self.pathHz * times[:, None] + self.offsets[None, :]
+        r = self.radius
+        if self.shape == 'circle':
+            x, y = r * np.cos(phase), r * np.sin(phase)
+        elif self.shape == 'line':
+            x, y = r * np.sin(phase), np.zeros_like(phase)
+        elif self.shape == 'figure8':
+            x, y = r * np.sin(phase), 0.5 * r * np.sin(2 * phase)
+        elif self.shape == 'lissajous':
+            x, y = r * np.sin(3 * phase + np.pi / 2), r * np.sin(2 * phase)
+        elif self.shape == 'static':
+            x = np.repeat(r * np.cos(self.offsets)[None, :], n, axis=0)
+            y = np.repeat(r * np.sin(self.offsets)[None, :], n, axis=0)
+        else:
+            # Wandering about a radius in each path period, bounded to the radius
+            dt = np.diff(np.concatenate(([times[0] if self._lastTime is None else self._lastTime], times)))
+            steps = self.rng.normal(size=(n, self.count, 2)) * (r * np.sqrt(self.pathHz * dt))[:, None, None]
+            walk = np.clip(self._walk[None] + np.cumsum(steps, axis=0), -r, r)
+            if n:
+                self._walk = walk[-1]
+                self._lastTime = times[-1]
+            x, y = walk[:, :, 0], walk[:, :, 1]
+
+        out = np.empty((n, self.count, 4))
+        out[:, :, 0], out[:, :, 1] = x, y
+        out[:, :, 2] = self.height
+        if self.jitter:
+            out[:, :, 0:3] += self.rng.normal(scale=self.jitter, size=(n, self.count, 3))
+        out[:, :, 3] = 0.5 + 0.5 * np.sin(2 * np.pi * self.amHz * times)[:, None] if self.amHz else 1.0
+        return out
+
+
+class SDKEmulator(object):
+    def __init__(self, destination, generator, level=4, rate=16000.0, noise=0.001, tick=0.005,
+                 burst_every=0.0, burst_seconds=0.0, burst_factor=4.0, stall_every=0.0, stall_seconds=0.0, seed=None):
+        super(SDKEmulator, self).__init__()
+        self.destination = destination
+        self.generator = generator
+        self.level = level
+        # Updates per second, each updating every control point
+        self.rate = min(rate, MAX_RATE)
+        # Noise lines per control point line
+        self.noise = noise
+        # Seconds between writes
+        self.tick = tick
+        # Periods, in seconds, of bursts at burst_factor times the rate, and of stalls with no output
+        self.burstEvery = burst_every
+        self.burstSeconds = burst_seconds
+        self.burstFactor = burst_factor
+        self.stallEvery = stall_every
+        self.stallSeconds = stall_seconds
+        self.rng = np.random.RandomState(seed)
+
+        self.updates = 0
+        self.lines = 0
+        self.bytes = 0
+        # Updates not sent because the emulator fell too far behind
+        self.skipped = 0
+
+    def log(self, level, message, now=None):
+        if level <= self.level:
+            self.write([self.linePrefix(now or time.time()) + message])
+
+    def linePrefix(self, t):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(t)) + ('.%06d ' % int((t % 1) * 1e6))
+
+    def write(self, lines):
+        data = ('\n'.join(lines) + '\n').encode()
+        self.destination.write(data)
+        self.lines += len(lines)
+        self.bytes += len(data)
+
+    def updateLines(self, times):
+        """Log lines for updates at (N,) wall clock times, all within one second"""
+        lines = []
+        if self.level >= 4 and len(times):
+            samples = self.generator.sample(times)
+            # One 'YYYY-mm-dd HH:MM:SS' for the whole tick, which ticks are split not to cross
+            stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(times[0]))
+            micros = ((times % 1) * 1e6).astype(np.int64).tolist()
+            values = samples.tolist()
+            lines = ['%s.%06d TRACE point %d position [%.5f,%.5f,%.5f] intensity %.4f' %
+                     (stamp, micro, point, p[0], p[1], p[2], p[3])
+                     for micro, update in zip(micros, values) for point, p in enumerate(update)]
+
+        noiseCount = self.rng.binomial(max(len(times) * self.generator.count, 1), self.noise)
+        if noiseCount:
+            positions = np.sort(self.rng.randint(0, len(lines) + 1, noiseCount))
+            prefix = self.linePrefix(times[-1] if len(times) else time.time())
+            noise = []
+            for i in self.rng.randint(0, len(NOISE_MESSAGES), noiseCount):
+                level, message = NOISE_MESSAGES[i]
+                noise.append(prefix + message % self.rng.randint(1, 1000) if level <= self.level else None)
+            for position, line in reversed(list(zip(positions, noise))):
+                if line:
+                    lines.insert(position, line)
+        return lines
+
+    def inPeriod(self, elapsed, every, seconds):
+        """Whether 'elapsed' falls in the last 'seconds' of a period of 'every' seconds"""
+        return every > 0 and seconds > 0 and elapsed % every >= every - seconds
+
+    def run(self, seconds=0.0):
+        """Log updates in real time for 'seconds', or until interrupted if 0"""
+        start = time.monotonic()
+        clockOffset = time.time() - start
+        last = start
+        due = 0.0
+        while True:
+            now = time.monotonic()
+            elapsed = now - start
+            if seconds and elapsed >= seconds:
+                return
+
+            if self.inPeriod(elapsed, self.stallEvery, self.stallSeconds):
+                remaining = self.stallEvery - elapsed % self.stallEvery
+                time.sleep(remaining)
+                # A stalled device skips the updates it missed
+                last = time.monotonic()
+                due = 0.0
+                self.log(2, 'WARNING Device update stalled for %d ms' % (remaining * 1000))
+                continue
+
+            rate = self.rate
+            if self.inPeriod(elapsed, self.burstEvery, self.burstSeconds):
+                rate = min(rate * self.burstFactor, MAX_RATE)
+            # End each tick at a whole second of wall clock time, as its lines share one time stamp
+            now = min(now, np.floor(last + clockOffset) + 1 - clockOffset)
+            due += (now - last) * rate
+            count = int(due)
+            due -= count
+            # Don't try to catch up more than a quarter of a second
+            if count > rate / 4:
+                self.skipped += count - int(rate / 4)
+                count = int(rate / 4)
+            times = last + (now - last) * np.arange(count) / max(count, 1) + clockOffset
+            last = now
+            lines = self.updateLines(times)
+            if lines:
+                self.write(lines)
+            self.updates += count
+
+            pause = self.tick - (time.monotonic() - now)
+            if pause > 0:
+                time.sleep(pause)
+
+
+def parseArguments(argv):
+    parser = argparse.ArgumentParser(description='Emulate the log output of an Ultrahaptics SDK application.')
+    parser.add_argument('--controlPoints', type=int, default=1, help='Number of control points.')
+    parser.add_argument('--rate', type=float, default=16000.0, help='Updates per second, up to %d.' % MAX_RATE)
+    parser.add_argument('--path', choices=PATH_SHAPES, default='circle', help='Shape the control points follow.')
+    parser.add_argument('--radius', type=float, default=0.02, help='Size of the path, in metres.')
+    parser.add_argument('--height', type=float, default=0.2, help='Height of the path above the array, in metres.')
+    parser.add_argument('--pathHz', type=float, default=100.0, help='Times per second the path is drawn.')
+    parser.add_argument('--amHz', type=float, default=0.0, help='Intensity modulation frequency, 0 for constant intensity.')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of noise added to positions, in metres.')
+    parser.add_argument('--noise', type=float, default=0.001, help='Other log lines per control point line.')
+    parser.add_argument('--tickMs', type=float, default=5.0, help='Interval between writes to the log, in ms.')
+    parser.add_argument('--burstEvery', type=float, default=0.0, help='Every this many seconds, burst the update rate.')
+    parser.add_argument('--burstSeconds', type=float, default=1.0, help='Length of each burst, in seconds.')
+    parser.add_argument('--burstFactor', type=float, default=4.0, help='Update rate multiplier during bursts (still at most %d).' % MAX_RATE)
+    parser.add_argument('--stallEvery', type=float, default=0.0, help='Every this many seconds, stop logging for a while.')
+    parser.add_argument('--stallSeconds', type=float, default=0.5, help='Length of each stall, in seconds.')
+    parser.add_argument('--runSeconds', type=float, default=0.0, help='Exit after this many seconds, 0 to run until interrupted.')
+    parser.add_argument('--restarts', type=int, default=0, help='With --runSeconds, close and reopen the log this many times before exiting, as if restarted.')
+    parser.add_argument('--restartDelay', type=float, default=1.0, help='Seconds between closing the log and reopening it on a restart.')
+    parser.add_argument('--exitCode', type=int, default=0, help='Exit status after the last run.')
+    parser.add_argument('--crash', action='store_true', help='End the last run mid-line, without closing the log, as if crashed.')
+    parser.add_argument('--appLogLevel', type=int, required=False, help='Log level set by the emulated application; UH_LOG_LEVEL overrides it if forced.')
+    parser.add_argument('--appLogDest', required=False, help='Log destination set by the emulated application; UH_LOG_DEST overrides it if forced.')
+    parser.add_argument('--seed', type=int, required=False, help='Random seed, for repeatable noise and random paths.')
+    args = parser.parse_args(argv)
+    if args.rate > MAX_RATE:
+        parser.error("--rate may be at most %d" % MAX_RATE)
+    return args
+
+if __name__ == '__main__':
+    args = parseArguments(shlex.split(os.environ.get('UH_EMULATOR_ARGS', '')) + sys.argv[1:])
+    level, dest = loggingSettings(os.environ, app_level=args.appLogLevel, app_dest=args.appLogDest)
+    destination = LogDestination(dest)
+    generator = PathGenerator(args.path, count=args.controlPoints, radius=args.radius, height=args.height,
+                              path_hz=args.pathHz, am_hz=args.amHz, jitter=args.jitter, seed=args.seed)
+    emulator = SDKEmulator(destination, generator, level=level, rate=args.rate, noise=args.noise,
+                           tick=args.tickMs / 1000.0, burst_every=args.burstEvery, burst_seconds=args.burstSeconds,
+                           burst_factor=args.burstFactor, stall_every=args.stallEvery,
+                           stall_seconds=args.stallSeconds, seed=args.seed)
+    print("SDK emulator: level %d to %s, %d control points at %g Hz" %
+          (level, dest or 'stdout', args.controlPoints, emulator.rate), file=sys.stderr)
+
+    runs = args.restarts + 1 if args.runSeconds else 1
+    try:
+        for run in range(runs):
+            if run:
+                time.sleep(args.restartDelay)
+            destination.open()
+            emulator.log(3, 'INFO Ultrahaptics SDK emulator starting (run %d of %d)' % (run + 1, runs))
+            emulator.log(3, 'INFO Device connected: serial EMU-%04d' % (os.getpid() % 10000))
+            start = time.monotonic()
+            before = (emulator.updates, emulator.lines, emulator.bytes, emulator.skipped)
+            emulator.run(args.runSeconds)
+            updates, lines, size, skipped = (emulator.updates - before[0], emulator.lines - before[1],
+                                             emulator.bytes - before[2], emulator.skipped - before[3])
+            print("Run %d: %d updates, %d lines, %.1f MB in %.1f s (%d skipped)" %
+                  (run + 1, updates, lines, size / 1e6, time.monotonic() - start, skipped), file=sys.stderr)
+            if args.crash and run == runs - 1:
+                destination.write((emulator.linePrefix(time.time()) + 'TRACE point 0 position [0.0').encode())
+                os._exit(args.exitCode or 1)
+            emulator.log(3, 'INFO Device disconnected')
+            destination.close()
+    except (KeyboardInterrupt, BrokenPipeError):
+        pass
+    finally:
+        destination.close()
+    sys.exit(args.exitCode)
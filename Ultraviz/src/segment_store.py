@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+# Disk-backed store of the raw SDK log, for long sessions
+----------------------------------------------------------
+SegmentedLogWriter appends each block of complete lines read from the log
+to a segment file, and each line's end offset and wall clock time to a
+sidecar index, 16 bytes per line. A new segment is started once the
+current one reaches segment_bytes, named after the session line number
+it starts at, and the oldest segments are deleted to keep within a total
+size and age. The budgets are applied when the writer opens, at each new
+segment, and at least every prune_interval seconds while lines arrive, so
+a slow log's segments still age out.
+
+SegmentedLogReader memory-maps the segments and their indexes, so no
+segment is read into memory. A line range is found by bisecting the
+segments' first line numbers, then reading the index directly; a time
+window by bisecting the segments' first times, then the index's times.
+Either way only O(log n) index entries are touched.
+
+Print lines from a store with:
+$ python3 segment_store.py ultraviz_logs --lines 1000:1100
+$ python3 segment_store.py ultraviz_logs --since "2020-01-01 23:00:00" --until "2020-01-01 23:00:05"
+"""
+import os
+import re
+import sys
+import mmap
+import time
+import bisect
+import argparse
+import numpy as np
+
+# One index record per line: where the line ends in its segment, and its time (seconds since the epoch)
+INDEX_DTYPE = np.dtype([('end', '<i8'), ('time', '<f8')])
+SEGMENT_PATTERN = re.compile(r'^segment_(\d+)\.log$')
+
+def segmentPaths(directory, first):
+    base = os.path.join(directory, 'segment_%012d' % first)
+    return base + '.log', base + '.idx'
+
+def listSegments(directory):
+    """First line numbers of the segments in a directory, in order"""
+    if not os.path.isdir(directory):
+        return []
+    return sorted(int(match[1]) for match in map(SEGMENT_PATTERN.match, os.listdir(directory)) if match)
+
+def indexLength(path):
+    """Number of complete records in an index file"""
+    try:
+        return os.path.getsize(path) // INDEX_DTYPE.itemsize
+    except OSError:
+        return 0
+
+
+class SegmentedLogWriter(object):
+    def __init__(self, directory, segment_bytes=256 * 1024 * 1024, max_bytes=None, max_age=None, flush_interval=0.5, prune_interval=60.0):
+        super(SegmentedLogWriter, self).__init__()
+        self.directory = directory
+        self.segmentBytes = segment_bytes
+        # Budgets for all segments together: bytes, and seconds since last written
+        self.maxBytes = max_bytes
+        self.maxAge = max_age
+        # Data is flushed this often, in seconds, so readers see it
+        self.flushInterval = flush_interval
+        # Segments are checked against the budgets at least this often, in seconds
+        self.pruneInterval = prune_interval
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Line times are given as time.monotonic(); segments hold wall clock times
+        self._clockOffset = time.time() - time.monotonic()
+
+        # Carry on the line numbers of any segments already in the directory
+        segments = listSegments(directory)
+        self.count = segments[-1] + indexLength(segmentPaths(directory, segments[-1])[1]) if segments else 0
+        self._log = None
+        self._index = None
+        self._size = 0
+        self._lastFlush = 0.0
+        self._lastPrune = 0.0
+        self._startSegment()
+        # Segments left by earlier sessions may already be over budget
+        self.prune()
+
+    def _startSegment(self):
+        logPath, indexPath = segmentPaths(self.directory, self.count)
+        self._log = open(logPath, 'wb')
+        self._index = open(indexPath, 'wb')
+        self._size = 0
+
+    def _closeSegment(self):
+        if self._log:
+            self._log.close()
+            self._index.close()
+            self._log = self._index = None
+
+    def append(self, block, times=None):
+        """Add a block of complete, newline-terminated lines, optionally with each line's time.monotonic()"""
+        if not block or self._log is None:
+            return
+        ends = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+        if len(ends) == 0:
+            return
+        records = np.empty(len(ends), dtype=INDEX_DTYPE)
+        records['end'] = self._size + ends + 1
+        records['time'] = time.time() if times is None else np.asarray(times) + self._clockOffset
+        # The text goes first, so an index entry never points past it
+        self._log.write(block)
+        self._index.write(records.tobytes())
+        self._size += len(block)
+        self.count += len(ends)
+
+        now = time.monotonic()
+        if now - self._lastFlush >= self.flushInterval:
+            self._log.flush()
+            self._index.flush()
+            self._lastFlush = now
+        if self._size >= self.segmentBytes:
+            self._closeSegment()
+            self._startSegment()
+            self.prune()
+        elif now - self._lastPrune >= self.pruneInterval:
+            self.prune()
+
+    def prune(self):
+        """Delete the oldest finished segments beyond the size and age budgets"""
+        self._lastPrune = time.monotonic()
+        segments = listSegments(self.directory)[:-1]
+        if not segments or not (self.maxBytes or self.maxAge):
+            return
+        sizes = {}
+        for first in listSegments(self.directory):
+            sizes[first] = sum(os.path.getsize(path) for path in segmentPaths(self.directory, first) if os.path.exists(path))
+        total = sum(sizes.values())
+        now = time.time()
+        for first in segments:
+            logPath, indexPath = segmentPaths(self.directory, first)
+            tooBig = self.maxBytes and total > self.maxBytes
+            tooOld = self.maxAge and now - os.path.getmtime(logPath) > self.maxAge
+            if not (tooBig or tooOld):
+                break
+            try:
+                # The index first, so a reader never finds an index without its text
+                os.remove(indexPath)
+                os.remove(logPath)
+            except OSError as e:
+                # e.g. still mapped by a reader on Windows; try again after the next segment
+                print("Unable to delete log segment: " + str(e))
+                break
+            total -= sizes[first]
+
+    def close(self):
+        self._closeSegment()
+
+
+class Segment(object):
+    def __init__(self, directory, first):
+        super(Segment, self).__init__()
+        self.first = first
+        self.logPath, self.indexPath = segmentPaths(directory, first)
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+        self.text = b''
+        self._file = None
+
+    def open(self):
+        """Map the segment as it is now, which for the one being written may be more than last time"""
+        length = indexLength(self.indexPath)
+        if length == len(self.index):
+            return
+        self.close()
+        if not length:
+            return
+        self._file = open(self.logPath, 'rb')
+        self.text = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        index = np.memmap(self.indexPath, dtype=INDEX_DTYPE, mode='r', shape=(length,))
+        # Only lines whose text has reached the disk too
+        self.index = index[:bisect.bisect_right(index['end'], len(self.text))]
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def end(self):
+        return self.first + len(self.index)
+
+    def startTime(self):
+        return float(self.index['time'][0]) if len(self.index) else None
+
+    def offset(self, i):
+        """Where line i of this segment starts"""
+        return int(self.index['end'][i - 1]) if i > 0 else 0
+
+    def close(self):
+        if self._file:
+            if isinstance(self.text, mmap.mmap):
+                self.text.close()
+            self._file.close()
+            self._file = None
+        self.text = b''
+        self.index = np.zeros(0, dtype=INDEX_DTYPE)
+
+
+class SegmentedLogReader(object):
+    def __init__(self, directory):
+        super(SegmentedLogReader, self).__init__()
+        self.directory = directory
+        self.segments = []
+        self.refresh()
+
+    def refresh(self):
+        """Pick up new and deleted segments, and lines added to the last one"""
+        known = {segment.first: segment for segment in self.segments}
+        firsts = listSegments(self.directory)
+        for first in set(known) - set(firsts):
+            known[first].close()
+        self.segments = [known.get(first) or Segment(self.directory, first) for first in firsts]
+        for segment in self.segments:
+            try:
+                segment.open()
+            except (OSError, ValueError):
+                # Deleted since it was listed, or nothing written yet
+                segment.close()
+        self.segments = [segment for segment in self.segments if len(segment)]
+        self._firsts = [segment.first for segment in self.segments]
+        self._startTimes = [segment.startTime() for segment in self.segments]
+
+    @property
+    def first(self):
+        return self.segments[0].first if self.segments else 0
+
+    @property
+    def count(self):
+        return self.segments[-1].end if self.segments else 0
+
+    def _segmentIndex(self, line):
+        return bisect.bisect_right(self._firsts, line) - 1
+
+    def raw(self, start, end):
+        """The bytes of lines start..end-1 still held, as one block"""
+        start, end = max(start, self.first), min(end, self.count)
+        parts = []
+        s = max(self._segmentIndex(start), 0)
+        while start < end and s < len(self.segments):
+            segment = self.segments[s]
+            if start < segment.first:
+                # Lines missing between segments
+                start = segment.first
+                continue
+            last = min(end, segment.end)
+            if last > start:
+                parts.append(segment.text[segment.offset(start - segment.first):segment.offset(last - segment.first)])
+            start = last
+            s += 1
+        return b''.join(parts)
+
+    def lines(self, start, end):
+        """The text of lines start..end-1 still held"""
+        text = self.raw(start, end).decode('utf-8', errors='replace')
+        return [line.rstrip('\r') for line in text.split('\n')[:-1]]
+
+    def times(self, start, end):
+        """Wall clock times of lines start..end-1 still held"""
+        start, end = max(start, self.first), min(end, self.count)
+        parts = []
+        for s in range(max(self._segmentIndex(start), 0), len(self.segments)):
+            segment = self.segments[s]
+            if segment.first >= end:
+                break
+            a, b = max(start, segment.first) - segment.first, min(end, segment.end) - segment.first
+            if b > a:
+                parts.append(np.array(segment.index['time'][a:b]))
+        return np.concatenate(parts) if parts else np.zeros(0)
+
+    def lineAt(self, t):
+        """The first line at or after wall clock time t"""
+        s = bisect.bisect_right(self._startTimes, t) - 1
+        if s < 0:
+            return self.first
+        segment = self.segments[s]
+        return segment.first + bisect.bisect_left(segment.index['time'], t)
+
+    def window(self, start_time, end_time):
+        """(first line, end line) of the lines from start_time up to end_time"""
+        return self.lineAt(start_time), self.lineAt(end_time)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+        self.segments = []
+        self._firsts = []
+        self._startTimes = []
+
+
+def parseTime(value):
+    """Seconds since the epoch, from a number or a local 'YYYY-mm-dd HH:MM:SS' time"""
+    try:
+        return float(value)
+    except ValueError:
+        return time.mktime(time.strptime(value, '%Y-%m-%d %H:%M:%S'))
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Print lines from a segmented SDK log store.')
+    parser.add_argument('directory', help='The store, as given to Ultraviz.py --logDir.')
+    parser.add_argument('--lines', required=False, help='A range of line numbers, "start:end".')
+    parser.add_argument('--since', required=False, help='Print lines from this time, as seconds since the epoch or "YYYY-mm-dd HH:MM:SS".')
+    parser.add_argument('--until', required=False, help='Print lines up to this time.')
+    parser.add_argument('--times', action='store_true', help='Prefix each line with its line number and time.')
+    args = parser.parse_args()
+
+    reader = SegmentedLogReader(args.directory)
+    if args.lines:
+        start, _, end = args.lines.partition(':')
+        start = int(start) if start else reader.first
+        end = int(end) if end else reader.count
+    elif args.since or args.until:
+        start = reader.lineAt(parseTime(args.since)) if args.since else reader.first
+        end = reader.lineAt(parseTime(args.until)) if args.until else reader.count
+    else:
+        if not reader.segments:
+            print("No segments in %s" % args.directory)
+            sys.exit(1)
+        size = sum(os.path.getsize(segment.logPath) for segment in reader.segments)
+        first, last = reader.times(reader.first, reader.first + 1)[0], reader.times(reader.count - 1, reader.count)[0]
+        print("Segments: %d (%.1f MB)" % (len(reader.segments), size / 1e6))
+        print("Lines:    %d to %d" % (reader.first, reader.count - 1))
+        print("From:     %s" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(first)))
+        print("To:       %s" % time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last)))
+        sys.exit(0)
+
+    # In slices, so a long range is never held in memory at once
+    for a in range(max(start, reader.first), min(end, reader.count), 100000):
+        b = min(a + 100000, end)
+        lines = reader.lines(a, b)
+        if args.times:
+            times = reader.times(a, b)
+            lines = ["%d %s.%03d %s" % (n, time.strftime('%H:%M:%S', time.localtime(t)), int(t * 1000) % 1000, line)
+                     for n, t, line in zip(range(a, b), times, lines)]
+        sys.stdout.write("\n".join(lines) + "\n")
@@ -0,0 +1,254 @@
+# -*- coding: utf-8 -*-
+"""
+# A shared memory ring of timestamped control point rows, so that local
+# analysis tools can read parsed data with no socket or serialisation cost.
+----------------------------------------------------------
+Layout of the shared memory block:
+  header  - 8 x uint64: magic, version, capacity, width, rows written,
+            rows being written, owner process ID, 0
+  times   - 2*capacity x float64, seconds (time.monotonic() of the writer)
+  points  - 2*capacity x width float32, X-Y-Z-I-ID rows in device units
+
+Like TimestampedBuffer, each row is written at slot and slot+capacity, so any
+run of up to 'capacity' rows is one contiguous NumPy view. The writer
+advances 'rows being written' before it touches any slot, and publishes the
+batch by advancing 'rows written' once the rows are in place, as a seqlock.
+A reader which falls more than 'capacity' rows behind skips ahead, counting
+the skipped rows as dropped, and can check that rows it has read weren't
+overwritten in the meantime against 'rows being written'.
+
+A ring left behind by an Ultraviz which didn't exit cleanly is replaced.
+Any other block of the same name, or a ring whose owner is still running,
+is left alone and the writer refuses to start.
+
+Reader example:
+  reader = SharedMemoryRingReader('ultraviz')
+  while True:
+      times, points = reader.read()
+      ... use the views ...
+      if not reader.intact(): ... the writer overwrote them while in use ...
+"""
+import os
+import sys
+import numpy as np
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    shared_memory = None
+    print("*** WARNING: multiprocessing.shared_memory needs Python 3.8 or later - shared memory output is unavailable")
+
+MAGIC = 0x525A5655  # 'UVZR'
+VERSION = 2
+HEADER_WORDS = 8
+H_MAGIC, H_VERSION, H_CAPACITY, H_WIDTH, H_WRITTEN, H_WRITING, H_OWNER = range(7)
+DEFAULT_NAME = 'ultraviz'
+
+def _layout(capacity, width):
+    headerBytes = HEADER_WORDS * 8
+    timesBytes = 2 * capacity * 8
+    pointsBytes = 2 * capacity * width * 4
+    return headerBytes, timesBytes, headerBytes + timesBytes + pointsBytes
+
+def _views(buf, capacity, width):
+    headerBytes, timesBytes, _ = _layout(capacity, width)
+    header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=buf)
+    times = np.ndarray((2*capacity,), dtype=np.float64, buffer=buf, offset=headerBytes)
+    points = np.ndarray((2*capacity, width), dtype=np.float32, buffer=buf, offset=headerBytes + timesBytes)
+    return header, times, points
+
+
+class SharedMemoryRingWriter(object):
+    """Creates and owns the ring, unless create is False, in which case it
+    attaches to a ring owned by another process and continues writing it."""
+    def __init__(self, name=DEFAULT_NAME, capacity=65536, width=5, create=True):
+        super(SharedMemoryRingWriter, self).__init__()
+        self.name = name
+        self.owner = create
+
+        if not create:
+            self.shm = shared_memory.SharedMemory(name=name)
+            header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+            if header[H_MAGIC] != MAGIC or header[H_VERSION] != VERSION:
+                self.shm.close()
+                raise ValueError("Shared memory '%s' is not an Ultraviz ring" % name)
+            self.capacity = int(header[H_CAPACITY])
+            self.width = int(header[H_WIDTH])
+            self.header, self.times, self.points = _views(self.shm.buf, self.capacity, self.width)
+            self.written = int(self.header[H_WRITTEN])
+            return
+
+        self.capacity = capacity
+        self.width = width
+        size = _layout(capacity, width)[2]
+        try:
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            _removeStale(name)
+            self.shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+
+        self.header, self.times, self.points = _views(self.shm.buf, capacity, width)
+        self.header[:] = 0
+        self.header[H_MAGIC] = MAGIC
+        self.header[H_VERSION] = VERSION
+        self.header[H_CAPACITY] = capacity
+        self.header[H_WIDTH] = width
+        self.header[H_OWNER] = os.getpid()
+        self.written = 0
+
+    def write(self, times, points):
+        """Publish a batch of (N,) times and (N,width) rows"""
+        n = len(times)
+        if n == 0:
+            return
+        if n > self.capacity:
+            times = times[-self.capacity:]
+            points = points[-self.capacity:]
+            self.written += n - self.capacity
+            n = self.capacity
+
+        # Readers of any row these slots held can tell it's being overwritten
+        self.header[H_WRITING] = self.written + n
+
+        slots = (self.written + np.arange(n)) % self.capacity
+        self.times[slots] = times
+        self.times[slots + self.capacity] = times
+        self.points[slots] = points
+        self.points[slots + self.capacity] = points
+
+        # Publish only once the rows are in place
+        self.written += n
+        self.header[H_WRITTEN] = self.written
+
+    def close(self):
+        self.header = self.times = self.points = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedMemoryRingReader(object):
+    """Pass same_process=True when reading a ring created in this process"""
+    def __init__(self, name=DEFAULT_NAME, from_start=False, same_process=False):
+        super(SharedMemoryRingReader, self).__init__()
+        self.shm = shared_memory.SharedMemory(name=name) if same_process else _attach(name)
+
+        header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=self.shm.buf)
+        if header[H_MAGIC] != MAGIC or header[H_VERSION] != VERSION:
+            self.shm.close()
+            raise ValueError("Shared memory '%s' is not an Ultraviz ring" % name)
+        self.capacity = int(header[H_CAPACITY])
+        self.width = int(header[H_WIDTH])
+        self.header, self.times, self.points = _views(self.shm.buf, self.capacity, self.width)
+
+        # Rows consumed so far, and rows skipped because we fell too far behind
+        written = int(self.header[H_WRITTEN])
+        self.position = max(0, written - self.capacity) if from_start else written
+        self.dropped = 0
+        self._lastStart = self.position
+
+    def available(self):
+        return int(self.header[H_WRITTEN]) - self.position
+
+    def read(self, max_rows=None):
+        """Returns (times, points) views of rows written since the last read"""
+        written = int(self.header[H_WRITTEN])
+        if written - self.position > self.capacity:
+            self.dropped += written - self.capacity - self.position
+            self.position = written - self.capacity
+        n = written - self.position
+        if max_rows is not None:
+            n = min(n, max_rows)
+
+        start = self.position % self.capacity
+        self._lastStart = self.position
+        self.position += n
+        return self.times[start:start + n], self.points[start:start + n]
+
+    def intact(self):
+        """True if the rows returned by the last read haven't since been overwritten,
+        or started to be"""
+        return int(self.header[H_WRITING]) - self._lastStart <= self.capacity
+
+    def close(self):
+        self.header = self.times = self.points = None
+        self.shm.close()
+
+def _ownerRunning(pid):
+    if sys.platform == 'win32':
+        # Windows frees a block once no process has it open, so it can't be left behind
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _removeStale(name):
+    """Unlink a ring left behind by an Ultraviz which didn't exit cleanly,
+    raising FileExistsError if the block is in use or not a ring"""
+    existing = shared_memory.SharedMemory(name=name)
+    try:
+        magic = version = owner = 0
+        if existing.size >= HEADER_WORDS * 8:
+            header = np.ndarray((HEADER_WORDS,), dtype=np.uint64, buffer=existing.buf)
+            magic, version, owner = int(header[H_MAGIC]), int(header[H_VERSION]), int(header[H_OWNER])
+            del header
+    finally:
+        existing.close()
+
+    error = None
+    if magic != MAGIC:
+        error = "Shared memory '%s' exists and is not an Ultraviz ring" % name
+    elif version < 2:
+        error = "Shared memory '%s' is a ring from an older Ultraviz, remove it if that isn't running" % name
+    elif _ownerRunning(owner):
+        error = "Shared memory '%s' is in use by process %d" % (name, owner)
+    if error is None:
+        existing.unlink()
+        return
+    # Attaching registered the block with this process's resource tracker,
+    # unless it is this process's own
+    if owner != os.getpid():
+        _untrack(existing)
+    raise FileExistsError(error)
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name=name)
+    _untrack(shm)
+    return shm
+
+def _untrack(shm):
+    # Before Python 3.13 attaching also registers the block with this process's
+    # resource tracker, which would unlink it when the process exits.
+    if sys.version_info < (3, 13):
+        try:
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(shm._name, 'shared_memory')
+        except Exception:
+            pass
+
+
+if __name__ == '__main__':
+    # A minimal client: report the rate of rows arriving from a running Ultraviz
+    import time
+    name = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_NAME
+    reader = SharedMemoryRingReader(name)
+    print("Reading '%s' (capacity %d rows)" % (name, reader.capacity))
+    count = 0
+    start = time.monotonic()
+    try:
+        while True:
+            times, points = reader.read()
+            count += len(times)
+            now = time.monotonic()
+            if now - start >= 1.0:
+                print("%8d rows/s, %d dropped, last %s" % (count / (now - start), reader.dropped,
+                                                            points[-1].tolist() if len(points) else '-'))
+                count = 0
+                start = now
+            time.sleep(0.001)
+    except KeyboardInterrupt:
+        reader.close()
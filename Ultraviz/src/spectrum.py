@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+"""
+# Sliding-window spectral analysis of control point intensity and position,
+# to check the modulation frequency of a sensation.
+----------------------------------------------------------
+Samples are split by control point, and a Hann-windowed rfft is taken of
+X, Y, Z and intensity together once every 'hop' new samples. All of the
+frames completed by a batch are transformed in a single rfft call.
+
+ControlPointSpectra is fed parsed batches by a stream bus subscriber which
+drops the oldest batches when it falls behind. After a drop every frame
+is started afresh, so frames are only ever built from contiguous samples;
+the widget only draws snapshots of it.
+"""
+import threading
+import numpy as np
+
+try:
+    import pyqtgraph as pg
+    from PyQt5.QtWidgets import QWidget, QVBoxLayout, QHBoxLayout, QLabel, QComboBox
+    from PyQt5.QtCore import QTimer
+except Exception as e:
+    print("Exception on thirdparty import: " + str(e))
+    print("*** WARNING: Unable to import dependencies. Please install via:\n\n pip3 install --user pyqt5 pyqtgraph \n")
+
+CHANNEL_NAMES = ('x', 'y', 'z', 'intensity')
+
+# Spectral analysis of the X-Y-Z-I channels of one control point
+class SlidingSpectrum(object):
+    def __init__(self, window_size=1024, hop=256, history=256, channels=4):
+        self.windowSize = window_size
+        self.hop = hop
+        self.channels = channels
+        self.window = np.hanning(window_size).astype(np.float32)
+        self.bins = window_size // 2 + 1
+
+        # The most recent window_size samples, and how many arrived since the last frame
+        self._times = np.zeros(0)
+        self._samples = np.zeros((0, channels), dtype=np.float32)
+        self._sinceLastFrame = 0
+
+        # Latest (channels, bins) magnitudes, their frequencies and the strongest frequency per channel
+        self.magnitude = np.zeros((channels, self.bins), dtype=np.float32)
+        self.frequencies = np.zeros(self.bins)
+        self.dominant = np.zeros(channels)
+        self.sampleRate = 0.0
+
+        # Ring of (history, channels, bins) magnitudes for a spectrogram
+        self.spectrogram = np.zeros((history, channels, self.bins), dtype=np.float32)
+        self.spectrogramIndex = 0
+
+    def add(self, times, samples):
+        """Add samples, returning True if any new frames were computed"""
+        times = np.concatenate((self._times, times))
+        samples = np.concatenate((self._samples, samples))
+        self._sinceLastFrame += len(samples) - len(self._samples)
+
+        # End index of each frame completed by this batch, which has a whole window
+        frames = self._sinceLastFrame // self.hop
+        ends = len(samples) - self._sinceLastFrame + self.hop * np.arange(1, frames + 1)
+        self._sinceLastFrame -= frames * self.hop
+        ends = ends[ends >= self.windowSize]
+
+        self._times = times[-self.windowSize:]
+        self._samples = samples[-self.windowSize:]
+        if len(ends) == 0:
+            return False
+
+        # (frames, windowSize, channels), with the mean of each frame removed
+        index = ends[:, None] + np.arange(-self.windowSize, 0)
+        framed = samples[index]
+        framed = framed - framed.mean(axis=1, keepdims=True)
+        spectra = np.abs(np.fft.rfft(framed * self.window[None, :, None], axis=1))
+        spectra = np.transpose(spectra, (0, 2, 1)).astype(np.float32)
+
+        duration = times[ends[-1] - 1] - times[ends[-1] - self.windowSize]
+        if duration > 0:
+            self.sampleRate = (self.windowSize - 1) / duration
+            self.frequencies = np.fft.rfftfreq(self.windowSize, 1.0 / self.sampleRate)
+
+        # Skip the DC bin, and report 0 Hz for a channel which isn't changing
+        self.magnitude = spectra[-1]
+        self.dominant = self.frequencies[1 + np.argmax(self.magnitude[:, 1:], axis=1)]
+        self.dominant[self.magnitude[:, 1:].max(axis=1) == 0] = 0.0
+
+        # Only the newest frames fit in the spectrogram
+        spectra = spectra[-len(self.spectrogram):]
+        slots = (self.spectrogramIndex + np.arange(len(spectra))) % len(self.spectrogram)
+        self.spectrogram[slots] = spectra
+        self.spectrogramIndex = (slots[-1] + 1) % len(self.spectrogram)
+        return True
+
+    def restart(self):
+        """Forget the samples of the frame in progress, e.g. after samples were lost"""
+        self._times = self._times[:0]
+        self._samples = self._samples[:0]
+        self._sinceLastFrame = 0
+
+    def orderedSpectrogram(self, channel):
+        """Returns the (history, bins) spectrogram of a channel, oldest first"""
+        return np.roll(self.spectrogram[:, channel], -self.spectrogramIndex, axis=0)
+
+
+# Routes X-Y-Z-I-ID rows to a SlidingSpectrum per control point. Rows are
+# added on a bus thread while the GUI takes snapshots, so both hold the lock.
+class ControlPointSpectra(object):
+    def __init__(self, window_size=1024, hop=256, history=256):
+        self.windowSize = window_size
+        self.hop = hop
+        self.history = history
+        self.spectra = {}
+        self._lock = threading.Lock()
+
+    def add(self, times, points):
+        ids = points[:, 4].astype(np.int32)
+        with self._lock:
+            for cp in np.unique(ids).tolist():
+                if cp not in self.spectra:
+                    self.spectra[cp] = SlidingSpectrum(self.windowSize, self.hop, self.history)
+                rows = ids == cp
+                self.spectra[cp].add(times[rows], points[rows, 0:4])
+
+    def restart(self):
+        """Start every control point's next frame afresh, keeping the spectra so far"""
+        with self._lock:
+            for spectrum in self.spectra.values():
+                spectrum.restart()
+
+    def controlPoints(self):
+        with self._lock:
+            return sorted(self.spectra.keys())
+
+    def snapshot(self, cp, channel):
+        """Copies of (frequencies, magnitude, dominant frequency, sample rate,
+        ordered spectrogram) for one channel of a control point, or None"""
+        with self._lock:
+            spectrum = self.spectra.get(cp)
+            if spectrum is None or spectrum.sampleRate == 0:
+                return None
+            return (spectrum.frequencies.copy(), spectrum.magnitude[channel].copy(), float(spectrum.dominant[channel]),
+                    spectrum.sampleRate, spectrum.orderedSpectrogram(channel))
+
+    def clear(self):
+        with self._lock:
+            self.spectra = {}
+
+
+class SpectrumWidget(QWidget):
+    REFRESH_INTERVAL = 50
+
+    def __init__(self, analysis, parent=None):
+        super(SpectrumWidget, self).__init__(parent)
+
+        # The ControlPointSpectra to show, fed by the stream bus
+        self.analysis = analysis
+
+        self.controlPointBox = QComboBox()
+        self.channelBox = QComboBox()
+        self.channelBox.addItems(CHANNEL_NAMES)
+        self.channelBox.setCurrentIndex(3)
+        self.dominantLabel = QLabel("Dominant: -")
+
+        self.spectrumPlot = pg.PlotWidget()
+        self.spectrumPlot.setLabel('bottom', 'frequency', units='Hz')
+        self.spectrumPlot.setLabel('left', 'magnitude')
+        self.spectrumCurve = self.spectrumPlot.plot(pen=pg.mkPen((0, 207, 117), width=1))
+
+        self.spectrogramPlot = pg.PlotWidget()
+        self.spectrogramPlot.setLabel('left', 'frequency', units='Hz')
+        self.spectrogramImage = pg.ImageItem()
+        self.spectrogramPlot.addItem(self.spectrogramImage)
+
+        controls = QHBoxLayout()
+        controls.addWidget(QLabel("Control point"))
+        controls.addWidget(self.controlPointBox)
+        controls.addWidget(self.channelBox)
+        controls.addWidget(self.dominantLabel)
+        controls.addStretch()
+
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(controls)
+        layout.addWidget(self.spectrumPlot)
+        layout.addWidget(self.spectrogramPlot)
+        self.setLayout(layout)
+
+        self.refreshTimer = QTimer()
+        self.refreshTimer.timeout.connect(self.refresh)
+        self.refreshTimer.start(self.REFRESH_INTERVAL)
+
+    def refresh(self):
+        if not self.isVisible():
+            return
+
+        ids = self.analysis.controlPoints()
+        if self.controlPointBox.count() != len(ids):
+            current = self.controlPointBox.currentText()
+            self.controlPointBox.clear()
+            self.controlPointBox.addItems([str(cp) for cp in ids])
+            if current:
+                self.controlPointBox.setCurrentText(current)
+        if not ids:
+            return
+
+        channel = self.channelBox.currentIndex()
+        snapshot = self.analysis.snapshot(int(self.controlPointBox.currentText() or ids[0]), channel)
+        if snapshot is None:
+            return
+        frequencies, magnitude, dominant, sampleRate, spectrogram = snapshot
+        self.spectrumCurve.setData(x=frequencies, y=magnitude)
+        self.dominantLabel.setText("Dominant: %.1f Hz (rate %.0f Hz)" % (dominant, sampleRate))
+
+        image = np.log10(spectrogram + 1e-6)
+        self.spectrogramImage.setImage(image, autoLevels=True)
+        self.spectrogramImage.setRect(pg.QtCore.QRectF(0, 0, len(image), frequencies[-1]))
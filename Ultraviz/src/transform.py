@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+# Device to world coordinate transform for control points.
+----------------------------------------------------------
+Control points are logged in the array's device space, in metres, with Z
+pointing up away from the array. A single 4x4 transform, built from an axis
+permutation, scale, rotation and offset, maps them to the world space used
+by the 3D view and sent to WebSocket clients. It is applied to whole
+batches with one NumPy matrix product.
+"""
+import numpy as np
+
+# Transducer layout of each array model: (columns, rows, pitch in metres).
+# The device origin is the centre of the array, and for the circular Inspire
+# layout these give its bounding square.
+ARRAY_MODELS = {
+    'stratos_explore': (16, 16, 0.0105),
+    'stratos_inspire': (16, 16, 0.0105),
+}
+
+def arraySize(model):
+    """(width, depth) in metres of an array model's transducer area"""
+    if model not in ARRAY_MODELS:
+        raise ValueError("Unknown array model '%s', choose from: %s" % (model, ", ".join(sorted(ARRAY_MODELS))))
+    columns, rows, pitch = ARRAY_MODELS[model]
+    return columns * pitch, rows * pitch
+
+def arrayCornerPreset(model, scale=10.0):
+    """Parameters placing the world origin at the array's front-left corner,
+    so the array covers world x in [0, width] and y in [0, depth] (times scale)"""
+    width, depth = arraySize(model)
+    return {'scale': scale, 'offset': (scale * width / 2.0, scale * depth / 2.0, 0.0)}
+
+# Named sets of transform parameters (see CoordinateTransform.fromParameters).
+# 'default' matches the scaling the 3D view has always used. The array
+# placements describe how the array is mounted relative to the world, and
+# each array model has a preset with the origin at the corner of its array.
+TRANSFORM_PRESETS = {
+    'default':        {'scale': 10.0},
+    'metres':         {'scale': 1.0},
+    'millimetres':    {'scale': 1000.0},
+    # Array lying flat, facing up (the device space itself)
+    'array_up':       {'scale': 10.0},
+    # Array mounted vertically, facing the user along world -Y
+    'array_facing':   {'scale': 10.0, 'rotation': (90.0, 0.0, 0.0)},
+    # Array mounted overhead, facing down
+    'array_down':     {'scale': 10.0, 'rotation': (180.0, 0.0, 0.0), 'offset': (0.0, 0.0, 5.0)},
+}
+TRANSFORM_PRESETS.update({model: arrayCornerPreset(model) for model in ARRAY_MODELS})
+
+AXES = {'x': 0, 'y': 1, 'z': 2}
+
+def permutationMatrix(axes):
+    """3x3 matrix taking device axes to world axes, e.g. 'x,z,-y' gives
+    world x = device x, world y = device z, world z = -device y"""
+    names = [axis.strip().lower() for axis in axes.split(',')] if isinstance(axes, str) else list(axes)
+    if len(names) != 3:
+        raise ValueError("Axes need three entries, e.g. 'x,z,-y': %s" % axes)
+    matrix = np.zeros((3, 3))
+    for row, name in enumerate(names):
+        sign = -1.0 if name.startswith('-') else 1.0
+        if name.lstrip('+-') not in AXES:
+            raise ValueError("Unknown axis '%s' in '%s', choose from: %s (optionally prefixed with -)" % (name, axes, ", ".join(sorted(AXES))))
+        matrix[row, AXES[name.lstrip('+-')]] = sign
+    if sorted(np.abs(matrix).argmax(axis=1)) != [0, 1, 2]:
+        raise ValueError("Axes must use each of x, y and z once: %s" % axes)
+    return matrix
+
+def rotationMatrix(degrees):
+    """3x3 matrix rotating by (x, y, z) Euler angles in degrees, applied in x, y, z order"""
+    rx, ry, rz = np.radians(degrees)
+    cx, sx, cy, sy, cz, sz = np.cos(rx), np.sin(rx), np.cos(ry), np.sin(ry), np.cos(rz), np.sin(rz)
+    x = np.array([[1, 0, 0], [0, cx, -sx], [0, sx, cx]])
+    y = np.array([[cy, 0, sy], [0, 1, 0], [-sy, 0, cy]])
+    z = np.array([[cz, -sz, 0], [sz, cz, 0], [0, 0, 1]])
+    return z.dot(y).dot(x)
+
+
+class CoordinateTransform(object):
+    def __init__(self, matrix=None):
+        super(CoordinateTransform, self).__init__()
+        self.matrix = np.identity(4) if matrix is None else np.asarray(matrix, dtype=np.float64)
+        self._update()
+
+    @classmethod
+    def fromParameters(cls, scale=1.0, axes='x,y,z', rotation=(0.0, 0.0, 0.0), offset=(0.0, 0.0, 0.0)):
+        """world = offset + rotation * scale * permutation * device"""
+        matrix = np.identity(4)
+        matrix[0:3, 0:3] = rotationMatrix(rotation).dot(scale * permutationMatrix(axes))
+        matrix[0:3, 3] = offset
+        return cls(matrix)
+
+    @classmethod
+    def fromPreset(cls, name, **overrides):
+        """A preset from TRANSFORM_PRESETS, with any parameters replaced by overrides which aren't None"""
+        if name not in TRANSFORM_PRESETS:
+            raise ValueError("Unknown transform preset: %s" % name)
+        parameters = dict(TRANSFORM_PRESETS[name])
+        # Keep the origin on the array's corner when an array model preset is rescaled
+        if name in ARRAY_MODELS and overrides.get('scale') is not None:
+            parameters.update(arrayCornerPreset(name, overrides['scale']))
+        parameters.update({key: value for key, value in overrides.items() if value is not None})
+        return cls.fromParameters(**parameters)
+
+    def _update(self):
+        # Kept transposed and in float32 to apply to (N,3) rows directly
+        self._linear = self.matrix[0:3, 0:3].T.astype(np.float32)
+        self._offset = self.matrix[0:3, 3].astype(np.float32)
+
+    def apply(self, points):
+        """Returns a copy of (N,>=3) rows with columns 0-2 transformed; other columns are unchanged"""
+        world = np.array(points, dtype=np.float32)
+        if len(world):
+            world[:, 0:3] = world[:, 0:3].dot(self._linear) + self._offset
+        return world
+
+    def __repr__(self):
+        return "CoordinateTransform(%s)" % self.matrix.tolist()
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+# Oscilloscope-style trigger capture of control point data.
+----------------------------------------------------------
+Trigger conditions are evaluated over each whole batch of samples with NumPy.
+When one fires, the samples before and after it are kept as a capture, in
+memory and optionally in a capture file, so that rare glitches survive
+long after they have left the live point buffer.
+
+Modes:
+  single - capture once, then wait until re-armed
+  normal - re-arm after every capture
+  auto   - as normal, but also capture if nothing triggers for auto_timeout seconds
+"""
+import re
+import threading
+import collections
+import numpy as np
+
+from buffer import TimestampedBuffer
+from capture import saveCapture, captureFileName
+
+COLUMNS = {'x': 0, 'y': 1, 'z': 2, 'intensity': 3, 'i': 3}
+
+# Fires when a column crosses (or is beyond) a level
+class ThresholdTrigger(object):
+    OPERATORS = {'<': np.less, '<=': np.less_equal, '>': np.greater, '>=': np.greater_equal}
+
+    def __init__(self, column, operator, level):
+        self.column = column
+        self.operator = operator
+        self.level = level
+        self._compare = self.OPERATORS[operator]
+
+    def evaluate(self, times, points):
+        return self._compare(points[:, self.column], self.level)
+
+    def __repr__(self):
+        return "ThresholdTrigger(column=%d %s %g)" % (self.column, self.operator, self.level)
+
+# Fires when a control point leaves an axis-aligned workspace box
+class OutsideWorkspaceTrigger(object):
+    def __init__(self, lower, upper):
+        self.lower = np.asarray(lower, dtype=np.float32)
+        self.upper = np.asarray(upper, dtype=np.float32)
+
+    def evaluate(self, times, points):
+        xyz = points[:, 0:3]
+        return ((xyz < self.lower) | (xyz > self.upper)).any(axis=1)
+
+    def __repr__(self):
+        return "OutsideWorkspaceTrigger(%s, %s)" % (self.lower.tolist(), self.upper.tolist())
+
+def parseTrigger(spec):
+    """Create a trigger from a command line spec, e.g. 'intensity<=0', 'z>0.3'
+    or 'outside:xmin,ymin,zmin,xmax,ymax,zmax' (device units, metres)."""
+    spec = spec.replace(' ', '')
+    if spec.startswith('outside:'):
+        bounds = [float(value) for value in spec[len('outside:'):].split(',')]
+        if len(bounds) != 6:
+            raise ValueError("Workspace trigger needs 6 bounds: %s" % spec)
+        return OutsideWorkspaceTrigger(bounds[0:3], bounds[3:6])
+    match = re.match(r'^(x|y|z|intensity|i)(<=|>=|<|>)(-?[0-9.]+)$', spec)
+    if not match:
+        raise ValueError("Unrecognised trigger: %s" % spec)
+    return ThresholdTrigger(COLUMNS[match[1]], match[2], float(match[3]))
+
+
+class TriggerCapture(object):
+    MODES = ('single', 'normal', 'auto')
+
+    def __init__(self, conditions, mode='normal', pre=1000, post=1000, width=5,
+                 capture_dir=None, max_captures=100, auto_timeout=1.0):
+        super(TriggerCapture, self).__init__()
+
+        if mode not in self.MODES:
+            raise ValueError("Unknown trigger mode: %s" % mode)
+        if pre < 0 or post < 0:
+            raise ValueError("Pre- and post-trigger sample counts can't be negative: %d, %d" % (pre, post))
+        self.conditions = list(conditions)
+        self.mode = mode
+        self.pre = pre
+        self.post = post
+        self.captureDir = capture_dir
+        self.autoTimeout = auto_timeout
+
+        # Completed captures as (trigger time, times, points), oldest dropped first
+        self.captures = collections.deque(maxlen=max_captures)
+        self.armed = True
+
+        # Samples preceding the next trigger
+        self._history = TimestampedBuffer(size=max(pre, 1), width=width)
+        self._capture = None
+        self._lastCaptureTime = None
+        self.captureCount = 0
+
+    def arm(self):
+        self.armed = True
+
+    def add(self, times, points, filtered=None):
+        """Evaluate the triggers over a batch and continue any capture in progress.
+
+        If filtered rows are given (with width=8), their X-Y-Z is kept after
+        each row's X-Y-Z-I-ID, and saved in capture files as 'filtered'.
+        """
+        n = len(times)
+        if n == 0:
+            return
+        if filtered is not None:
+            points = np.column_stack((points, np.asarray(filtered)[:, 0:3]))
+        if self._lastCaptureTime is None:
+            self._lastCaptureTime = times[0]
+
+        fired = np.zeros(n, dtype=bool)
+        for condition in self.conditions:
+            fired |= condition.evaluate(times, points)
+        hits = np.flatnonzero(fired)
+
+        pos = 0
+        while pos < n:
+            if self._capture is not None:
+                pos = self._continueCapture(times, points, pos)
+            elif self.armed:
+                later = hits[hits >= pos]
+                if len(later):
+                    pos = self._startCapture(times, points, later[0])
+                elif self.mode == 'auto' and times[-1] - self._lastCaptureTime > self.autoTimeout:
+                    pos = self._startCapture(times, points, n - 1)
+                else:
+                    break
+            else:
+                break
+
+        self._history.record(points, times)
+
+    def _startCapture(self, times, points, index):
+        heldTimes, heldPoints = self._history.latest()
+        preTimes = np.concatenate((heldTimes, times[:index]))[-self.pre:] if self.pre else times[:0]
+        prePoints = np.concatenate((heldPoints, points[:index]))[-self.pre:] if self.pre else points[:0]
+        self._capture = {'triggerTime': times[index], 'times': [preTimes], 'points': [prePoints], 'remaining': self.post}
+        self.armed = False
+        if self.post == 0:
+            # Nothing follows, so finish now, and move past the trigger so it can't fire again
+            self._finishCapture()
+            return index + 1
+        return index
+
+    def _continueCapture(self, times, points, pos):
+        capture = self._capture
+        end = min(len(times), pos + capture['remaining'])
+        capture['times'].append(times[pos:end])
+        capture['points'].append(points[pos:end])
+        capture['remaining'] -= end - pos
+        if capture['remaining'] == 0:
+            self._finishCapture()
+        return end
+
+    def _finishCapture(self):
+        capture = self._capture
+        self._capture = None
+        times = np.concatenate(capture['times'])
+        points = np.concatenate(capture['points'])
+        self.captures.append((capture['triggerTime'], times, points))
+        self._lastCaptureTime = times[-1] if len(times) else capture['triggerTime']
+        self.captureCount += 1
+        print("Trigger capture at %.6f (%d samples)" % (capture['triggerTime'], len(times)))
+
+        if self.captureDir:
+            path = captureFileName(self.captureDir, self.captureCount)
+            # Don't hold up the log reader while writing to disk
+            metadata = {'trigger_time': capture['triggerTime']}
+            if points.shape[1] >= 8:
+                metadata['filtered'] = points[:, 5:8]
+            writer = threading.Thread(target=saveCapture, args=(path, times, points[:, 0:5]), kwargs=metadata)
+            writer.daemon = True
+            writer.start()
+
+        if self.mode != 'single':
+            self.armed = True
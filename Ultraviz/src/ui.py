@@ -12,14 +12,45 @@ except Exception as e:
     print("Exception on thirdparty import: " + str(e))
     print("*** WARNING: Unable to import dependencies. Please install via:\n\n pip3 install --user pyqt5 pyqtgraph numpy PyOpenGL atom \n")
 
-from buffer import CircularBuffer
+from buffer import TimestampedBuffer
+from history import HistoryPyramid
+from colormaps import RenderAttributes, COLOR_MODES
+from picking import PointIndex
 
 class UHSDKLogViewer(QWidget):
 
-    def __init__(self, exe_path=None, auto_launch=False):
+    def __init__(self, exe_path=None, auto_launch=False, window_ms=None, buffer_size=512,
+                 color_mode='intensity', colormap='white', split_view=False):
         super(UHSDKLogViewer, self).__init__()
 
-        self.pointBuffer = CircularBuffer(size=512)
+        # Rows of X-Y-Z-Intensity-ControlPointID
+        self.pointBuffer = TimestampedBuffer(size=buffer_size, width=5)
+
+        # Each sample's deviation from the reference capture, recorded alongside
+        # pointBuffer so the two stay in step
+        self.deviationBuffer = TimestampedBuffer(size=buffer_size, width=1)
+        self.hasReference = False
+
+        # Runs of log lines without a control point, as [line count, duration] rows
+        self.gapBuffer = TimestampedBuffer(size=4096, width=2)
+
+        # Spatial index over the point buffer, for picking samples in the 3D view
+        self.pointIndex = PointIndex(self.pointBuffer)
+
+        # Downsampled history of the session per control point, for browsing
+        # back in time. Nothing reads it yet, so it is only created, and
+        # samples only recorded, once enableHistory() is called.
+        self.history = None
+
+        # If set, only plot samples from the last windowMs milliseconds,
+        # otherwise plot everything held in the buffer
+        self.windowMs = window_ms
+
+        # Frames uploaded to the 3D view, only written by the GUI thread
+        self.framesRendered = 0
+
+        # Colour/size mapping, computed on the thread which records new points
+        self.renderAttributes = RenderAttributes(buffer_size, color_mode=color_mode, colormap=colormap)
 
         self.painterThreadTimer = QTimer()
         self.painterThreadTimer.timeout.connect(self.updatePlot)
@@ -35,9 +66,9 @@ class UHSDKLogViewer(QWidget):
         self.plot3D = Scatter3DPlot(pos=pos, size=size, color=color)
         self.scene3D = Scatter3DScene(plot=self.plot3D)
         self.scene3D._widget.setMinimumSize(QSize(500, 700))
-        
-        # Scaling of control point space
-        self._scaling = 10
+
+        # Perspective, top, front and side views in one widget. Press V to toggle.
+        self.scene3D.setSplitView(split_view)
 
         # Build UI
         self.createUI()
@@ -48,20 +79,81 @@ class UHSDKLogViewer(QWidget):
         mainLayout.addWidget(self.scene3D._widget)
         self.setLayout(mainLayout)
     
+    def getPlotPoints(self):
+        if self.windowMs:
+            return self.pointBuffer.window(self.windowMs / 1000.0)
+        return self.pointBuffer.latest()
+
+    def updateRenderAttributes(self):
+        times, pts = self.getPlotPoints()
+        deviations = self.deviationBuffer.latest(len(times))[1][:, 0] if self.hasReference else None
+        return self.renderAttributes.update(times, pts, deviations=deviations)
+
     def updatePlot(self):
-        if len(self.pointBuffer[:])>0:
-            pts = np.array(self.pointBuffer[:])
-            intensity = pts[:,3]
-            color = np.ones((pts.shape[0], 4))
-            color[:,3] = intensity
-            self.plot3D._plot.setData(pos=pts[:,0:3], color=color, size=10*intensity)
-
-    def setControlPointsFromFromRegexMatch(self, match):
-        if (match):
-            pts = [self._scaling*float(match[1]),
-                   self._scaling*float(match[2]),
-                   self._scaling*float(match[3]),
-                   float(match[4])]
-            self.pointBuffer.record(pts)
+        frame = self.renderAttributes.acquire()
+        if frame is None and self.renderAttributes.stale:
+            # Nothing new has been recorded since the last set was made, so
+            # the latest points (or colour mode) haven't been mapped yet
+            self.updateRenderAttributes()
+            frame = self.renderAttributes.acquire()
+        if frame is None:
+            return
+        pos, color, size = frame
+        if len(pos)>0:
+            self.plot3D.setData(pos=pos, color=color, size=size)
+            self.framesRendered += 1
+
+    def cycleColorMode(self):
+        modes = [mode for mode in COLOR_MODES if mode != 'deviation' or self.hasReference]
+        current = self.renderAttributes.colorMode
+        mode = modes[(modes.index(current) + 1) % len(modes)] if current in modes else modes[0]
+        self.renderAttributes.setColorMode(mode)
+        return mode
+
+    # Overlay a reference capture's X-Y-Z rows, in world coordinates, or remove it if None
+    def setReference(self, points):
+        if points is None:
+            self.hasReference = False
+            self.scene3D.clearReference()
+            if self.renderAttributes.colorMode == 'deviation':
+                self.renderAttributes.setColorMode('intensity')
         else:
-            self.pointBuffer.record([0.0,0.0,0.0,0.0])
+            self.scene3D.setReference(np.asarray(points, dtype=np.float32)[:, 0:3])
+            self.hasReference = True
+            self.renderAttributes.setColorMode('deviation')
+
+    # Record a batch of timestamped X-Y-Z-I-ID rows, in world coordinates, and
+    # optionally each row's deviation from the reference capture
+    def setControlPointsWithTimes(self, points, times, deviations=None):
+        pts = np.asarray(points, dtype=np.float32)
+        self.pointBuffer.record(pts, times)
+        self.deviationBuffer.record(np.zeros(len(pts)) if deviations is None else deviations, times)
+        self.pointIndex.update(len(pts))
+        if self.history is not None:
+            self.history.record(times, pts)
+        self.updateRenderAttributes()
+
+    # Start recording the downsampled session history, returning it
+    def enableHistory(self, **kwargs):
+        if self.history is None:
+            self.history = HistoryPyramid(width=5, id_column=4, **kwargs)
+        return self.history
+
+    # The plotted sample nearest a ray from the 3D view, as a dict, or None
+    def pickSample(self, origin, direction, pixel_angle):
+        since = None
+        latest = self.pointBuffer.last_time()
+        if self.windowMs and latest is not None:
+            since = latest - self.windowMs / 1000.0
+        slot = self.pointIndex.pick(origin, direction, pixel_angle, since=since)
+        if slot is None:
+            return None
+        times, rows = self.pointBuffer.slots(slot, slot + 1)
+        x, y, z, intensity, controlPoint = rows[0]
+        time = times[0]
+        return {'x': x, 'y': y, 'z': z, 'intensity': intensity, 'controlPoint': int(controlPoint),
+                'time': time, 'age': (latest - time) * 1000.0}
+
+    # Record timestamped runs of log lines which had no control point
+    def setGaps(self, times, gaps):
+        self.gapBuffer.record(gaps, times)
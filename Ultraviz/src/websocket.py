@@ -1,5 +1,6 @@
 # Requirement: pip3 install SimpleWebSocketServer
 from SimpleWebSocketServer import SimpleWebSocketServer, WebSocket
+import json
 import socket
 
 # TODO: Get away from horrible Global 'clients' !
@@ -28,4 +29,25 @@ def createWebSocketServer():
     return SimpleWebSocketServer("", 9000, SimpleWSServer, selectInterval=(1000.0 / 15) / 1000)
 
 def get_clients():
-    return clients
\ No newline at end of file
+    return clients
+
+def encodePoints(points, times=None, raw=None):
+    """One JSON message per (N,>=3) row of points. If times are given, each row's is sent as 't',
+    and if raw (unfiltered) rows are given, each is sent as 'raw'"""
+    msgs = []
+    for i, point in enumerate(points):
+        msg = {'x': float(point[0]), 'y': float(point[1]), 'z': float(point[2])}
+        if times is not None:
+            msg['t'] = float(times[i])
+        if raw is not None:
+            msg['raw'] = {'x': float(raw[i][0]), 'y': float(raw[i][1]), 'z': float(raw[i][2])}
+        msgs.append(json.dumps(msg))
+    return msgs
+
+def broadcast(msgs):
+    """Send every message to every connected client. Returns the number of clients sent to"""
+    targets = list(clients)
+    for client in targets:
+        for msg in msgs:
+            client.sendMessage(msg)
+    return len(targets)